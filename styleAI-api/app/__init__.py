@@ -5,8 +5,6 @@ import sys
 from dotenv import load_dotenv
 import logging
 import threading
-import importlib.util
-import platform
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -34,11 +32,9 @@ def create_app():
         os.makedirs(temp_dir)
         logger.info(f"创建临时目录: {temp_dir}")
     
-    # 检查Python版本和必要的依赖是否已安装
-    check_environment()
-    
-    # 在后台线程中预加载算法模块和模型
-    threading.Thread(target=preload_resources, daemon=True).start()
+    # 在后台线程中预加载算法模块和模型(MODEL_PRELOAD=0时在第一个需要模型的请求到达时加载)
+    if os.environ.get('MODEL_PRELOAD', '1') != '0':
+        threading.Thread(target=preload_resources, daemon=True).start()
     
     # Register blueprints
     from app.routes.personalized import personalized_bp
@@ -50,37 +46,14 @@ def create_app():
         """Health check endpoint"""
         return jsonify({"status": "ok"})
     
-    return app
-
-def check_environment():
-    """检查Python版本和必要的依赖是否已安装"""
-    # 检查Python版本
-    python_version = platform.python_version()
-    logger.info(f"Python版本: {python_version}")
-    
-    # 检查必要的依赖是否已安装
-    required_packages = {
-        'transformers': None,  # None表示不要求特定版本
-        'torch': None,
-        'scikit-learn': None
-    }
+    @app.route('/ready')
+    def ready_check():
+        """就绪检查：模型资源加载完成时返回200，否则返回503及加载状态"""
+        from app.utils import preload
+        status = preload.get_status()
+        return jsonify(status), 200 if status['ready'] else 503
     
-    missing_packages = []
-    installed_packages = []
-    
-    for package, version in required_packages.items():
-        if importlib.util.find_spec(package) is None:
-            missing_packages.append(package)
-        else:
-            installed_packages.append(package)
-    
-    if missing_packages:
-        logger.warning(f"以下依赖包未安装: {', '.join(missing_packages)}")
-        logger.warning(f"请使用以下命令安装: pip install {' '.join(missing_packages)}")
-        logger.warning("某些功能可能受限")
-    
-    if installed_packages:
-        logger.info(f"已安装的依赖包: {', '.join(installed_packages)}")
+    return app
 
 def preload_resources():
     """在后台线程中预加载资源"""
@@ -97,7 +70,7 @@ def preload_resources():
         try:
             from app.utils import preload
             
-            # 初始化预加载
+            # 初始化预加载(每个进程只加载一次，请求处理函数会等待这次加载)
             preload.initialize()
             
             logger.info("资源预加载完成")
@@ -4,8 +4,8 @@ import time
 import logging
 import os
 import sys
-import importlib.util
 import json
+import math
 from app.utils.db import get_job_by_id, update_job_description, update_job_best_fit
 from app.utils.image_utils import save_image_from_buffer, buffer_to_base64, cleanup_temp_files
 from app.utils.style_matching import find_best_match_image, generate_outfit_image
@@ -83,16 +83,60 @@ MOCK_ANALYSIS_DATA = {
 def safe_import_preload():
     """安全导入预加载模块"""
     try:
-        if importlib.util.find_spec('app.utils.preload') is not None:
-            from app.utils import preload
-            return preload
-        else:
-            logger.warning("预加载模块不可用")
-            return None
+        from app.utils import preload
+        return preload
     except ImportError as e:
         logger.error(f"导入预加载模块失败: {str(e)}")
         return None
 
+# 模型资源未就绪时的响应
+def models_not_ready_response(preload, job_id):
+    """
+    模型资源在MODEL_READY_TIMEOUT秒内未就绪时返回503，客户端按Retry-After重试；
+    加载失败时Retry-After为距离重新加载的退避时间
+    """
+    status = preload.get_status()
+    logger.warning(f"模型资源未就绪，状态: {status['state']}，jobId: {job_id}")
+    response = jsonify({
+        "status": "error",
+        "jobId": job_id,
+        "error": "模型资源加载中，请稍后重试" if status['state'] != 'failed' else f"模型资源加载失败: {status['error']}",
+        "model_state": status['state']
+    })
+    retry_in = status.get('retry_in')
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_in))) if retry_in is not None else '5'
+    return response, 503
+
+# 检查请求中的筛选条件
+def valid_filters(filters):
+    """filters缺省或为字符串、字符串列表时有效"""
+    if filters is None or isinstance(filters, str):
+        return True
+    return isinstance(filters, list) and all(isinstance(clause, str) for clause in filters)
+
+# 筛选条件相关的异常
+def filter_exceptions(preload):
+    """
+    find_best_match_image抛出的筛选条件异常类型，catalog_filters不可用时为空元组
+    """
+    catalog_filters = preload.import_module('catalog_filters')
+    if catalog_filters is None:
+        return ()
+    return (catalog_filters.FilterError, catalog_filters.NoMatchingEntries)
+
+# 筛选条件无法使用时的响应
+def filter_error_response(error, job_id):
+    """
+    筛选条件无效时返回400，条件有效但没有目录条目满足时返回404
+    """
+    no_match = isinstance(error, LookupError)
+    logger.warning(f"筛选条件{'没有匹配的目录条目' if no_match else '无效'}: {str(error)}，jobId: {job_id}")
+    return jsonify({
+        "status": "error",
+        "jobId": job_id,
+        "error": f"没有目录条目满足筛选条件: {str(error)}" if no_match else f"筛选条件无效: {str(error)}"
+    }), 404 if no_match else 400
+
 # 解析分析结果
 def parse_analysis_result(json_text):
     """
@@ -295,12 +339,11 @@ def personalized_analysis():
             
             # 直接使用本地文件路径进行分析
             try:
-                # 检查算法模块是否可用
-                input_analyse_spec = importlib.util.find_spec('input_analyse')
+                # 导入算法模块(每个模块只解析一次)
+                from app.utils import preload
+                input_analyse = preload.import_module('input_analyse')
                 
-                if input_analyse_spec:
-                    # 导入算法模块
-                    import input_analyse
+                if input_analyse is not None:
                     
                     logger.info(f"开始分析图像: {image_path}")
                     
@@ -457,7 +500,7 @@ def personalized_analysis():
 def wear_suit_pictures():
     """
     穿着建议图片API端点
-    接受一个包含jobId的JSON请求
+    接受一个包含jobId的JSON请求，可选filters字段限定匹配的目录条目
     返回成功/失败状态和模拟的穿着建议图片
     """
     job_id = None
@@ -481,7 +524,15 @@ def wear_suit_pictures():
             }), 400
             
         job_id = data['jobId']
-        logger.info(f"接收到穿着建议请求，jobId: {job_id}")
+        # 可选的目录筛选条件，如 "occasion=formal; style!=one-piece"
+        filters = data.get('filters')
+        if not valid_filters(filters):
+            logger.error(f"filters字段类型无效: {type(filters).__name__}")
+            return jsonify({
+                'error': 'filters must be a string or a list of strings',
+                'status': 'error'
+            }), 400
+        logger.info(f"接收到穿着建议请求，jobId: {job_id}, 筛选条件: {filters}")
         
         # 检查job是否存在
         job = get_job_by_id(job_id)
@@ -503,6 +554,10 @@ def wear_suit_pictures():
             preload = safe_import_preload()
             
             if preload:
+                # 等待模型资源就绪(最多MODEL_READY_TIMEOUT秒)，未就绪时返回503而不是模拟结果
+                if not preload.wait_until_ready():
+                    return models_not_ready_response(preload, job_id)
+                
                 # 获取预加载的资源
                 resources = preload.get_model_resources()
                 
@@ -549,12 +604,18 @@ def wear_suit_pictures():
                                 device = resources.get('device')
                                 
                                 # 步骤1: 使用embedding_match找到最佳匹配的图片
-                                success, message, best_image_path = find_best_match_image(
-                                    analysis_json_str,  # 使用处理后的JSON字符串
-                                    tokenizer, 
-                                    model, 
-                                    device
-                                )
+                                try:
+                                    success, message, best_image_path = find_best_match_image(
+                                        analysis_json_str,  # 使用处理后的JSON字符串
+                                        tokenizer, 
+                                        model, 
+                                        device,
+                                        resources.get('batcher'),
+                                        filters=filters
+                                    )
+                                except filter_exceptions(preload) as e:
+                                    # 筛选条件是客户端输入，不能用模拟数据掩盖
+                                    return filter_error_response(e, job_id)
                                 
                                 if not success:
                                     logger.warning(f"查找最佳匹配图片失败: {message}")
@@ -702,6 +763,7 @@ def generate_best_fit():
     
     请求参数:
         jobId: 任务ID
+        filters: 可选，目录筛选条件，如 "occasion=formal; style!=one-piece" 或其列表
         
     返回:
         成功: {"status": "success", "jobId": "xxx", "message": "成功生成最佳穿着建议图片"}
@@ -711,12 +773,20 @@ def generate_best_fit():
         # 获取请求参数
         data = request.get_json()
         job_id = data.get('jobId')
+        # 可选的目录筛选条件，如 "occasion=formal; style!=one-piece"
+        filters = data.get('filters')
         
         if not job_id:
             return jsonify({
                 'status': 'error',
                 'error': '缺少必要参数: jobId'
             }), 400
+        
+        if not valid_filters(filters):
+            return jsonify({
+                'status': 'error',
+                'error': 'filters必须是字符串或字符串列表'
+            }), 400
             
         logger.info(f"接收到生成最佳穿着建议请求，jobId: {job_id}")
         
@@ -778,6 +848,10 @@ def generate_best_fit():
             preload = safe_import_preload()
             
             if preload:
+                # 等待模型资源就绪(最多MODEL_READY_TIMEOUT秒)，未就绪时返回503而不是模拟结果
+                if not preload.wait_until_ready():
+                    return models_not_ready_response(preload, job_id)
+                
                 # 获取预加载的资源
                 resources = preload.get_model_resources()
                 
@@ -788,12 +862,18 @@ def generate_best_fit():
                 
                 if analysis_data:
                     # 步骤1: 使用embedding_match找到最佳匹配的图片
-                    success, message, best_image_path = find_best_match_image(
-                        analysis_data, 
-                        tokenizer, 
-                        model, 
-                        device
-                    )
+                    try:
+                        success, message, best_image_path = find_best_match_image(
+                            analysis_data, 
+                            tokenizer, 
+                            model, 
+                            device,
+                            resources.get('batcher'),
+                            filters=filters
+                        )
+                    except filter_exceptions(preload) as e:
+                        cleanup_temp_files(file_paths=[image_path])
+                        return filter_error_response(e, job_id)
                     
                     if not success:
                         logger.warning(f"查找最佳匹配图片失败: {message}")
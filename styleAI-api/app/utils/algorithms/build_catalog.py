@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Convert the look catalog JSON into the memory-mapped binary catalog format.
+
+Usage:
+    python build_catalog.py [--input ALL_final_merged.json] [--output catalog_bin]
+                            [--layers N] [--model distilbert-base-uncased]
+
+embedding_match picks up the output directory automatically when it sits at
+the default location, or through the CATALOG_PATH environment variable. The
+attribute texts are written alongside for the lexical backend (lexical_match).
+
+With --layers N every attribute text is re-embedded with the first N blocks of
+the model, as served with EMBEDDING_LAYERS=N, and the depth is recorded in the
+metadata; by default the vectors of the source JSON are kept as they are.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from catalog_index import CatalogIndex, DEFAULT_BINARY_CATALOG_PATH, DEFAULT_CATALOG_PATH, EMBEDDINGS_FILE, reembed_catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the binary look catalog from ALL_final_merged.json")
+    parser.add_argument("--input", default=DEFAULT_CATALOG_PATH, help="source catalog JSON")
+    parser.add_argument("--output", default=DEFAULT_BINARY_CATALOG_PATH, help="output catalog directory")
+    parser.add_argument("--layers", type=int, help="re-embed with the first N transformer blocks")
+    parser.add_argument("--model", default="distilbert-base-uncased", help="model used with --layers")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Catalog JSON not found: {args.input}")
+        return 1
+
+    start_time = time.time()
+    index = CatalogIndex.from_json(args.input)
+    if args.layers is not None:
+        import embedding_backends
+        import embedding_match
+        tokenizer, model, _ = embedding_backends.load_embedding_model(args.model, "cpu", "fp32", args.layers)
+        layers = embedding_backends.embedding_layers(model)
+        print(f"Re-embedding {len(index)} entries with {layers} transformer blocks of {args.model}")
+        index = reembed_catalog(
+            index, lambda texts: embedding_match.generate_embeddings(texts, tokenizer, model, "cpu"), layers)
+    index.save(args.output)
+
+    blob_size = os.path.getsize(os.path.join(args.output, EMBEDDINGS_FILE))
+    print(f"Wrote {len(index)} entries, {len(index.attributes)} attributes, dim {index.dim} "
+          f"({blob_size / 1024 / 1024:.1f} MB of embeddings) to {args.output} "
+          f"in {time.time() - start_time:.2f} seconds")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Approximate nearest-neighbour shortlist for embedding_match.
+
+An IVF (inverted file) index over the heavily weighted attributes: every
+catalog row gets a key vector made of its L2-normalized embeddings for those
+attributes (each randomly projected to a few dimensions and scaled by
+sqrt(weight)), the keys are clustered with k-means, and a query only
+keeps the rows of the clusters whose centroids are nearest to the user's key.
+The full weighted scorer then runs on that shortlist.
+
+Configuration (environment variables):
+    CATALOG_ANN                 "ivf" to enable; anything else scores the whole catalog (default "off")
+    CATALOG_ANN_CLUSTERS        number of clusters (default: sqrt of the catalog size)
+    CATALOG_ANN_PROBES          clusters visited per query (default 8)
+    CATALOG_ANN_MIN_CANDIDATES  shortlist floor; catalogs this small are always scored exactly (default 256)
+    CATALOG_ANN_PROJECTION_DIM  projected dimensions per attribute (default 64)
+"""
+
+import logging
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_ROWS = 8192
+_TRAIN_POINTS_PER_CLUSTER = 64
+_MAX_CLUSTER_RATIO = 4
+_MAX_SPLIT_ROUNDS = 4
+
+_ann_indexes = weakref.WeakKeyDictionary()
+_ann_lock = threading.Lock()
+
+
+def get_ann_config():
+    """Read the ANN settings from the environment."""
+    return {
+        "mode": os.environ.get("CATALOG_ANN", "off").lower(),
+        "n_clusters": int(os.environ.get("CATALOG_ANN_CLUSTERS", 0)) or None,
+        "n_probe": int(os.environ.get("CATALOG_ANN_PROBES", 8)),
+        "min_candidates": int(os.environ.get("CATALOG_ANN_MIN_CANDIDATES", 256)),
+        "projection_dim": int(os.environ.get("CATALOG_ANN_PROJECTION_DIM", 64)),
+    }
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors, dtype=np.float32), where=norms > 0)
+
+
+def _kmeans(keys, n_clusters, rng, seed):
+    """Lloyd k-means fit on a sample, then every row assigned to its nearest centroid."""
+    from sklearn.cluster import KMeans
+
+    n = len(keys)
+    sample_size = min(n, max(_TRAIN_POINTS_PER_CLUSTER * n_clusters, 10000))
+    sample = keys[np.sort(rng.choice(n, sample_size, replace=False))]
+    kmeans = KMeans(n_clusters=n_clusters, random_state=seed, n_init=1).fit(sample)
+    labels = np.concatenate([kmeans.predict(keys[start:start + _CHUNK_ROWS])
+                             for start in range(0, n, _CHUNK_ROWS)])
+    return kmeans.cluster_centers_, labels
+
+
+class IVFIndex:
+    """Cluster-based shortlist over the catalog's heavily weighted attributes."""
+
+    def __init__(self, attributes, scales, projection, block_means, centroids, order, offsets,
+                 n_probe=8, min_candidates=256):
+        self.attributes = attributes
+        self.scales = scales
+        self.projection = projection
+        self.block_means = block_means
+        self.centroids = centroids
+        self.centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = n_probe
+        self.min_candidates = min_candidates
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, catalog, n_clusters=None, n_probe=8, min_candidates=256, projection_dim=64, seed=0):
+        # imported here: embedding_match imports this module at load time
+        from embedding_match import WEIGHTS
+        n = len(catalog)
+        attributes = [attr for attr in catalog.attributes if WEIGHTS.get(attr, 1.0) > 1.0]
+        if not attributes:
+            attributes = list(catalog.attributes)
+        scales = np.sqrt([WEIGHTS.get(attr, 1.0) for attr in attributes]).astype(np.float32)
+
+        rng = np.random.RandomState(seed)
+        projection = (rng.standard_normal((catalog.dim, projection_dim)) / np.sqrt(projection_dim)).astype(np.float32)
+
+        keys = np.zeros((n, len(attributes) * projection_dim), dtype=np.float32)
+        block_means = np.zeros_like(keys[0])
+        for i, attr in enumerate(attributes):
+            columns = slice(i * projection_dim, (i + 1) * projection_dim)
+            matrix = catalog.embeddings[attr]
+            for start in range(0, n, _CHUNK_ROWS):
+                block = _normalized(np.asarray(matrix[start:start + _CHUNK_ROWS], dtype=np.float32))
+                keys[start:start + _CHUNK_ROWS, columns] = (block @ projection) * scales[i]
+            # rows lacking the attribute get its mean key, so they cluster by the
+            # attributes they do have instead of collecting in "missing" clusters
+            mask = catalog.masks[attr]
+            if mask.any():
+                block_means[columns] = keys[mask, columns].mean(axis=0)
+                keys[~mask, columns] = block_means[columns]
+
+        n_clusters = min(n_clusters or max(1, int(np.sqrt(n))), n)
+        centroids, labels = _kmeans(keys, n_clusters, rng, seed)
+
+        # k-means in high dimensions can park a large share of the rows in a few
+        # clusters, which would turn the shortlist into a near full scan; split
+        # clusters far above the target size into proportionally many pieces
+        target_size = max(1, n // n_clusters)
+        for _ in range(_MAX_SPLIT_ROUNDS):
+            sizes = np.bincount(labels, minlength=len(centroids))
+            oversized = np.flatnonzero(sizes > _MAX_CLUSTER_RATIO * target_size)
+            if not len(oversized):
+                break
+            for cluster in oversized:
+                rows = np.flatnonzero(labels == cluster)
+                pieces = int(np.ceil(len(rows) / target_size))
+                sub_centroids, sub_labels = _kmeans(keys[rows], pieces, rng, seed)
+                centroids[cluster] = sub_centroids[0]
+                labels[rows[sub_labels > 0]] = sub_labels[sub_labels > 0] - 1 + len(centroids)
+                centroids = np.vstack([centroids, sub_centroids[1:]])
+
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+        return cls(attributes, scales, projection, block_means, centroids.astype(np.float32),
+                   order, offsets, n_probe, min_candidates)
+
+    def query_key(self, user_emb_dict):
+        dim = self.projection.shape[1]
+        key = self.block_means.copy()
+        for i, attr in enumerate(self.attributes):
+            if attr in user_emb_dict:
+                vector = _normalized(np.asarray(user_emb_dict[attr], dtype=np.float32))
+                key[i * dim:(i + 1) * dim] = (vector @ self.projection) * self.scales[i]
+        return key
+
+    def shortlist(self, user_emb_dict):
+        """
+        Sorted catalog rows worth scoring exactly, or None to score everything
+        (the user has none of the indexed attributes).
+        """
+        if not any(attr in user_emb_dict for attr in self.attributes):
+            return None
+        key = self.query_key(user_emb_dict)
+
+        # nearest centroids by squared L2 distance (|key|^2 is constant per query)
+        distances = self.centroid_norms - 2.0 * (self.centroids @ key)
+        cluster_order = np.argsort(distances, kind="stable")
+        sizes = np.diff(self.offsets)[cluster_order]
+        # visit at least n_probe clusters, and more until the shortlist floor is met
+        visited = max(self.n_probe, int(np.searchsorted(np.cumsum(sizes), self.min_candidates)) + 1)
+        clusters = cluster_order[:visited]
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+        return np.sort(rows)
+
+
+def get_ann_index(catalog):
+    """
+    The IVF index for ``catalog``, built on first use, or None when ANN is
+    disabled, the catalog is small enough to score exactly, or the build failed.
+    """
+    config = get_ann_config()
+    if config["mode"] != "ivf" or len(catalog) <= config["min_candidates"]:
+        return None
+    # sparse lexical catalogs (lexical_match) are always scored exactly
+    if getattr(catalog, "sparse", False):
+        return None
+
+    index = _ann_indexes.get(catalog)
+    if index is None:
+        with _ann_lock:
+            index = _ann_indexes.get(catalog)
+            if index is None:
+                start_time = time.time()
+                try:
+                    index = IVFIndex.build(catalog, config["n_clusters"], config["n_probe"],
+                                           config["min_candidates"], config["projection_dim"])
+                    logger.info(f"ANN index built: {index.n_clusters} clusters over {len(catalog)} entries, "
+                                f"took {time.time() - start_time:.2f} seconds")
+                except Exception as e:
+                    # remembered so requests do not retry the build; matching stays exact
+                    logger.error(f"Failed to build ANN index, scoring the whole catalog: {e}")
+                    index = False
+                _ann_indexes[catalog] = index
+    return index or None
+
+
+def shortlist(catalog, user_emb_dict):
+    """Candidate rows for ``top_matches``; None means score the whole catalog."""
+    index = get_ann_index(catalog)
+    return None if index is None else index.shortlist(user_emb_dict)
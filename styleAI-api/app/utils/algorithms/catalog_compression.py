@@ -0,0 +1,211 @@
+"""
+Compressed catalog embeddings for embedding_match.
+
+A CompressedCatalog replaces every float32 attribute matrix of a CatalogIndex
+with a smaller code matrix and scores directly on it:
+    float16  half-precision copy of each row
+    int8     each row scaled by its own max |value| / 127 and rounded, with the
+             float32 scale kept per row
+Optionally every row is first L2-normalized and projected onto a PCA basis fit
+with scikit-learn (CATALOG_PCA_DIM dimensions, the mean direction included so
+the shared component of DistilBERT vectors survives); user vectors go through
+the same projection once per request.
+
+Cosines are computed against the decoded rows, whose norms are stored at
+compression time. With CATALOG_RESCORE > 0 the source catalog is kept and the
+top candidates of the compressed scores are re-scored exactly; pair this with
+the memory-mapped binary catalog so the full-precision rows stay on disk.
+
+Configuration (environment variables):
+    CATALOG_COMPRESSION  off (default) | float16 | int8
+    CATALOG_PCA_DIM      projected dimensions, 0 disables the projection (default 0)
+    CATALOG_RESCORE      candidates re-scored at full precision, 0 disables (default 50)
+"""
+
+import logging
+import os
+import time
+
+import numpy as np
+
+from catalog_index import CatalogIndex, dense_span, row_dots
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_KINDS = ("float16", "int8")
+_CHUNK_ROWS = 8192
+_PCA_SAMPLE_ROWS = 20000
+
+
+def get_compression_config():
+    """Read the compression settings from the environment."""
+    return {
+        "kind": os.environ.get("CATALOG_COMPRESSION", "off").lower(),
+        "pca_dim": int(os.environ.get("CATALOG_PCA_DIM", 0)),
+        "rescore": int(os.environ.get("CATALOG_RESCORE", 50)),
+    }
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors, dtype=np.float32), where=norms > 0)
+
+
+def fit_pca_basis(catalog, dim, seed=0):
+    """
+    Orthonormal (dim, catalog.dim) basis: the mean direction of the normalized
+    rows followed by the leading PCA components of a row sample.
+    """
+    from sklearn.decomposition import PCA
+
+    rng = np.random.RandomState(seed)
+    per_attribute = max(1, _PCA_SAMPLE_ROWS // max(1, len(catalog.attributes)))
+    samples = []
+    for attr in catalog.attributes:
+        present = np.flatnonzero(catalog.masks[attr])
+        if len(present):
+            rows = np.sort(rng.choice(present, min(len(present), per_attribute), replace=False))
+            samples.append(_normalized(np.asarray(catalog.embeddings[attr][rows], dtype=np.float32)))
+    sample = np.concatenate(samples)
+
+    dim = min(dim, catalog.dim, len(sample))
+    pca = PCA(n_components=max(1, dim - 1), random_state=seed).fit(sample)
+    basis, _ = np.linalg.qr(np.vstack([pca.mean_, pca.components_]).T)
+    return basis.T[:dim].astype(np.float32)
+
+
+def _encode(block, kind):
+    """Codes, per-row scales (int8 only) and decoded row norms for a float32 block."""
+    if kind == "float16":
+        codes = block.astype(np.float16)
+        return codes, None, np.linalg.norm(codes.astype(np.float32), axis=1)
+    scales = np.abs(block).max(axis=1) / 127.0
+    safe_scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.rint(block / safe_scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32), np.linalg.norm(codes.astype(np.float32), axis=1) * scales
+
+
+class CompressedCatalog(CatalogIndex):
+    """
+    CatalogIndex whose attribute matrices are float16 or int8 codes.
+
+    Row metadata (images, genders, scores, masks) is shared with the source
+    index. ``exact`` is the source index when re-scoring is enabled, else None.
+    """
+
+    def __init__(self, source, codes, scales, norms, kind, basis=None, rescore=0):
+        super().__init__(source.images, source.gender_codes, source.gender_values, source.aesthetic_scores,
+                         codes, source.masks, source.attribute_keys, source.attribute_key_mask,
+                         source_rows=source.source_rows, attribute_texts=source.attribute_texts)
+        self.scales = scales
+        self.norms = norms
+        self.kind = kind
+        self.basis = basis
+        self.rescore = rescore
+        self.exact = source if rescore > 0 else None
+        self.embedding_layers = source.embedding_layers
+        self.source_path = source.source_path
+
+    @property
+    def nbytes(self):
+        """Bytes held by the codes, scales, norms and projection."""
+        total = sum(codes.nbytes for codes in self.embeddings.values())
+        total += sum(norms.nbytes for norms in self.norms.values())
+        total += sum(scales.nbytes for scales in self.scales.values() if scales is not None)
+        return total + (self.basis.nbytes if self.basis is not None else 0)
+
+    def row_range(self, start, stop):
+        view = super().row_range(start, stop)
+        view.scales = {attr: None if scales is None else scales[start:stop] for attr, scales in self.scales.items()}
+        view.norms = {attr: norms[start:stop] for attr, norms in self.norms.items()}
+        view.exact = None if self.exact is None else self.exact.row_range(start, stop)
+        return view
+
+    def prepare_query(self, user_emb_dict):
+        if self.basis is None:
+            return user_emb_dict
+        return {attr: self.basis @ _normalized(np.asarray(vector, dtype=np.float32))
+                for attr, vector in user_emb_dict.items()}
+
+    def cosine(self, attr, vector, rows=None):
+        span = dense_span(rows)
+        if span is not None:
+            return self.cosine(attr, vector, span[0])[span[1]]
+        codes = self.embeddings[attr] if rows is None else self.embeddings[attr][rows]
+        vector = np.asarray(vector, dtype=np.float32)
+        vector_norm = np.linalg.norm(vector)
+        if vector_norm == 0:
+            return np.zeros(len(codes), dtype=np.float64)
+
+        # decode in chunks so a request never materializes a full float32 matrix
+        dots = np.empty(len(codes), dtype=np.float64)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            dots[start:start + _CHUNK_ROWS] = row_dots(codes[start:start + _CHUNK_ROWS].astype(np.float32), vector)
+        scales = self.scales[attr]
+        if scales is not None:
+            dots *= scales if rows is None else scales[rows]
+
+        norms = self.norms[attr] if rows is None else self.norms[attr][rows]
+        row_norms = norms.astype(np.float64) * vector_norm
+        return np.divide(dots, row_norms, out=np.zeros_like(dots), where=row_norms > 0)
+
+    def cosine_many(self, attr, vectors, rows=None):
+        span = dense_span(rows)
+        if span is not None:
+            return self.cosine_many(attr, vectors, span[0])[span[1]]
+        codes = self.embeddings[attr] if rows is None else self.embeddings[attr][rows]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dots = np.empty((len(codes), len(vectors)), dtype=np.float64)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            dots[start:start + _CHUNK_ROWS] = codes[start:start + _CHUNK_ROWS].astype(np.float32) @ vectors.T
+        scales = self.scales[attr]
+        if scales is not None:
+            dots *= (scales if rows is None else scales[rows])[:, None]
+
+        norms = self.norms[attr] if rows is None else self.norms[attr][rows]
+        denominators = norms.astype(np.float64)[:, None] * np.linalg.norm(vectors, axis=1)[None, :]
+        return np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+    @classmethod
+    def compress(cls, catalog, kind="int8", pca_dim=0, rescore=0, seed=0):
+        if kind not in COMPRESSION_KINDS:
+            raise ValueError(f"Unknown catalog compression: {kind}")
+        basis = fit_pca_basis(catalog, pca_dim, seed) if pca_dim else None
+
+        codes, scales, norms = {}, {}, {}
+        for attr in catalog.attributes:
+            matrix = catalog.embeddings[attr]
+            blocks = []
+            for start in range(0, len(catalog), _CHUNK_ROWS):
+                block = np.asarray(matrix[start:start + _CHUNK_ROWS], dtype=np.float32)
+                if basis is not None:
+                    block = _normalized(block) @ basis.T
+                blocks.append(_encode(block, kind))
+            codes[attr] = np.concatenate([b[0] for b in blocks])
+            scales[attr] = np.concatenate([b[1] for b in blocks]) if kind == "int8" else None
+            norms[attr] = np.concatenate([b[2] for b in blocks]).astype(np.float32)
+        return cls(catalog, codes, scales, norms, kind, basis, rescore)
+
+
+def maybe_compress(catalog):
+    """
+    Compress ``catalog`` as configured, or return it unchanged when compression
+    is off or fails.
+    """
+    config = get_compression_config()
+    if config["kind"] == "off":
+        return catalog
+
+    start_time = time.time()
+    try:
+        compressed = CompressedCatalog.compress(catalog, config["kind"], config["pca_dim"], config["rescore"])
+    except Exception as e:
+        logger.error(f"Failed to compress catalog, keeping full precision: {e}")
+        return catalog
+    logger.info(
+        f"Catalog compressed to {config['kind']}"
+        f"{f' with {compressed.dim}-d PCA' if compressed.basis is not None else ''}: "
+        f"{compressed.nbytes / 1e6:.1f} MB, rescoring top {config['rescore']}, "
+        f"took {time.time() - start_time:.2f} seconds"
+    )
+    return compressed
@@ -0,0 +1,215 @@
+"""
+Inverted attribute index for filtered catalog queries.
+
+Categorical catalog attributes (the gender and every ``Style Features`` path,
+e.g. the style keywords and the occasion) are indexed once per catalog: each
+normalized value maps to a posting list, the sorted int32 array of the rows
+carrying it. A value is posted under itself, under every comma, semicolon or
+slash separated term and under every word of those terms, so "formal" finds
+both "business formal" and "formal, classic".
+
+A filter is a list of clauses that must all hold, or one string with the
+clauses separated by ";":
+    occasion=office          rows carrying the value
+    occasion=office|party    rows carrying any of the values
+    style!=one-piece         rows not carrying it (rows without the attribute are kept)
+Fields are full attribute paths, their last path segment ("style keywords")
+or one of FILTER_ALIASES. A filter is compiled into a row bitmask from the
+posting lists alone, without reading a single embedding, and only the
+selected rows are then scored, so narrower filters are cheaper to serve.
+
+Filtering on anything but the gender needs the catalog's attribute texts:
+kept in memory for the source JSON, read from the attribute_texts.json
+sidecar of a binary catalog.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+
+import numpy as np
+
+import catalog_index
+
+logger = logging.getLogger(__name__)
+
+FILTER_ALIASES = {
+    "gender": catalog_index.GENDER_ATTR,
+    "style": "Style Features.Style Keywords",
+    "occasion": "Style Features.Occasion",
+}
+# attribute paths indexed besides the gender
+FILTER_PREFIXES = ("Style Features.",)
+
+_TERM_SEPARATORS = re.compile(r"[,;/]")
+# hyphens stay inside words ("one-piece")
+_WORD_SEPARATORS = re.compile(r"[^\w-]+")
+_CLAUSE = re.compile(r"^(.+?)(!=|=)(.*)$")
+
+_filter_indexes = weakref.WeakKeyDictionary()
+_filter_lock = threading.Lock()
+
+
+class FilterError(ValueError):
+    """A filter expression that cannot be parsed or names an unindexed field."""
+
+
+class NoMatchingEntries(LookupError):
+    """A valid filter that no catalog row passes."""
+
+
+def normalize_value(value):
+    """Lower-cased value with runs of whitespace collapsed."""
+    return " ".join(str(value).lower().split())
+
+
+def value_tokens(value):
+    """Every posting key of an attribute value: the value, its terms and their words."""
+    value = normalize_value(value)
+    if not value:
+        return set()
+    tokens = {value}
+    for term in _TERM_SEPARATORS.split(value):
+        term = term.strip()
+        if term:
+            tokens.add(term)
+            tokens.update(word for word in _WORD_SEPARATORS.split(term) if word)
+    return tokens
+
+
+def _postings(values):
+    posted = {}
+    for row, value in enumerate(values):
+        if value is None:
+            continue
+        for token in value_tokens(value):
+            posted.setdefault(token, []).append(row)
+    return {token: np.array(rows, dtype=np.int32) for token, rows in posted.items()}
+
+
+class AttributeIndex:
+    """Posting lists of catalog rows per indexed field and normalized value."""
+
+    def __init__(self, n_rows, postings):
+        self.n_rows = n_rows
+        self.postings = postings
+        self._fields = {}
+        for field in postings:
+            self._fields[field.lower()] = field
+            self._fields.setdefault(field.rsplit(".", 1)[-1].lower(), field)
+        for alias, field in FILTER_ALIASES.items():
+            if field in postings:
+                self._fields[alias] = field
+
+    @property
+    def fields(self):
+        return list(self.postings)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the posting lists."""
+        return sum(rows.nbytes for values in self.postings.values() for rows in values.values())
+
+    @classmethod
+    def build(cls, catalog, attribute_texts=None):
+        """Index the catalog's genders and the ``FILTER_PREFIXES`` columns of ``attribute_texts``."""
+        genders = catalog.genders
+        postings = {catalog_index.GENDER_ATTR: _postings([gender or None for gender in genders])}
+        for attr, texts in (attribute_texts or {}).items():
+            if attr.startswith(FILTER_PREFIXES):
+                postings[attr] = _postings(texts)
+        return cls(len(catalog), postings)
+
+    def resolve_field(self, name):
+        """Indexed attribute path for a field name, alias or last path segment."""
+        field = self._fields.get(normalize_value(name))
+        if field is None:
+            raise FilterError(f"Unknown filter field {name!r}, indexed fields: {', '.join(self.fields)}")
+        return field
+
+    def parse(self, filters):
+        """(field, negated, values) of every clause of a filter expression."""
+        if isinstance(filters, str):
+            filters = filters.split(";")
+        if not isinstance(filters, (list, tuple)) or not all(isinstance(clause, str) for clause in filters):
+            raise FilterError(f"Filters must be a string or a list of strings, got {filters!r}")
+        clauses = []
+        for clause in filters:
+            if not clause.strip():
+                continue
+            match = _CLAUSE.match(clause.strip())
+            if match is None:
+                raise FilterError(f"Filter clause {clause!r} is not field=value or field!=value")
+            name, operator, values = match.groups()
+            values = [normalize_value(value) for value in values.split("|") if normalize_value(value)]
+            if not values:
+                raise FilterError(f"Filter clause {clause!r} has no value")
+            clauses.append((self.resolve_field(name), operator == "!=", values))
+        return clauses
+
+    def mask(self, filters):
+        """Row bitmask of the catalog rows satisfying every clause of ``filters``."""
+        selected = np.ones(self.n_rows, dtype=bool)
+        for field, negated, values in self.parse(filters):
+            hits = np.zeros(self.n_rows, dtype=bool)
+            for value in values:
+                rows = self.postings[field].get(value)
+                if rows is not None:
+                    hits[rows] = True
+            if negated:
+                selected &= ~hits
+            else:
+                selected &= hits
+        return selected
+
+    def select(self, filters):
+        """
+        Rows satisfying ``filters`` and the fraction of the catalog they are.
+
+        Returns:
+            tuple: (rows, selectivity); rows is a sorted array of catalog rows
+        """
+        rows = np.flatnonzero(self.mask(filters))
+        return rows, len(rows) / max(1, self.n_rows)
+
+
+def _attribute_texts(catalog):
+    if catalog.attribute_texts is not None:
+        return catalog.attribute_texts
+    path = getattr(catalog, "source_path", None)
+    if path and os.path.isdir(path):
+        texts = catalog_index.load_attribute_texts(path)
+        if texts is None:
+            logger.warning(f"{path} has no {catalog_index.TEXTS_FILE}, only the gender can be filtered on; "
+                           f"rebuild it with build_catalog.py")
+        return texts
+    return None
+
+
+def get_filter_index(catalog):
+    """The inverted attribute index of ``catalog``, built on first use."""
+    index = _filter_indexes.get(catalog)
+    if index is None:
+        with _filter_lock:
+            index = _filter_indexes.get(catalog)
+            if index is None:
+                start_time = time.time()
+                index = AttributeIndex.build(catalog, _attribute_texts(catalog))
+                logger.info(f"Attribute filter index built: {len(index.fields)} fields, "
+                            f"{sum(len(values) for values in index.postings.values())} values, "
+                            f"{index.nbytes / 1e6:.1f} MB, took {time.time() - start_time:.2f} seconds")
+                _filter_indexes[catalog] = index
+    return index
+
+
+def select_rows(catalog, filters):
+    """
+    Catalog rows passing ``filters`` and their selectivity, or (None, 1.0)
+    when there is no filter. Raises FilterError for a malformed filter.
+    """
+    if not filters:
+        return None, 1.0
+    return get_filter_index(catalog).select(filters)
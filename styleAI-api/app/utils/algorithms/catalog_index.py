@@ -0,0 +1,588 @@
+"""
+Resident catalog index for embedding_match.
+
+The look catalog (ALL_final_merged.json) is parsed once per process and kept
+in memory as one contiguous float32 matrix per attribute path, plus parallel
+arrays for image path, gender and aesthetic score. Fields derived from each
+entry's analysis text (normalized gender, parsed aesthetic score, flattened
+attribute key set) are computed once at load and stored as typed columns, so
+the matcher never touches raw catalog JSON while serving a request.
+
+Attribute rows are L2-normalized once when the index is built (and stored
+that way in the binary format), so a cosine similarity against the catalog is
+a single matrix-vector product with the normalized user vector.
+
+At serve time the catalog is normally read from the binary format written by
+build_catalog.py: a directory holding one float32 blob with every attribute
+matrix (memory-mapped read-only, so all workers share the pages through the OS
+page cache) and a small JSON metadata sidecar.
+"""
+
+import base64
+import copy
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CATALOG_PATH = os.path.join(ALGORITHMS_DIR, "ALL_final_merged.json")
+DEFAULT_BINARY_CATALOG_PATH = os.path.join(ALGORITHMS_DIR, "catalog_bin")
+
+CATALOG_FORMAT_VERSION = 3
+# version 2 stored raw rows; they are still readable and normalized in memory
+SUPPORTED_FORMAT_VERSIONS = (2, 3)
+EMBEDDINGS_FILE = "embeddings.f32"
+METADATA_FILE = "metadata.json"
+# attribute texts per row, only read by the lexical matcher (lexical_match)
+TEXTS_FILE = "attribute_texts.json"
+
+# row selections at least this dense are scored through a view of their span
+DENSE_ROWS_FRACTION = 0.2
+
+GENDER_ATTR = "Semantic Features.Intrinsic Features.Gender"
+AESTHETIC_SCORE_ATTR = "Scoring.Aesthetic Score"
+REQUIRED_ENTRY_KEYS = ("image", "attribute_embeddings", "result")
+
+_catalog_index = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_path():
+    """
+    Catalog location, overridable with the CATALOG_PATH environment variable.
+
+    Without an override the binary catalog is preferred when it has been built,
+    falling back to the source JSON.
+    """
+    path = os.environ.get("CATALOG_PATH")
+    if path:
+        return path
+    if os.path.isdir(DEFAULT_BINARY_CATALOG_PATH):
+        return DEFAULT_BINARY_CATALOG_PATH
+    return DEFAULT_CATALOG_PATH
+
+
+def normalize_gender(value):
+    """Gender as compared by the matcher; "" means unknown and never penalized."""
+    return str(value).lower() if value else ""
+
+
+def parse_aesthetic_score(value):
+    """Same rule top_matches always used: plain non-negative decimals, else 0."""
+    value = str(value)
+    return float(value) if value.replace('.', '', 1).isdigit() else 0
+
+
+def row_dots(matrix, vector):
+    """
+    Dot product of every row of ``matrix`` with ``vector``.
+
+    Computed as a stack of (1 x dim) @ (dim x 1) products, one BLAS dot per
+    row, so each row's value depends only on that row. BLAS gemv
+    (``matrix @ vector``) sends the rows left over after its blocks through a
+    different kernel: a row could come out one ulp apart depending on which
+    other rows share the call, and scoring a subset, a partition or a shard
+    would not reproduce the full scores (or the order of exact ties) bit for bit.
+    """
+    return np.matmul(matrix[:, None, :], vector[:, None])[:, 0, 0]
+
+
+def cosine_column(matrix, vector):
+    """Cosine similarity of every row of ``matrix`` with ``vector``; zero-norm rows give 0."""
+    vector_norm = np.linalg.norm(vector)
+    if vector_norm == 0:
+        return np.zeros(matrix.shape[0], dtype=np.float64)
+    row_norms = np.linalg.norm(matrix, axis=1) * vector_norm
+    dots = row_dots(matrix, vector).astype(np.float64)
+    return np.divide(dots, row_norms, out=np.zeros_like(dots), where=row_norms > 0)
+
+
+def normalize_rows(matrix):
+    """Rows of ``matrix`` scaled to unit L2 norm in place; all-zero rows stay zero."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def gender_layout(gender_codes, n_values):
+    """
+    Stable row order grouping the catalog by gender code.
+
+    Unknown genders (-1) are never penalized, so they sit between the first two
+    genders: with two gender values both users' unpenalized rows and penalized
+    rows are then contiguous blocks.
+    """
+    keys = np.asarray(gender_codes, dtype=np.int64)
+    if n_values == 2:
+        keys = np.select([keys == 0, keys == -1], [0, 1], 2)
+    return np.argsort(keys, kind="stable")
+
+
+def _as_slice(rows):
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return slice(int(rows[0]), int(rows[-1]) + 1)
+    rows.flags.writeable = False
+    return rows
+
+
+def dense_span(rows):
+    """
+    (span, positions) for a sorted row array covering at least
+    DENSE_ROWS_FRACTION of the contiguous span it lies in, else None: scoring
+    such rows through a view of the span and picking ``positions`` costs less
+    than gathering a copy of them, and gives the same values.
+    """
+    if rows is None or isinstance(rows, slice) or not len(rows):
+        return None
+    start, stop = int(rows[0]), int(rows[-1]) + 1
+    if len(rows) < DENSE_ROWS_FRACTION * (stop - start):
+        return None
+    return slice(start, stop), rows - start
+
+
+def _pack_mask(mask):
+    return base64.b64encode(np.packbits(mask)).decode("ascii")
+
+
+class CatalogIndex:
+    """
+    Column-oriented view of the look catalog.
+
+    Row i of every array describes the same catalog entry. For each attribute
+    path, ``embeddings[attr]`` is an (n, dim) float32 matrix and ``masks[attr]``
+    marks the rows that actually carry that attribute (other rows are zero).
+
+    When ``normalized`` is set every row has unit norm (or is zero) and
+    ``cosine`` skips the per-row norms.
+
+    Rows are laid out grouped by gender (see ``gender_layout``) so each
+    gender's rows are one contiguous block; ``source_rows`` maps every row
+    back to its position in the source catalog, which is what ties are broken
+    by when ranking.
+
+    Typed columns parsed from the analysis text:
+        gender_codes: int16 index into ``gender_values`` (-1 when unknown)
+        aesthetic_scores: float64 ``Scoring.Aesthetic Score``
+        attribute_key_mask: (n, len(attribute_keys)) bool, the flattened
+            attribute paths present in each entry's analysis
+
+    ``attribute_texts`` (attribute path -> object array of the analysis text
+    per row, None where absent) is kept when the index is built from catalog
+    entries and written next to the binary catalog; ``from_binary`` leaves it
+    on disk (see ``load_attribute_texts``).
+
+    ``embedding_layers`` is the number of transformer blocks the rows were
+    embedded with (see ``reembed_catalog``), None for the full model, and
+    ``source_path`` the file or directory ``load`` read the index from.
+    """
+
+    def __init__(self, images, gender_codes, gender_values, aesthetic_scores,
+                 embeddings, masks, attribute_keys, attribute_key_mask, normalized=False, source_rows=None,
+                 attribute_texts=None):
+        self.images = images
+        self.gender_codes = gender_codes
+        self.gender_values = list(gender_values)
+        self.aesthetic_scores = aesthetic_scores
+        self.embeddings = embeddings
+        self.masks = masks
+        self.attributes = list(embeddings.keys())
+        self.attribute_keys = list(attribute_keys)
+        self.attribute_key_mask = attribute_key_mask
+        self.normalized = normalized
+        self.source_rows = np.arange(len(images)) if source_rows is None else source_rows
+        self.attribute_texts = attribute_texts
+        self.embedding_layers = None
+        self.source_path = None
+        self._gender_partitions = {}
+
+    def __len__(self):
+        return len(self.images)
+
+    @property
+    def dim(self):
+        for matrix in self.embeddings.values():
+            return matrix.shape[1]
+        return 0
+
+    @property
+    def genders(self):
+        """Normalized gender per row ("" when unknown)."""
+        values = np.array(self.gender_values + [""], dtype=object)
+        return values[self.gender_codes]
+
+    def gender_mismatch(self, user_gender):
+        """Rows whose known gender differs from ``user_gender`` (already normalized)."""
+        if not user_gender:
+            return np.zeros(len(self), dtype=bool)
+        code = self.gender_values.index(user_gender) if user_gender in self.gender_values else -2
+        return (self.gender_codes >= 0) & (self.gender_codes != code)
+
+    def gender_partitions(self, user_gender):
+        """
+        Rows without and with a gender penalty for ``user_gender``, computed
+        once per gender value. A partition that is one contiguous block (always
+        the case for two gender values with the default layout) is returned as
+        a slice, so scoring it works on views of the embedding matrices.
+        """
+        partitions = self._gender_partitions.get(user_gender)
+        if partitions is None:
+            mismatch = self.gender_mismatch(user_gender)
+            partitions = tuple(_as_slice(np.flatnonzero(rows)) for rows in (~mismatch, mismatch))
+            self._gender_partitions[user_gender] = partitions
+        return partitions
+
+    def row_range(self, start, stop):
+        """
+        Rows ``start:stop`` as an index of views of this one's arrays (the
+        embedding matrices of a binary catalog stay memory-mapped).
+        """
+        view = copy.copy(self)
+        view.images = self.images[start:stop]
+        view.gender_codes = self.gender_codes[start:stop]
+        view.aesthetic_scores = self.aesthetic_scores[start:stop]
+        view.embeddings = {attr: matrix[start:stop] for attr, matrix in self.embeddings.items()}
+        view.masks = {attr: mask[start:stop] for attr, mask in self.masks.items()}
+        view.attribute_key_mask = self.attribute_key_mask[start:stop]
+        view.source_rows = self.source_rows[start:stop]
+        if self.attribute_texts is not None:
+            view.attribute_texts = {attr: texts[start:stop] for attr, texts in self.attribute_texts.items()}
+        view._gender_partitions = {}
+        return view
+
+    def prepare_query(self, user_emb_dict):
+        """User embeddings in the space ``cosine`` compares against, normalized once per request."""
+        if not self.normalized:
+            return user_emb_dict
+        return {attr: unit_vector(vector) for attr, vector in user_emb_dict.items()}
+
+    def cosine(self, attr, vector, rows=None):
+        """Cosine similarity of ``vector`` with attribute ``attr`` of every row (or of ``rows``)."""
+        span = dense_span(rows)
+        if span is not None:
+            return self.cosine(attr, vector, span[0])[span[1]]
+        matrix = self.embeddings[attr]
+        if rows is not None:
+            matrix = matrix[rows]
+        if not self.normalized:
+            return cosine_column(matrix, vector)
+        # rows are unit (or zero) vectors; vector is already unit after prepare_query
+        vector_norm = np.linalg.norm(vector)
+        if vector_norm == 0:
+            return np.zeros(matrix.shape[0], dtype=np.float64)
+        return row_dots(matrix, vector / vector_norm).astype(np.float64)
+
+    def cosine_many(self, attr, vectors, rows=None):
+        """
+        Cosine similarities of every row (or of ``rows``) with each of the
+        (u, dim) ``vectors`` as one matrix product: an (n, u) array whose
+        column j is ``cosine(attr, vectors[j], rows)``.
+        """
+        span = dense_span(rows)
+        if span is not None:
+            return self.cosine_many(attr, vectors, span[0])[span[1]]
+        matrix = self.embeddings[attr] if rows is None else self.embeddings[attr][rows]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vector_norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        units = np.divide(vectors, vector_norms, out=np.zeros_like(vectors), where=vector_norms > 0)
+        dots = (matrix @ units.T).astype(np.float64)
+        if self.normalized:
+            return dots
+        row_norms = np.linalg.norm(matrix, axis=1, keepdims=True).astype(np.float64)
+        return np.divide(dots, row_norms, out=np.zeros_like(dots), where=row_norms > 0)
+
+    @classmethod
+    def from_entries(cls, entries, normalize=True):
+        """Build the index from the parsed catalog JSON (a list of entries)."""
+        # imported here: embedding_match imports this module at load time
+        from embedding_match import extract_attributes_scoring
+
+        valid_entries = []
+        for entry in entries:
+            if not all(k in entry and entry[k] is not None for k in REQUIRED_ENTRY_KEYS):
+                logger.warning(f"Skipping invalid catalog entry: {entry.get('image', 'Unknown image')}")
+                continue
+            valid_entries.append(entry)
+
+        genders = []
+        scores = []
+        key_sets = []
+        entry_attributes = []
+        for entry in valid_entries:
+            try:
+                text = entry["result"]["data"]["outputs"]["text"]
+            except (KeyError, TypeError):
+                text = "{}"
+            model_attributes, model_scoring = extract_attributes_scoring(text)
+            genders.append(normalize_gender(model_attributes.get(GENDER_ATTR, None)))
+            scores.append(parse_aesthetic_score(model_scoring.get(AESTHETIC_SCORE_ATTR, "0")))
+            key_sets.append(model_attributes.keys())
+            entry_attributes.append(model_attributes)
+
+        gender_values = sorted({gender for gender in genders if gender})
+        source_codes = np.array([gender_values.index(g) if g else -1 for g in genders], dtype=np.int16)
+        # row r of the index holds entry source_rows[r] (rows grouped by gender)
+        source_rows = gender_layout(source_codes, len(gender_values))
+
+        n = len(valid_entries)
+        attributes = sorted({attr for entry in valid_entries for attr in entry["attribute_embeddings"]})
+        dim = 0
+        for entry in valid_entries:
+            for vector in entry["attribute_embeddings"].values():
+                dim = len(vector)
+                break
+            if dim:
+                break
+
+        images = np.empty(n, dtype=object)
+        embeddings = {attr: np.zeros((n, dim), dtype=np.float32) for attr in attributes}
+        masks = {attr: np.zeros(n, dtype=bool) for attr in attributes}
+        texts = {attr: np.full(n, None, dtype=object) for attr in attributes}
+        for row, source in enumerate(source_rows):
+            entry = valid_entries[source]
+            images[row] = os.path.join(entry["image"])
+            for attr, vector in entry["attribute_embeddings"].items():
+                embeddings[attr][row] = vector
+                masks[attr][row] = True
+                texts[attr][row] = entry_attributes[source].get(attr)
+
+        gender_codes = source_codes[source_rows]
+        aesthetic_scores = np.array(scores, dtype=np.float64)[source_rows]
+
+        if normalize:
+            for matrix in embeddings.values():
+                normalize_rows(matrix)
+
+        attribute_keys = sorted({key for keys in key_sets for key in keys})
+        key_columns = {key: col for col, key in enumerate(attribute_keys)}
+        attribute_key_mask = np.zeros((n, len(attribute_keys)), dtype=bool)
+        for row, source in enumerate(source_rows):
+            attribute_key_mask[row, [key_columns[key] for key in key_sets[source]]] = True
+
+        return cls(images, gender_codes, gender_values, aesthetic_scores,
+                   embeddings, masks, attribute_keys, attribute_key_mask, normalize, source_rows, texts)
+
+    @classmethod
+    def from_json(cls, path, normalize=True):
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        return cls.from_entries(entries, normalize)
+
+    @classmethod
+    def from_binary(cls, path):
+        """Open a catalog directory written by ``save``; embeddings are read-only mmap views."""
+        with open(os.path.join(path, METADATA_FILE), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        if metadata.get("format_version") not in SUPPORTED_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported catalog format version: {metadata.get('format_version')}")
+
+        n = metadata["count"]
+        dim = metadata["dim"]
+        blob = np.zeros(0, dtype=np.float32)
+        if n and dim and metadata["attributes"]:
+            with open(os.path.join(path, EMBEDDINGS_FILE), "rb") as f:
+                # the mapping stays valid after the file object is closed
+                blob = np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.float32)
+
+        embeddings = {}
+        masks = {}
+        for attr in metadata["attributes"]:
+            start = attr["offset"] // blob.itemsize
+            embeddings[attr["name"]] = blob[start:start + n * dim].reshape(n, dim)
+            packed = np.frombuffer(base64.b64decode(attr["mask"]), dtype=np.uint8)
+            masks[attr["name"]] = np.unpackbits(packed, count=n).astype(bool)
+
+        normalized = metadata.get("normalized", False)
+        if not normalized:
+            # older builds: normalize private copies (rebuild to share the pages again)
+            logger.warning(f"Catalog {path} stores raw vectors, normalizing in memory; rebuild it with build_catalog.py")
+            embeddings = {attr: normalize_rows(np.array(matrix)) for attr, matrix in embeddings.items()}
+            normalized = True
+
+        images = np.empty(n, dtype=object)
+        images[:] = metadata["images"]
+        gender_codes = np.array(metadata["gender_codes"], dtype=np.int16)
+        aesthetic_scores = np.array(metadata["aesthetic_scores"], dtype=np.float64)
+        attribute_key_mask = np.zeros((n, len(metadata["attribute_keys"])), dtype=bool)
+        for col, packed in enumerate(metadata["attribute_key_masks"]):
+            packed = np.frombuffer(base64.b64decode(packed), dtype=np.uint8)
+            attribute_key_mask[:, col] = np.unpackbits(packed, count=n).astype(bool)
+        source_rows = np.array(metadata["source_rows"], dtype=np.int64) if "source_rows" in metadata else None
+        index = cls(images, gender_codes, metadata["gender_values"], aesthetic_scores,
+                    embeddings, masks, metadata["attribute_keys"], attribute_key_mask, normalized, source_rows)
+        index.embedding_layers = metadata.get("embedding_layers")
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """Load from a binary catalog directory or from the source JSON."""
+        index = cls.from_binary(path) if os.path.isdir(path) else cls.from_json(path)
+        index.source_path = path
+        return index
+
+    def save(self, path):
+        """
+        Write the binary catalog format to directory ``path``.
+
+        The directory is assembled next to its final location and swapped in,
+        so processes that already mapped the previous version keep a valid view.
+        """
+        n = len(self)
+        dim = self.dim
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        attributes = []
+        offset = 0
+        with open(os.path.join(tmp_path, EMBEDDINGS_FILE), "wb") as f:
+            for attr in self.attributes:
+                matrix = np.ascontiguousarray(self.embeddings[attr], dtype=np.float32)
+                f.write(matrix.tobytes())
+                attributes.append({
+                    "name": attr,
+                    "offset": offset,
+                    "mask": _pack_mask(self.masks[attr]),
+                })
+                offset += matrix.nbytes
+
+        metadata = {
+            "format_version": CATALOG_FORMAT_VERSION,
+            "count": n,
+            "dim": dim,
+            "normalized": self.normalized,
+            "embedding_layers": self.embedding_layers,
+            "attributes": attributes,
+            "images": [str(image) for image in self.images],
+            "gender_values": self.gender_values,
+            "gender_codes": [int(code) for code in self.gender_codes],
+            "aesthetic_scores": [float(score) for score in self.aesthetic_scores],
+            "source_rows": [int(row) for row in self.source_rows],
+            "attribute_keys": self.attribute_keys,
+            "attribute_key_masks": [_pack_mask(self.attribute_key_mask[:, col])
+                                    for col in range(len(self.attribute_keys))],
+        }
+        with open(os.path.join(tmp_path, METADATA_FILE), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        if self.attribute_texts is not None:
+            with open(os.path.join(tmp_path, TEXTS_FILE), "w", encoding="utf-8") as f:
+                json.dump({attr: list(texts) for attr, texts in self.attribute_texts.items()}, f, ensure_ascii=False)
+
+        old_path = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+
+
+def reembed_catalog(index, encode, layers=None, batch_size=256):
+    """
+    A copy of ``index`` whose attribute rows are ``encode(texts)`` of its own
+    attribute texts, L2-normalized, recorded as embedded with ``layers`` blocks.
+
+    Rows that carry an embedding but no text cannot be re-embedded and lose
+    that attribute, so vectors of different depths are never mixed.
+    """
+    if index.attribute_texts is None:
+        raise ValueError("catalog has no attribute texts; build it from the source JSON")
+
+    embeddings, masks = {}, {}
+    dropped = 0
+    for attr in index.attributes:
+        texts = index.attribute_texts[attr]
+        mask = index.masks[attr] & np.array([text is not None for text in texts], dtype=bool)
+        dropped += int(np.count_nonzero(index.masks[attr] & ~mask))
+        rows = np.flatnonzero(mask)
+        matrix = None
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            vectors = encode([str(texts[row]) for row in chunk])
+            if matrix is None:
+                matrix = np.zeros((len(index), vectors.shape[1]), dtype=np.float32)
+            matrix[chunk] = vectors
+        embeddings[attr] = normalize_rows(matrix if matrix is not None
+                                          else np.zeros((len(index), index.dim), dtype=np.float32))
+        masks[attr] = mask
+    if dropped:
+        logger.warning(f"{dropped} attribute embeddings without text were dropped while re-embedding")
+
+    reembedded = CatalogIndex(index.images, index.gender_codes, index.gender_values, index.aesthetic_scores,
+                              embeddings, masks, index.attribute_keys, index.attribute_key_mask, True,
+                              index.source_rows, index.attribute_texts)
+    reembedded.embedding_layers = layers
+    return reembedded
+
+
+def load_attribute_texts(path):
+    """
+    Attribute texts of a binary catalog directory as written by ``save``, or
+    None when the catalog was built without them.
+    """
+    texts_path = os.path.join(path, TEXTS_FILE)
+    if not os.path.exists(texts_path):
+        return None
+    with open(texts_path, "r", encoding="utf-8") as f:
+        return {attr: np.array(texts, dtype=object) for attr, texts in json.load(f).items()}
+
+
+def _load_catalog_index_locked(path):
+    global _catalog_index
+
+    path = path or get_catalog_path()
+    start_time = time.time()
+    try:
+        index = CatalogIndex.load(path)
+    except Exception as e:
+        logger.error(f"Failed to load catalog index from {path}: {e}")
+        return None
+    # imported here: catalog_compression subclasses CatalogIndex
+    import catalog_compression
+    index = catalog_compression.maybe_compress(index)
+    _catalog_index = index
+    logger.info(
+        f"Catalog index loaded: {len(index)} entries, {len(index.attributes)} attributes, "
+        f"took {time.time() - start_time:.2f} seconds"
+    )
+    return index
+
+
+def load_catalog_index(path=None):
+    """
+    Build the catalog index from disk and install it as the process-wide index.
+
+    Returns:
+        CatalogIndex or None: the index, or None if the catalog could not be loaded
+    """
+    with _catalog_lock:
+        return _load_catalog_index_locked(path)
+
+
+def get_catalog_index():
+    """
+    Return the process-wide catalog index, building it on first use.
+
+    Returns:
+        CatalogIndex or None: the index, or None if the catalog could not be loaded
+    """
+    index = _catalog_index
+    if index is not None:
+        return index
+    with _catalog_lock:
+        if _catalog_index is not None:
+            return _catalog_index
+        return _load_catalog_index_locked(None)
@@ -0,0 +1,170 @@
+"""
+Sharded scatter-gather scoring for embedding_match.
+
+The catalog index is split into CATALOG_SHARDS contiguous row ranges, each
+owned by a worker process that scores only its rows. Workers are forked from
+the process that loaded the catalog and hold ``row_range`` views of its
+arrays: a memory-mapped binary catalog's pages are shared through the page
+cache and in-memory arrays copy-on-write, so a shard costs no copy of the
+embeddings. A query sends the prepared user vectors to every shard at once
+and each shard answers with its local top candidates; the merge in
+embedding_match keeps the global best by (score, source row), exactly the
+order single-process ranking uses, so the result is identical.
+
+Queries are serialized per pool (one scatter-gather in flight); the parallelism
+is across shards. A pool belongs to the process that started it: a process
+forked after that (a gunicorn worker forked from a preloading master) starts
+its own pool instead of sharing the parent's pipes. A preloading master calls
+defer_shard_pools so it starts none of its own, which would never be used.
+Scoring falls back to the calling process when the pool is disabled, the
+catalog is too small to be worth the round trip, the platform cannot fork, or
+a worker failed.
+
+Configuration (environment variables):
+    CATALOG_SHARDS           worker processes, 0 or 1 scores in-process (default 0)
+    CATALOG_SHARD_MIN_ROWS   catalogs this small are always scored in-process (default 20000)
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_shard_pools = weakref.WeakKeyDictionary()
+_shard_lock = threading.Lock()
+# pid of a process that starts no pools (see defer_shard_pools)
+_deferred_pid = None
+
+
+def get_shard_config():
+    """Read the sharding settings from the environment."""
+    return {
+        "shards": int(os.environ.get("CATALOG_SHARDS", 0)),
+        "min_rows": int(os.environ.get("CATALOG_SHARD_MIN_ROWS", 20000)),
+    }
+
+
+def shard_bounds(n, n_shards):
+    """(start, stop) of ``n_shards`` contiguous row ranges of near-equal size."""
+    edges = np.linspace(0, n, n_shards + 1).astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _serve(shard, conn, score, inherited):
+    """Worker loop: answer every request with ``score(shard, request)`` until the pipe closes."""
+    # the parent's ends of this and the earlier shards' pipes came along with the fork;
+    # holding them would keep the pipes open after the pool closes its ends
+    for parent_conn in inherited:
+        parent_conn.close()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((True, score(shard, request)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class ShardPool:
+    """
+    One forked worker process per row range of ``catalog``; ``score(shard,
+    request)`` runs in the workers against the shard's view of the catalog.
+    """
+
+    def __init__(self, catalog, n_shards, score):
+        self.bounds = shard_bounds(len(catalog), n_shards)
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conns = []
+        self._processes = []
+        context = multiprocessing.get_context("fork")
+        for start, stop in self.bounds:
+            parent_conn, child_conn = context.Pipe()
+            # forked: the view and the score function are inherited, not pickled
+            process = context.Process(target=_serve, args=(catalog.row_range(start, stop), child_conn, score,
+                                                           self._conns + [parent_conn]),
+                                      name=f"catalog-shard-{start}-{stop}", daemon=True)
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+    def scatter(self, requests):
+        """Send one request per shard and return the shards' results in shard order."""
+        with self._lock:
+            for conn, request in zip(self._conns, requests):
+                conn.send(request)
+            replies = [conn.recv() for conn in self._conns]
+        errors = [reply for ok, reply in replies if not ok]
+        if errors:
+            raise RuntimeError(f"catalog shard failed: {errors[0]}")
+        return [reply for _, reply in replies]
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+
+def defer_shard_pools():
+    """
+    Start no pool in the calling process; processes forked from it start
+    their own on first use. For a process that only loads and forks workers.
+    """
+    global _deferred_pid
+    _deferred_pid = os.getpid()
+
+
+def get_shard_pool(catalog, score):
+    """
+    The shard pool for ``catalog``, started on first use, or None when sharding
+    is disabled, the catalog is small, the process deferred its pools, or the
+    pool could not be started.
+    """
+    config = get_shard_config()
+    if config["shards"] <= 1 or len(catalog) < max(config["min_rows"], config["shards"]):
+        return None
+    if _deferred_pid == os.getpid():
+        return None
+    # sparse lexical catalogs (lexical_match) are scored in-process
+    if getattr(catalog, "sparse", False):
+        return None
+
+    pool = _shard_pools.get(catalog)
+    if pool is None or (pool and pool.pid != os.getpid()):
+        with _shard_lock:
+            pool = _shard_pools.get(catalog)
+            # a pool inherited through fork is the parent's; its workers are not our children
+            if pool is None or (pool and pool.pid != os.getpid()):
+                start_time = time.time()
+                try:
+                    pool = ShardPool(catalog, config["shards"], score)
+                    logger.info(f"Catalog shard pool started: {config['shards']} workers over {len(catalog)} "
+                                f"entries, took {time.time() - start_time:.2f} seconds")
+                except Exception as e:
+                    # remembered so requests do not retry; scoring stays in-process
+                    logger.error(f"Failed to start catalog shard pool, scoring in-process: {e}")
+                    pool = False
+                _shard_pools[catalog] = pool
+    return pool or None
+
+
+def disable_shard_pool(catalog, error):
+    """Stop a failed pool; ``catalog`` is scored in-process from then on."""
+    with _shard_lock:
+        pool = _shard_pools.get(catalog)
+        _shard_pools[catalog] = False
+    logger.error(f"Catalog shard pool failed, scoring in-process from now on: {error}")
+    if pool:
+        pool.close()
@@ -0,0 +1,289 @@
+"""
+Embedding model backends for embedding_match.
+
+The backend is chosen with the EMBEDDING_BACKEND environment variable:
+    fp32   the model as published (default)
+    int8   PyTorch dynamic int8 quantization of every nn.Linear, CPU only;
+           weights are quantized once at load time and activations on the fly
+
+Use benchmarks/verify_backend.py to measure drift, ranking agreement, speed
+and size of a backend against fp32 before switching production to it.
+
+On top of either backend, EMBEDDING_COMPILE builds a CLS-only encoder once at
+preload time to cut Python dispatch overhead on the many small batches:
+    off      eager model (default)
+    trace    torch.jit.trace + freeze; cached under EMBEDDING_TRACE_CACHE when set
+    compile  torch.compile(dynamic=True)
+A compiled encoder that fails validation or raises at run time falls back to
+the eager model. benchmarks/bench_encoder.py compares the latencies.
+
+EMBEDDING_LAYERS keeps only the first N transformer blocks (early exit; unset
+or 0 runs all of them). The CLS vectors then come from a shallower layer and
+are only comparable with a catalog embedded at the same depth: build it with
+``build_catalog.py --layers N``, which records the depth in the catalog
+metadata. benchmarks/bench_layers.py reports the latency saving and ranking
+agreement of every depth against the full model.
+
+The model is loaded from the local snapshot written by export_model.py when
+one exists for it (see model_snapshot; weights memory-mapped, no network
+access), and from the Hugging Face hub otherwise.
+"""
+
+import hashlib
+import logging
+import os
+
+import model_snapshot
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "fp32"
+BACKENDS = ("fp32", "int8")
+
+
+def get_backend_name():
+    """Configured backend name, falling back to fp32 for unknown values."""
+    backend = os.environ.get("EMBEDDING_BACKEND", DEFAULT_BACKEND).lower()
+    if backend not in BACKENDS:
+        logger.warning(f"Unknown EMBEDDING_BACKEND {backend!r}, using {DEFAULT_BACKEND}")
+        return DEFAULT_BACKEND
+    return backend
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of the model's linear layers (returns a new module)."""
+    import torch
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def apply_backend(model, device, backend):
+    """
+    Convert a loaded fp32 model to ``backend``.
+
+    Quantized kernels only exist for CPU, so int8 on a GPU device keeps fp32.
+
+    Returns:
+        tuple: (model, backend name actually applied)
+    """
+    model.eval()
+    if backend == "int8":
+        if getattr(device, "type", str(device)) != "cpu":
+            logger.warning(f"int8 backend needs a CPU device, keeping fp32 on {device}")
+            return model, "fp32"
+        return quantize_int8(model), "int8"
+    return model, "fp32"
+
+
+def get_layer_count():
+    """Configured number of transformer blocks to run, 0 for all of them."""
+    return int(os.environ.get("EMBEDDING_LAYERS", 0) or 0)
+
+
+def _layer_list(model):
+    # DistilBERT keeps its blocks in transformer.layer, BERT-style models in encoder.layer
+    for owner_name in ("transformer", "encoder"):
+        owner = getattr(model, owner_name, None)
+        if owner is not None and hasattr(owner, "layer"):
+            return owner
+    raise ValueError(f"Cannot find the transformer blocks of {type(model).__name__}")
+
+
+def embedding_layers(model):
+    """Number of transformer blocks ``model`` runs."""
+    return len(_layer_list(model).layer)
+
+
+def truncate_layers(model, n_layers):
+    """
+    Keep the first ``n_layers`` transformer blocks of ``model`` (in place).
+
+    0, or a count at or above the model's depth, keeps every block.
+
+    Returns:
+        tuple: (model, number of blocks kept)
+    """
+    owner = _layer_list(model)
+    total = len(owner.layer)
+    if not n_layers or n_layers >= total:
+        return model, total
+    if n_layers < 0:
+        raise ValueError(f"Invalid layer count: {n_layers}")
+    owner.layer = owner.layer[:n_layers]
+    # head masks and the config-driven loops size themselves from the config
+    for name in ("n_layers", "num_hidden_layers"):
+        if hasattr(model.config, name):
+            setattr(model.config, name, n_layers)
+    return model, n_layers
+
+
+def load_embedding_model(model_name, device, backend=None, n_layers=None):
+    """
+    Load the tokenizer and the embedding model, truncated to ``n_layers``
+    blocks (EMBEDDING_LAYERS by default) and converted to the configured backend.
+
+    Returns:
+        tuple: (tokenizer, model, backend name actually applied)
+    """
+    from transformers import AutoModel, AutoTokenizer
+
+    backend = backend or get_backend_name()
+    snapshot = model_snapshot.find_snapshot(model_name)
+    model = None
+    if snapshot is not None:
+        try:
+            tokenizer, model = model_snapshot.load_snapshot(snapshot, "cpu")
+            weights = f"snapshot:{model_snapshot.snapshot_fingerprint(snapshot)}"
+        except Exception as e:
+            logger.error(f"Failed to load model snapshot {snapshot}, loading {model_name} from the hub: {e}")
+    if model is None:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        weights = f"hub:{model_name}@{getattr(model.config, '_commit_hash', None)}"
+    # truncated before quantization so dropped blocks are never converted
+    model, _ = truncate_layers(model, get_layer_count() if n_layers is None else n_layers)
+    model, backend = apply_backend(model.to(device), device, backend)
+    model._weights_identity = weights
+    model._embedding_backend = backend
+    return tokenizer, model, backend
+
+
+def weights_identity(model):
+    """
+    Where the weights of ``model`` (or of the eager model behind a compiled
+    encoder) came from, as recorded by load_embedding_model: the snapshot
+    fingerprint, or the hub name and revision. None for models loaded elsewhere.
+    """
+    return getattr(getattr(model, "eager_model", model), "_weights_identity", None)
+
+
+COMPILE_MODES = ("off", "trace", "compile")
+_VALIDATION_TEXTS = ["male", "slim build with long limbs and softly defined lines", "oval face"]
+
+
+def get_compile_mode():
+    """Configured compile mode, falling back to off for unknown values."""
+    mode = os.environ.get("EMBEDDING_COMPILE", "off").lower()
+    if mode not in COMPILE_MODES:
+        logger.warning(f"Unknown EMBEDDING_COMPILE {mode!r}, using eager model")
+        return "off"
+    return mode
+
+
+class CompiledClsEncoder:
+    """
+    CLS-only wrapper around a traced or compiled encoder.
+
+    encode_texts calls ``encode_cls``; calling the wrapper itself runs the eager
+    model with the full HuggingFace outputs. The first run-time failure of the
+    compiled module switches the wrapper to the eager model for good.
+    """
+
+    def __init__(self, eager_model, compiled, mode):
+        self.eager_model = eager_model
+        self.compiled = compiled
+        self.mode = mode
+
+    def __call__(self, **inputs):
+        return self.eager_model(**inputs)
+
+    def eager_cls(self, input_ids, attention_mask):
+        return self.eager_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, 0, :]
+
+    def encode_cls(self, input_ids, attention_mask):
+        compiled = self.compiled
+        if compiled is not None:
+            try:
+                return compiled(input_ids, attention_mask)
+            except Exception as e:
+                logger.error(f"{self.mode} encoder failed, falling back to the eager model: {e}")
+                self.compiled = None
+                self.mode = "off"
+        return self.eager_cls(input_ids, attention_mask)
+
+
+def _cls_module(model):
+    import torch
+
+    class ClsHead(torch.nn.Module):
+        """Only the CLS row of the last hidden state, as a plain tensor output."""
+
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0][:, 0, :]
+
+    return ClsHead(model).eval()
+
+
+def _trace_cache_path(weights, backend, n_layers):
+    import torch
+    cache_dir = os.environ.get("EMBEDDING_TRACE_CACHE")
+    # a model of unknown origin is traced afresh rather than risk loading another model's trace
+    if not cache_dir or not weights:
+        return None
+    # artifacts are only valid for the same weights, depth, backend and torch build
+    key = hashlib.sha1(f"{weights}|{n_layers}|{backend}|{torch.__version__}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"cls_encoder_{backend}_{key}.pt")
+
+
+def _trace(model, tokenizer, device, cache_path):
+    import torch
+
+    if cache_path and os.path.exists(cache_path):
+        logger.info(f"Loading traced encoder from {cache_path}")
+        return torch.jit.load(cache_path, map_location=device)
+
+    example = tokenizer(_VALIDATION_TEXTS[:2], return_tensors="pt", padding=True).to(device)
+    with torch.no_grad():
+        traced = torch.jit.trace(_cls_module(model), (example["input_ids"], example["attention_mask"]),
+                                 check_trace=False)
+    traced = torch.jit.freeze(traced.eval())
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        torch.jit.save(traced, tmp_path)
+        os.replace(tmp_path, cache_path)
+    return traced
+
+
+def _validate(encoder, tokenizer, device, atol=1e-3):
+    """The compiled path must reproduce the eager CLS vectors on shapes it was not built with."""
+    import torch
+
+    inputs = tokenizer(_VALIDATION_TEXTS, return_tensors="pt", padding=True).to(device)
+    with torch.no_grad():
+        expected = encoder.eager_cls(inputs["input_ids"], inputs["attention_mask"])
+        actual = encoder.compiled(inputs["input_ids"], inputs["attention_mask"])
+    difference = float((expected - actual).abs().max())
+    if difference > atol:
+        raise ValueError(f"compiled encoder differs from eager by {difference:.2e}")
+
+
+def compile_encoder(model, tokenizer, device, mode=None, backend=DEFAULT_BACKEND):
+    """
+    Build the CLS encoder for ``mode`` (EMBEDDING_COMPILE by default).
+
+    Returns:
+        tuple: (model or CompiledClsEncoder, compile mode actually applied)
+    """
+    mode = mode or get_compile_mode()
+    if mode == "off":
+        return model, "off"
+
+    import torch
+    try:
+        if mode == "trace":
+            # the backend recorded at load time wins over the argument, which callers may leave at fp32
+            backend = getattr(model, "_embedding_backend", backend)
+            cache_path = _trace_cache_path(weights_identity(model), backend, embedding_layers(model))
+            compiled = _trace(model, tokenizer, device, cache_path)
+        else:
+            compiled = torch.compile(_cls_module(model), dynamic=True)
+        encoder = CompiledClsEncoder(model, compiled, mode)
+        _validate(encoder, tokenizer, device)
+    except Exception as e:
+        logger.error(f"Failed to build {mode} encoder, using the eager model: {e}")
+        return model, "off"
+    return encoder, mode
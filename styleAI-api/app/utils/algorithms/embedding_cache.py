@@ -0,0 +1,70 @@
+"""
+Bounded, thread-safe LRU cache for attribute-text embeddings.
+
+Attribute values repeat heavily across users ("Male", "Slim", "Oval", palette
+names...), so generate_embeddings looks every normalized text up here first
+and only sends the misses through the model.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """LRU mapping from a hashable key to an embedding vector, with hit/miss counters."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        """Cached vectors for ``keys`` in order, None where missing."""
+        if self.maxsize <= 0:
+            return [None] * len(keys)
+        results = []
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                results.append(vector)
+        return results
+
+    def put_many(self, keys, vectors):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = vector.copy()
+                # shared between requests, so never mutated in place
+                vector.flags.writeable = False
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
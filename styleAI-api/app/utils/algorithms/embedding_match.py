@@ -1,10 +1,17 @@
+import itertools
 import json
-import torch
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import time
 import os
+import threading
+import weakref
 
+import catalog_ann
+import catalog_filters
+import catalog_index
+import catalog_shards
+import embedding_backends
+from embedding_cache import EmbeddingCache
 
 
 # weights for important attributes
@@ -21,6 +28,47 @@ WEIGHTS = {
 THRESHOLD = 0.95  # square similarity threshold, below which a penalty is applied
 PENALTY_VALUE = 0.3  # punishment value, to which attributes are adjusted if below threshold
 
+# user attributes that are also compared against a differently named catalog attribute
+MAPPED_ATTRS = {
+    "Clothing Color Optimization Suggestions": "Clothing Color Description",
+    "Style Optimization and Temperament Enhancement Suggestions": "Style and Temperament Description"
+}
+
+GENDER_ATTR = catalog_index.GENDER_ATTR
+GENDER_PENALTY = 0.1  # small penalty for gender mismatch, entries are not excluded
+# float headroom on the "adjusted similarity <= 1" bound used to skip rows
+_BOUND_SLACK = 1e-6
+TOP_K = 5  # candidates re-ranked by aesthetic score
+
+# users scored together by match_catalog_batch, bounds its (catalog rows x users) arrays
+MATCH_BATCH_USERS = int(os.environ.get("MATCH_BATCH_USERS", 256))
+# attribute texts per generate_embeddings call in batch_top_matches
+MATCH_BATCH_TEXTS = int(os.environ.get("MATCH_BATCH_TEXTS", 256))
+# batch candidates per user re-scored one user at a time before ranking
+_BATCH_RESCORE = 50
+
+# bounded LRU cache of attribute-text embeddings, 0 disables it
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 4096))
+_embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+# cache keys of models load_embedding_model did not load: one per model object, never reused
+_model_tokens = weakref.WeakKeyDictionary()
+_model_token_counter = itertools.count()
+_model_token_lock = threading.Lock()
+
+# attribute paths each catalog can score, computed once per catalog index
+_scorable_attributes = weakref.WeakKeyDictionary()
+_scorable_lock = threading.Lock()
+
+# print the per-attribute breakdown of the returned candidates
+MATCH_DEBUG = os.environ.get("MATCH_DEBUG", "0") == "1"
+
+# token-length classes for bucketed tokenization; texts longer than the last
+# boundary share one final bucket, an empty list pads everything together
+MAX_TOKENS = 512
+LENGTH_BUCKETS = tuple(int(b) for b in os.environ.get("EMBEDDING_LENGTH_BUCKETS", "8,16,32,64,128").split(",") if b)
+_padding_stats = {"texts": 0, "forward_passes": 0, "real_tokens": 0, "padded_tokens": 0, "unbucketed_tokens": 0}
+_padding_lock = threading.Lock()
+
 # # attribute extraction
 # def extract_attributes(text):
 #     try:
@@ -74,151 +122,623 @@ def extract_attributes_scoring(text):
         print(f"Error parsing text: {e}")
         return {}, {}
 
-def generate_embeddings(texts, tokenizer, model, device):
+def bucket_by_length(lengths, boundaries=LENGTH_BUCKETS):
+    """Positions grouped into token-length classes, shortest class first, each sorted by length."""
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind="stable")
+    classes = np.searchsorted(np.asarray(boundaries, dtype=np.int64), lengths[order])
+    return [order[classes == c] for c in np.unique(classes)]
+
+def _encode_cls(model, inputs):
+    # traced/compiled encoders (embedding_backends) return the CLS rows directly
+    encode_cls = getattr(model, "encode_cls", None)
+    if encode_cls is not None:
+        return encode_cls(inputs["input_ids"], inputs["attention_mask"])
+    return model(**inputs).last_hidden_state[:, 0, :]
+
+def encode_texts(normalized_texts, tokenizer, model, device, boundaries=None):
+    """
+    Run the model over already normalized texts and return their CLS embeddings.
+
+    Texts are split into token-length buckets and every bucket is padded only to
+    its own longest text, so short values ("male", "oval") no longer pay for the
+    attention cost of a long description. Rows come back in input order.
+
+    Args:
+        boundaries: token-length bucket boundaries, LENGTH_BUCKETS by default
+    """
+    # imported here so the lexical backend can use this module without torch
+    import torch
+
+    lengths = [len(ids) for ids in tokenizer(normalized_texts, truncation=True, max_length=MAX_TOKENS)["input_ids"]]
+    embeddings = None
+    padded_tokens = 0
+    buckets = bucket_by_length(lengths, LENGTH_BUCKETS if boundaries is None else boundaries)
+    for rows in buckets:
+        inputs = tokenizer([normalized_texts[i] for i in rows], return_tensors="pt",
+                           padding=True, truncation=True, max_length=MAX_TOKENS).to(device)
+        with torch.no_grad():
+            cls_embeddings = _encode_cls(model, inputs).cpu().numpy()
+        if embeddings is None:
+            embeddings = np.empty((len(normalized_texts), cls_embeddings.shape[1]), dtype=cls_embeddings.dtype)
+        embeddings[rows] = cls_embeddings
+        padded_tokens += inputs["input_ids"].numel()
+
+    with _padding_lock:
+        _padding_stats["texts"] += len(lengths)
+        _padding_stats["forward_passes"] += len(buckets)
+        _padding_stats["real_tokens"] += sum(lengths)
+        _padding_stats["padded_tokens"] += padded_tokens
+        _padding_stats["unbucketed_tokens"] += max(lengths, default=0) * len(lengths)
+    return embeddings
+
+def get_padding_stats():
+    """
+    Token counts of every forward pass so far. ``padding_ratio`` is the share of
+    pad tokens actually run; ``unbucketed_padding_ratio`` is what padding all
+    texts of a call together would have cost.
+    """
+    with _padding_lock:
+        stats = dict(_padding_stats)
+    padded, unbucketed = stats["padded_tokens"], stats["unbucketed_tokens"]
+    stats["padding_ratio"] = 1 - stats["real_tokens"] / padded if padded else 0.0
+    stats["unbucketed_padding_ratio"] = 1 - stats["real_tokens"] / unbucketed if unbucketed else 0.0
+    return stats
+
+def get_embedding_cache():
+    return _embedding_cache
+
+def _model_cache_key(model):
+    """
+    The part of the embedding cache key that identifies ``model``'s vectors.
+
+    A model from load_embedding_model is keyed on its weights (snapshot
+    fingerprint or hub revision), backend, depth and compile mode, so
+    reloading the same model keeps its entries and a swapped model never
+    reads them. Any other model gets a token of its own: unlike id(), it is
+    not handed to a later model once this one is freed.
+    """
+    weights = embedding_backends.weights_identity(model)
+    if weights is not None:
+        eager = getattr(model, "eager_model", model)
+        return (weights, getattr(eager, "_embedding_backend", None), embedding_backends.embedding_layers(eager),
+                getattr(model, "mode", "off"))
+    with _model_token_lock:
+        token = _model_tokens.get(model)
+        if token is None:
+            token = _model_tokens[model] = ("model", next(_model_token_counter))
+        return token
+
+def generate_embeddings(texts, tokenizer, model, device, batcher=None):
+    """
+    Embeddings for ``texts`` in order. Cache misses go through ``batcher`` when
+    one is given, so concurrent requests share a single forward pass.
+    """
     normalized_texts = [" ".join(text.lower().split()) for text in texts]
-    inputs = tokenizer(normalized_texts, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    return outputs.last_hidden_state[:, 0, :].cpu().numpy()
 
-def top_matches(user_text, model_data, tokenizer, model, device):
+    # keyed by model as well, so vectors from different models or backends never mix
+    model_key = _model_cache_key(model)
+    keys = [(model_key, text) for text in normalized_texts]
+    cached = _embedding_cache.get_many(keys)
+    missing = list(dict.fromkeys(text for text, vector in zip(normalized_texts, cached) if vector is None))
+    if not missing:
+        return np.stack(cached) if cached else np.zeros((0, 0), dtype=np.float32)
+
+    if batcher is not None:
+        fresh = batcher.embed(missing)
+    else:
+        fresh = encode_texts(missing, tokenizer, model, device)
+    _embedding_cache.put_many([(model_key, text) for text in missing], fresh)
+    fresh_by_text = dict(zip(missing, fresh))
+    return np.stack([vector if vector is not None else fresh_by_text[text]
+                     for text, vector in zip(normalized_texts, cached)])
+
+def _adjust(squared_sim, weight):
+    # attributes with the default weight are penalized below the threshold
+    if weight == 1.0:
+        return np.where(squared_sim >= THRESHOLD, squared_sim, PENALTY_VALUE)
+    return squared_sim
+
+def _take(array, rows):
+    return array if rows is None else array[rows]
+
+def _count(rows):
+    # gender partitions may be slices of the index
+    return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+def scorable_attributes(catalog):
+    """
+    User attribute paths that can ever contribute to a score against ``catalog``:
+    its own attribute paths plus the MAPPED_ATTRS keys whose target it carries.
+    """
+    attributes = _scorable_attributes.get(catalog)
+    if attributes is None:
+        attributes = frozenset(catalog.embeddings) | frozenset(
+            user_key for user_key, model_key in MAPPED_ATTRS.items() if model_key in catalog.embeddings)
+        with _scorable_lock:
+            _scorable_attributes[catalog] = attributes
+    return attributes
+
+def _score_pairs(user_emb_dict, catalog):
+    """(user_key, model_key, is_common) for every attribute comparison, in scoring order."""
+    pairs = [(attr, attr, True) for attr in user_emb_dict if attr in catalog.embeddings]
+    pairs += [(user_key, model_key, False) for user_key, model_key in MAPPED_ATTRS.items()
+              if user_key in user_emb_dict and model_key in catalog.embeddings]
+    return pairs
+
+def score_catalog(user_emb_dict, catalog, user_gender=None, rows=None):
+    """
+    Score every catalog entry against the user's attribute embeddings at once.
+
+    Applies the same rules as the original per-entry loop: squared cosine
+    similarity per common attribute, WEIGHTS, the THRESHOLD/PENALTY_VALUE rule,
+    the MAPPED_ATTRS cross comparisons and the gender penalty.
+
+    Args:
+        rows: optional sorted array of catalog rows to score (e.g. an ANN shortlist),
+            or a slice of contiguous rows
+
+    Returns:
+        tuple: (similarity, valid) arrays over the scored rows; ``valid`` is False
+        for entries sharing no attribute with the user, which are never ranked
+    """
+    n = len(_take(catalog.gender_codes, rows))
+    total_weighted_similarity = np.zeros(n, dtype=np.float64)
+    total_weight = np.zeros(n, dtype=np.float64)
+    has_common = np.zeros(n, dtype=bool)
+
+    for user_key, model_key, is_common in _score_pairs(user_emb_dict, catalog):
+        mask = _take(catalog.masks[model_key], rows)
+        sim = catalog.cosine(model_key, user_emb_dict[user_key], rows)
+        weight = WEIGHTS.get(user_key, 1.0)
+        adjusted_sim = _adjust(sim ** 2, weight)
+        total_weighted_similarity += np.where(mask, weight * adjusted_sim, 0.0)
+        total_weight += np.where(mask, weight, 0.0)
+        if is_common:
+            has_common |= mask
+
+    weighted_avg_similarity = np.divide(total_weighted_similarity, total_weight,
+                                        out=np.zeros(n, dtype=np.float64), where=total_weight > 0)
+
+    gender_penalty = np.where(_take(catalog.gender_mismatch(user_gender), rows), GENDER_PENALTY, 0.0)
+
+    similarity = np.maximum(0, weighted_avg_similarity - gender_penalty)
+    return similarity, has_common
+
+def _prune_by_bound(user_emb_dict, catalog, rows, cutoff):
+    """
+    Rows of a gender-penalized partition whose score can still reach ``cutoff``.
+
+    Every adjusted similarity is at most 1, so a row's weighted average is
+    bounded by replacing its not yet scored attributes with 1. Attributes are
+    scored heaviest first and rows are dropped as soon as their bound minus
+    GENDER_PENALTY falls below the cutoff; before the first attribute the bound
+    is 1 - GENDER_PENALTY for every row, which skips the whole partition when
+    the cutoff is above it.
+    """
+    row_ids = np.arange(len(catalog))[rows]
+    n = len(row_ids)
+    pairs = sorted(_score_pairs(user_emb_dict, catalog), key=lambda pair: -WEIGHTS.get(pair[0], 1.0))
+    total_weight = np.zeros(n, dtype=np.float64)
+    for user_key, model_key, _ in pairs:
+        total_weight += np.where(catalog.masks[model_key][rows], WEIGHTS.get(user_key, 1.0), 0.0)
+    scored_similarity = np.zeros(n, dtype=np.float64)
+    scored_weight = np.zeros(n, dtype=np.float64)
+
+    alive = np.ones(n, dtype=bool)
+    for step in range(len(pairs) + 1):
+        bound = np.divide(scored_similarity + (total_weight - scored_weight), total_weight,
+                          out=np.zeros(n, dtype=np.float64), where=total_weight > 0)
+        alive &= np.maximum(0, bound - GENDER_PENALTY) + _BOUND_SLACK >= cutoff
+        if step == len(pairs) or not alive.any():
+            break
+        user_key, model_key, _ = pairs[step]
+        positions = np.flatnonzero(alive)
+        # views of the partition while nothing has been dropped yet
+        subset = rows if len(positions) == n else row_ids[positions]
+        weight = WEIGHTS.get(user_key, 1.0)
+        mask = catalog.masks[model_key][subset]
+        sim = catalog.cosine(model_key, user_emb_dict[user_key], subset)
+        scored_similarity[positions] += np.where(mask, weight * _adjust(sim ** 2, weight), 0.0)
+        scored_weight[positions] += np.where(mask, weight, 0.0)
+    return rows if alive.all() else row_ids[alive]
+
+def score_catalog_partitioned(user_emb_dict, catalog, user_gender=None, rows=None, k=TOP_K):
+    """
+    score_catalog for ranking the best ``k`` rows, with fewer rows scored.
+
+    The rows without a gender penalty are scored first; their k-th best score
+    is the cutoff the penalized rows have to reach, and rows that provably
+    cannot (see _prune_by_bound) are left unscored and marked invalid. Rows
+    that can make the top ``k`` get exactly the score_catalog values, so the
+    ranking is identical.
+    """
+    if rows is None:
+        # contiguous gender blocks of the index, scored as matrix views
+        matching, penalized = catalog.gender_partitions(user_gender)
+        n = len(catalog)
+    else:
+        mismatch = catalog.gender_mismatch(user_gender)[rows]
+        matching, penalized = np.flatnonzero(~mismatch), np.flatnonzero(mismatch)
+        n = len(rows)
+    if not _count(matching) or not _count(penalized):
+        return score_catalog(user_emb_dict, catalog, user_gender, rows)
+
+    similarity = np.zeros(n, dtype=np.float64)
+    valid = np.zeros(n, dtype=bool)
+    similarity[matching], valid[matching] = score_catalog(user_emb_dict, catalog, user_gender,
+                                                          matching if rows is None else rows[matching])
+
+    top = _top_positions(similarity[matching], valid[matching], k)
+    cutoff = similarity[matching][top[-1]] if len(top) == k else -np.inf
+    if rows is None:
+        survivors = _prune_by_bound(user_emb_dict, catalog, penalized, cutoff)
+        positions = survivors
+    else:
+        survivors = _prune_by_bound(user_emb_dict, catalog, rows[penalized], cutoff)
+        positions = penalized[np.isin(rows[penalized], survivors, assume_unique=True)]
+    if _count(positions):
+        similarity[positions], valid[positions] = score_catalog(user_emb_dict, catalog, user_gender, survivors)
+    return similarity, valid
+
+def _top_positions(similarity, valid, k, order=None):
+    """
+    Positions of the ``k`` highest valid scores, best first.
+
+    Ties are broken by ``order`` (the rows' source catalog positions), or by
+    position when it is None. np.partition finds the k-th best score in linear
+    time and only the scores at or above it (the top k plus any ties at the
+    cutoff) are sorted, so the result is exactly what a full stable sort of
+    the source catalog would give.
+    """
+    positions = np.flatnonzero(valid)
+    scores = similarity[positions]
+    if k <= 0:
+        return positions[:0]
+    if len(positions) > k:
+        cutoff = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= cutoff
+        positions, scores = positions[keep], scores[keep]
+    if order is None:
+        ranked = np.argsort(-scores, kind="stable")
+    else:
+        ranked = np.lexsort((order[positions], -scores))
+    return positions[ranked][:k]
+
+def rank_matches(similarity, valid, catalog, k=TOP_K, rows=None):
+    """
+    Top ``k`` rows by similarity, re-ranked by aesthetic score.
+
+    Ties keep source catalog order exactly like list.sort did, also when the
+    index stores its rows grouped by gender. Returns catalog row numbers, also
+    when ``rows`` restricted the scoring.
+    """
+    positions = _top_positions(similarity, valid, k, _take(catalog.source_rows, rows))
+    top_k = positions if rows is None else rows[positions]
+    return top_k[np.argsort(-catalog.aesthetic_scores[top_k], kind="stable")]
+
+def top_candidates(similarity, valid, catalog, count, rows=None):
+    """The ``count`` best scored rows as a sorted array of catalog row numbers."""
+    positions = _top_positions(similarity, valid, count, _take(catalog.source_rows, rows))
+    return np.sort(positions if rows is None else rows[positions])
+
+def explain_matches(user_emb_dict, catalog, top_rows, user_gender=None):
+    """
+    Per-candidate breakdown for ``top_rows`` only: final similarity, aesthetic
+    score and the cosine similarity of every contributing attribute (mapped
+    attributes under the user key), like the old per-entry results list.
+    """
+    exact = getattr(catalog, "exact", None)
+    if exact is not None:
+        catalog = exact
+    query = catalog.prepare_query(user_emb_dict)
+    rows = np.sort(np.asarray(top_rows))
+    similarity, _ = score_catalog(query, catalog, user_gender, rows)
+
+    contributions = {row: {} for row in rows.tolist()}
+    for user_key, model_key, _ in _score_pairs(query, catalog):
+        sim = catalog.cosine(model_key, query[user_key], rows)
+        for row, present, value in zip(rows.tolist(), catalog.masks[model_key][rows], sim):
+            if present:
+                contributions[row][user_key] = float(value)
+
+    by_row = dict(zip(rows.tolist(), similarity))
+    return [{
+        "image": catalog.images[row],
+        "similarity": float(by_row[row]),
+        "contributions": contributions[row],
+        "score": float(catalog.aesthetic_scores[row]),
+    } for row in np.asarray(top_rows).tolist()]
+
+def shard_candidates(shard, request):
+    """
+    Worker side of sharded scoring: the ``count`` best rows of one shard
+    (shard row numbers, best first) and their scores.
+
+    With ``cutoff`` None the shard's rows without a gender penalty are scored;
+    otherwise its penalized rows that can still reach the global ``cutoff``
+    (see _prune_by_bound), the two halves of score_catalog_partitioned.
+    """
+    query, user_gender, rows, count, cutoff = request
+    if rows is None:
+        matching, penalized = shard.gender_partitions(user_gender)
+    else:
+        mismatch = shard.gender_mismatch(user_gender)[rows]
+        matching, penalized = rows[~mismatch], rows[mismatch]
+    target = matching if cutoff is None else penalized
+    if _count(target) and cutoff is not None:
+        target = _prune_by_bound(query, shard, target, cutoff)
+    if not _count(target):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    similarity, valid = score_catalog(query, shard, user_gender, target)
+    positions = _top_positions(similarity, valid, count, _take(shard.source_rows, target))
+    return np.arange(len(shard))[target][positions], similarity[positions]
+
+def _gather(pool, requests):
+    """Scatter one request per shard; the returned rows and scores, as catalog rows."""
+    results = pool.scatter(requests)
+    rows = np.concatenate([shard_rows + start for (shard_rows, _), (start, _) in zip(results, pool.bounds)])
+    return rows, np.concatenate([scores for _, scores in results])
+
+def _score_sharded(pool, query, catalog, user_gender, rows, count):
+    """
+    score_catalog_partitioned across the shard pool, returning only the rows
+    that can make the top ``count``.
+
+    Every shard first returns its best ``count`` rows without a gender
+    penalty; the global ``count``-th of those is the cutoff each shard then
+    prunes its penalized rows against. Every row of the global top ``count``
+    is in its shard's top ``count`` of its half, so ranking the gathered rows
+    gives the single-process result.
+
+    Returns:
+        tuple: (similarity, valid, rows) over the gathered catalog rows
+    """
+    local_rows = [None if rows is None else rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)] - start
+                  for start, stop in pool.bounds]
+    gathered, similarity = _gather(pool, [(query, user_gender, local, count, None) for local in local_rows])
+    mismatch = catalog.gender_mismatch(user_gender)
+    if mismatch.any() if rows is None else mismatch[rows].any():
+        top = _top_positions(similarity, np.ones(len(gathered), dtype=bool), count, catalog.source_rows[gathered])
+        cutoff = similarity[top[-1]] if len(top) == count else -np.inf
+        penalized_rows, penalized_similarity = _gather(
+            pool, [(query, user_gender, local, count, cutoff) for local in local_rows])
+        gathered = np.concatenate([gathered, penalized_rows])
+        similarity = np.concatenate([similarity, penalized_similarity])
+    return similarity, np.ones(len(gathered), dtype=bool), gathered
+
+def match_catalog(user_emb_dict, catalog, user_gender=None, rows=None):
+    """
+    Catalog rows of the best matches for the user's embeddings, best first.
+
+    Runs the optional ANN shortlist and scores in the catalog's own space,
+    on the shard pool when CATALOG_SHARDS is set, skipping gender-penalized
+    rows that cannot reach the top; a compressed catalog that keeps its
+    full-precision source re-scores its top candidates exactly before the
+    final ranking.
+
+    Args:
+        rows: optional sorted array of the only catalog rows that may match
+            (a filter selection); they are scored exactly, without the ANN shortlist
+    """
+    query = catalog.prepare_query(user_emb_dict)
+    # optional approximate shortlist; None means score the whole catalog
+    candidate_rows = catalog_ann.shortlist(catalog, query) if rows is None else rows
+    exact = getattr(catalog, "exact", None)
+    needed = catalog.rescore if exact is not None else TOP_K
+    similarity = None
+    pool = catalog_shards.get_shard_pool(catalog, shard_candidates)
+    if pool is not None:
+        try:
+            similarity, valid, candidate_rows = _score_sharded(pool, query, catalog, user_gender,
+                                                                candidate_rows, needed)
+        except Exception as e:
+            catalog_shards.disable_shard_pool(catalog, e)
+    if similarity is None:
+        similarity, valid = score_catalog_partitioned(query, catalog, user_gender, candidate_rows, needed)
+
+    if exact is not None:
+        candidate_rows = top_candidates(similarity, valid, catalog, catalog.rescore, candidate_rows)
+        similarity, valid = score_catalog(user_emb_dict, exact, user_gender, candidate_rows)
+    return rank_matches(similarity, valid, catalog, rows=candidate_rows)
+
+def score_catalog_batch(user_emb_dicts, catalog, user_genders):
+    """
+    score_catalog for several users at once.
+
+    Each attribute comparison is a single matrix product of the catalog
+    matrix with the vectors of every user carrying that attribute, adjusted
+    in place over the whole (catalog rows x users) block. The per-user weight
+    totals and "has a common attribute" flags are products of the row masks
+    with the users' attribute weights, exact in float64.
+
+    Returns:
+        tuple: (similarity, valid) arrays of shape (len(catalog), len(user_emb_dicts))
+    """
+    n, count = len(catalog), len(user_emb_dicts)
+    users_by_pair = {}
+    for user, user_emb_dict in enumerate(user_emb_dicts):
+        for pair in _score_pairs(user_emb_dict, catalog):
+            users_by_pair.setdefault(pair, []).append(user)
+
+    total_weighted_similarity = np.zeros((n, count), dtype=np.float64)
+    row_masks = np.zeros((n, len(users_by_pair)), dtype=np.float64)
+    pair_weights = np.zeros((len(users_by_pair), count), dtype=np.float64)
+    pair_common = np.zeros((len(users_by_pair), count), dtype=np.float64)
+    for column, ((user_key, model_key, is_common), users) in enumerate(users_by_pair.items()):
+        mask = catalog.masks[model_key]
+        weight = WEIGHTS.get(user_key, 1.0)
+        sim = catalog.cosine_many(model_key, np.stack([user_emb_dicts[user][user_key] for user in users]))
+        adjusted = _adjust(np.square(sim, out=sim), weight)
+        adjusted *= weight
+        adjusted[~mask] = 0.0
+        total_weighted_similarity[:, slice(None) if len(users) == count else users] += adjusted
+        row_masks[:, column] = mask
+        pair_weights[column, users] = weight
+        pair_common[column, users] = is_common
+
+    total_weight = row_masks @ pair_weights
+    has_common = (row_masks @ pair_common) > 0
+
+    similarity = np.divide(total_weighted_similarity, total_weight, out=total_weighted_similarity,
+                           where=total_weight > 0)
+    similarity[total_weight <= 0] = 0.0
+    for gender in set(user_genders):
+        users = [user for user, user_gender in enumerate(user_genders) if user_gender == gender]
+        penalty = np.where(catalog.gender_mismatch(gender), GENDER_PENALTY, 0.0)[:, None]
+        similarity[:, slice(None) if len(users) == count else users] -= penalty
+    np.maximum(similarity, 0, out=similarity)
+    return similarity, has_common
+
+def match_catalog_batch(user_emb_dicts, catalog, user_genders):
+    """
+    match_catalog for many users: the catalog rows of each user's best
+    matches, best first.
+
+    Users are scored MATCH_BATCH_USERS at a time against the whole catalog;
+    the ANN shortlist and the gender-partition pruning are per-query
+    shortcuts and are not used. Every user's top candidates are then
+    re-scored one user at a time (against the full-precision source of a
+    compressed catalog that keeps it), so rankings match match_catalog.
+    """
+    exact = getattr(catalog, "exact", None)
+    results = []
+    for start in range(0, len(user_emb_dicts), MATCH_BATCH_USERS):
+        block = user_emb_dicts[start:start + MATCH_BATCH_USERS]
+        genders = user_genders[start:start + MATCH_BATCH_USERS]
+        queries = [catalog.prepare_query(user_emb_dict) for user_emb_dict in block]
+        similarity, valid = score_catalog_batch(queries, catalog, genders)
+        for column, (user_emb_dict, query, user_gender) in enumerate(zip(block, queries, genders)):
+            if exact is None:
+                # matrix-product rounding can swap near-ties, the shortlist is
+                # re-scored exactly like match_catalog would score it
+                rows = top_candidates(similarity[:, column], valid[:, column], catalog, _BATCH_RESCORE)
+                row_similarity, row_valid = score_catalog(query, catalog, user_gender, rows)
+            else:
+                rows = top_candidates(similarity[:, column], valid[:, column], catalog, catalog.rescore)
+                row_similarity, row_valid = score_catalog(user_emb_dict, exact, user_gender, rows)
+            results.append(rank_matches(row_similarity, row_valid, catalog, rows=rows))
+    return results
+
+
+def batch_top_matches(user_texts, catalog, tokenizer, model, device, top_k=1, batcher=None):
+    """
+    Best images for many users' analysis JSON texts, e.g. when re-ranking
+    stored jobs after a catalog update.
+
+    The scorable attribute texts of all users are embedded up front,
+    MATCH_BATCH_TEXTS distinct texts per call, and the users are then matched
+    together with match_catalog_batch.
+
+    Returns:
+        list: per user, up to ``top_k`` image names best first, taken from the
+        TOP_K candidates re-ranked by aesthetic score (so at most TOP_K); an
+        empty list when the text could not be parsed or nothing matched
+    """
     start_time = time.time()
-    
+    scorable = scorable_attributes(catalog)
+    parsed, user_genders = [], []
+    for user_text in user_texts:
+        user_attributes, _ = extract_attributes_scoring(user_text)
+        parsed.append({attr_name: value for attr_name, value in user_attributes.items() if attr_name in scorable})
+        user_genders.append(catalog_index.normalize_gender(user_attributes.get(GENDER_ATTR, None)))
+
+    texts = list(dict.fromkeys(value for user_attributes in parsed for value in user_attributes.values()))
+    vectors = {}
+    for start in range(0, len(texts), MATCH_BATCH_TEXTS):
+        chunk = texts[start:start + MATCH_BATCH_TEXTS]
+        vectors.update(zip(chunk, generate_embeddings(chunk, tokenizer, model, device, batcher)))
+    embed_time = time.time() - start_time
+
+    user_emb_dicts = [{attr_name: vectors[value] for attr_name, value in user_attributes.items()}
+                      for user_attributes in parsed]
+    matches = match_catalog_batch(user_emb_dicts, catalog, user_genders)
+
+    print(f"Matched {len(user_texts)} users ({len(texts)} distinct attribute texts): embedding took "
+          f"{embed_time:.2f} seconds, scoring {time.time() - start_time - embed_time:.2f} seconds")
+    return [[catalog.images[row] for row in rows[:top_k]] for rows in matches]
+
+def top_matches(user_text, catalog, tokenizer, model, device, batcher=None, debug=None, filters=None):
+    # accept the raw catalog entry list for callers that still pass it
+    if not isinstance(catalog, catalog_index.CatalogIndex):
+        catalog = catalog_index.CatalogIndex.from_entries(catalog)
+
+    def embed(texts):
+        return generate_embeddings(texts, tokenizer, model, device, batcher)
+
+    return match_user_text(user_text, catalog, embed, debug, filters)
+
+def match_user_text(user_text, catalog, embed, debug=None, filters=None):
+    """
+    Best image name for the user's analysis JSON against ``catalog``.
+
+    ``embed`` maps a list of attribute texts to one vector per text in the
+    space of ``catalog`` (CLS embeddings here, lexical vectors in lexical_match).
+    ``filters`` restricts the candidates to the catalog rows passing a
+    catalog_filters expression (e.g. "occasion=formal; style!=one-piece");
+    a malformed filter raises catalog_filters.FilterError and a filter no
+    catalog row passes raises catalog_filters.NoMatchingEntries.
+    """
+    start_time = time.time()
+
     # user_attributes = extract_attributes(user_text)
     user_attributes, user_scoring = extract_attributes_scoring(user_text)
     if not user_attributes:
         print("User description parsing failed, unable to match.")
         return [], []
 
-    user_gender = user_attributes.get("Semantic Features.Intrinsic Features.Gender", None)
-    if user_gender:
-        user_gender = user_gender.lower()
+    # filters only read the inverted attribute index; nothing is embedded when no row passes
+    filter_rows, selectivity = catalog_filters.select_rows(catalog, filters)
+    if filter_rows is not None:
+        print(f"Filter {filters!r} kept {len(filter_rows)} of {len(catalog)} catalog entries "
+              f"(selectivity {selectivity:.2%})")
+        if not len(filter_rows):
+            raise catalog_filters.NoMatchingEntries(f"No catalog entries match the filter {filters!r}")
 
-    user_texts = list(user_attributes.values())
-    user_embeddings = generate_embeddings(user_texts, tokenizer, model, device)
-    user_emb_dict = {attr_name: emb for attr_name, emb in zip(user_attributes.keys(), user_embeddings)}
+    user_gender = catalog_index.normalize_gender(user_attributes.get(GENDER_ATTR, None))
 
-    results = []
-    for model_entry in model_data:
-        if not all(k in model_entry and model_entry[k] is not None 
-                   for k in ["image", "attribute_embeddings", "result"]):
-            print(f"Skipping invalid entry: {model_entry.get('image', 'Unknown image')}")
-            continue
-
-        model_attributes, model_scoring = extract_attributes_scoring(model_entry["result"]["data"]["outputs"]["text"])
-        
-        model_gender = model_attributes.get("Semantic Features.Intrinsic Features.Gender", None)
-        # Apply gender matching preference but don't exclude completely
-        # Add a penalty to similarity for gender mismatch instead of skipping entirely
-        gender_penalty = 0.0
-        if user_gender and model_gender and (user_gender != model_gender.lower()):
-            gender_penalty = 0.1  # Small penalty for gender mismatch
-            print(f"Gender mismatch penalty applied for {model_entry.get('image')}: user {user_gender} vs model {model_gender}")
-        else:
-            print(f"Gender match or unknown for {model_entry.get('image')}: user {user_gender} vs model {model_gender}")
-
-        # aesthetic_score
-        aesthetic_score_str = model_scoring.get("Scoring.Aesthetic Score", "0")
-        aesthetic_score = float(aesthetic_score_str) if aesthetic_score_str.replace('.', '', 1).isdigit() else 0
-
-        # # extract score
-        # score = None
-        # if ("result" in model_entry and "data" in model_entry["result"] 
-        #     and "outputs" in model_entry["result"]["data"]):
-        #     text = model_entry["result"]["data"]["outputs"]["text"]
-        #     score = extract_score(text)
-        
-        total_weighted_similarity = 0.0
-        total_weight = 0.0
-        attr_contributions = {}
+    # only attributes the catalog can score are worth a forward pass
+    scorable = scorable_attributes(catalog)
+    user_keys = [attr_name for attr_name in user_attributes if attr_name in scorable]
+    user_texts = [user_attributes[attr_name] for attr_name in user_keys]
+    print(f"Embedding {len(user_keys)} of {len(user_attributes)} user attributes")
+    user_embeddings = embed(user_texts) if user_texts else []
+    user_emb_dict = {attr_name: emb for attr_name, emb in zip(user_keys, user_embeddings)}
 
-        model_emb_dict = model_entry["attribute_embeddings"]
-        common_attrs = set(user_emb_dict.keys()) & set(model_emb_dict.keys())
-        
-        mapped_attrs = {
-            "Clothing Color Optimization Suggestions": "Clothing Color Description",
-            "Style Optimization and Temperament Enhancement Suggestions": "Style and Temperament Description"
-        }
+    top_rows = match_catalog(user_emb_dict, catalog, user_gender, filter_rows)
 
-        if not common_attrs:
-            continue
-        
-        for attr in common_attrs:
-            user_emb = user_emb_dict[attr]
-            model_emb = np.array(model_emb_dict[attr])
-            sim = cosine_similarity([user_emb], [model_emb])[0][0]
-            squared_sim = sim ** 2
-            weight = WEIGHTS.get(attr, 1.0)
-
-            # apply penalty if similarity is below threshold
-            if weight == 1.0:
-                adjusted_sim = squared_sim if squared_sim >= THRESHOLD else PENALTY_VALUE
-            else:
-                adjusted_sim = squared_sim 
-            weighted_sim = weight * adjusted_sim  
-            attr_contributions[attr] = sim  
-            total_weighted_similarity += weighted_sim
-            total_weight += weight
-        
-        # extra map
-        for user_key, model_key in mapped_attrs.items():
-            if user_key in user_emb_dict and model_key in model_emb_dict:
-                sim = cosine_similarity([user_emb_dict[user_key]], [np.array(model_emb_dict[model_key])])[0][0]
-                squared_sim = sim ** 2
-                weight = WEIGHTS.get(user_key, 1.0)
-
-                if weight == 1.0:
-                    adjusted_sim = squared_sim if squared_sim >= THRESHOLD else PENALTY_VALUE
-                else:
-                    adjusted_sim = squared_sim
-
-                weighted_sim = weight * adjusted_sim
-                attr_contributions[user_key] = sim
-                total_weighted_similarity += weighted_sim
-                total_weight += weight
-        
-        weighted_avg_similarity = total_weighted_similarity / total_weight if total_weight > 0 else 0
-        # Apply gender penalty to final similarity score
-        final_similarity = max(0, weighted_avg_similarity - gender_penalty)
-        results.append({
-            "image": os.path.join(model_entry["image"]),
-            "similarity": final_similarity,
-            "contributions": attr_contributions,
-            "score": aesthetic_score
-        })
-
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    
-    top_5 = results[:5]
-
-    # sort top 5 by score
-    top_5.sort(key=lambda x: x["score"], reverse=True)
-    top_1 = top_5[0] if top_5 else None
+    if MATCH_DEBUG if debug is None else debug:
+        for result in explain_matches(user_emb_dict, catalog, top_rows, user_gender):
+            print(f"{result['image']}: similarity {result['similarity']:.4f}, score {result['score']}, "
+                  f"contributions {result['contributions']}")
     
     end_time = time.time()
     match_time = end_time - start_time
     print(f"Matching process took: {match_time:.2f} seconds")
 
-    return top_1["image"] if top_1 else None  # return best image name
+    return catalog.images[top_rows[0]] if len(top_rows) else None  # return best image name
 
 # entry
-def main(user_text, tokenizer, model, device):
+def main(user_text, tokenizer, model, device, batcher=None, filters=None):
     if not user_text:
         print("Failed to retrieve user description, exiting.")
         return
 
-    # 使用绝对路径
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    embeddings_file = os.path.join(current_dir, "ALL_final_merged.json")
-    
-    try:
-        with open(embeddings_file, "r", encoding="utf-8") as f:
-            model_data = json.load(f)
-        print(f"成功加载嵌入数据: {embeddings_file}")
-    except Exception as e:
-        print(f"加载嵌入数据失败: {str(e)}")
+    # 目录索引每个进程只构建一次（预加载时或首次使用时）
+    catalog = catalog_index.get_catalog_index()
+    if catalog is None:
+        print(f"加载嵌入数据失败: {catalog_index.get_catalog_path()}")
         return None
 
-    best_image_name = top_matches(user_text, model_data, tokenizer, model, device)
+    best_image_name = top_matches(user_text, catalog, tokenizer, model, device, batcher, filters=filters)
     
-    return best_image_name
\ No newline at end of file
+    return best_image_name
+
+# batch entry for backfills: one list of image names per user text
+def main_batch(user_texts, tokenizer, model, device, top_k=1, batcher=None):
+    catalog = catalog_index.get_catalog_index()
+    if catalog is None:
+        print(f"加载嵌入数据失败: {catalog_index.get_catalog_path()}")
+        return None
+
+    return batch_top_matches(user_texts, catalog, tokenizer, model, device, top_k, batcher)
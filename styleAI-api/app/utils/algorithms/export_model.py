@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Export the embedding model into a local snapshot for offline loading.
+
+Usage:
+    python export_model.py [--model distilbert-base-uncased] [--output model_snapshot]
+
+Run once where the hub is reachable (the Docker build does); the API then
+loads the model from the snapshot without network access, the weights
+memory-mapped (see model_snapshot). The output defaults to EMBEDDING_MODEL_DIR.
+After writing, the snapshot is loaded back and checked against the source
+model on a few texts, and the load time is reported.
+"""
+
+import argparse
+import sys
+import time
+
+from embedding_match import encode_texts
+from model_snapshot import export_snapshot, get_snapshot_dir, load_snapshot
+
+CHECK_TEXTS = ["male", "oval face", "slim build with long limbs and softly defined lines"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model into a local snapshot")
+    parser.add_argument("--model", default="distilbert-base-uncased", help="hub name or local model directory")
+    parser.add_argument("--output", default=get_snapshot_dir(), help="snapshot directory")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    manifest = export_snapshot(args.model, args.output)
+    print(f"Exported {args.model} ({manifest['parameters']} parameters, "
+          f"{manifest['weights_bytes'] / 1e6:.1f} MB of weights) to {args.output} "
+          f"in {time.time() - start_time:.2f} seconds")
+
+    from transformers import AutoModel, AutoTokenizer
+    import numpy as np
+
+    start_time = time.time()
+    tokenizer, model = load_snapshot(args.output, "cpu")
+    load_seconds = time.time() - start_time
+    source = AutoModel.from_pretrained(args.model).eval()
+    expected = encode_texts(CHECK_TEXTS, AutoTokenizer.from_pretrained(args.model), source, "cpu")
+    actual = encode_texts(CHECK_TEXTS, tokenizer, model, "cpu")
+    drift = float(np.abs(expected - actual).max())
+    print(f"Snapshot loads in {load_seconds:.3f} seconds, max difference from the source model: {drift:.2e}")
+    if drift > 1e-5:
+        print("Snapshot does not reproduce the source model")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 import json
-from sklearn.metrics.pairwise import cosine_similarity
 import requests
 import time
 import os
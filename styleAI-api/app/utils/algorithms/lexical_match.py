@@ -0,0 +1,191 @@
+"""
+Lexical ("lite") matching backend for embedding_match.
+
+Every attribute text of the catalog and of the user is turned into a sparse
+TF-IDF weighted vector of hashed word unigrams and bigrams (scikit-learn
+HashingVectorizer + TfidfTransformer, the IDF fit on the catalog texts), and
+the catalog is scored with the unchanged embedding_match rules: squared cosine
+per attribute, WEIGHTS, THRESHOLD/PENALTY_VALUE, MAPPED_ATTRS, the gender
+penalty and the aesthetic re-rank of the top 5.
+
+Nothing here imports torch or transformers, so a process using only this
+backend starts in well under a second and keeps a sparse catalog that is a
+small fraction of the float32 embedding matrices. Lexical cosines only get
+close to 1 for near-identical wording, so more default-weight attributes fall
+below THRESHOLD than with CLS embeddings: results approximate the embedding
+matcher, they are not the same.
+
+Configuration (environment variables):
+    MATCH_BACKEND     embedding (default) | lexical; lexical never loads the model
+    LEXICAL_FALLBACK  1 (default) matches lexically when the embedding model is
+                      not loaded, 0 keeps the previous mock-data fallback
+    LEXICAL_FEATURES  size of the hashed feature space (default 2**18)
+
+The texts come from the source JSON, or from the attribute_texts.json sidecar
+that build_catalog.py writes next to the binary catalog.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import catalog_index
+from catalog_index import CatalogIndex
+from embedding_match import match_user_text
+
+logger = logging.getLogger(__name__)
+
+MATCH_BACKENDS = ("embedding", "lexical")
+DEFAULT_FEATURES = 2 ** 18
+
+_lexical_catalog = None
+_lexical_lock = threading.Lock()
+
+
+def get_match_backend():
+    """Configured matching backend, falling back to embedding for unknown values."""
+    backend = os.environ.get("MATCH_BACKEND", "embedding").lower()
+    if backend not in MATCH_BACKENDS:
+        logger.warning(f"Unknown MATCH_BACKEND {backend!r}, using embedding")
+        return "embedding"
+    return backend
+
+
+def fallback_enabled():
+    """Whether requests without a loaded embedding model are matched lexically."""
+    return os.environ.get("LEXICAL_FALLBACK", "1") != "0"
+
+
+class LexicalEncoder:
+    """Hashed word 1-2 gram counts, sublinear TF-IDF weighted and L2-normalized."""
+
+    def __init__(self, n_features=DEFAULT_FEATURES):
+        from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+        self.hasher = HashingVectorizer(n_features=n_features, ngram_range=(1, 2),
+                                        alternate_sign=False, norm=None, dtype=np.float32)
+        self.tfidf = TfidfTransformer(sublinear_tf=True)
+
+    def fit(self, texts):
+        self.tfidf.fit(self.hasher.transform(texts))
+        return self
+
+    def transform(self, texts):
+        """(len(texts), n_features) float32 CSR matrix with unit (or zero) rows."""
+        return self.tfidf.transform(self.hasher.transform(texts)).astype(np.float32).tocsr()
+
+    def embed(self, texts):
+        """One 1-row sparse vector per text, the ``embed`` callable of match_user_text."""
+        matrix = self.transform(texts)
+        return [matrix[i] for i in range(matrix.shape[0])]
+
+
+class LexicalCatalog(CatalogIndex):
+    """
+    CatalogIndex whose attribute matrices are sparse lexical vectors.
+
+    Row metadata (images, genders, scores, masks, row layout) is taken from the
+    source index; its dense embeddings are not kept.
+    """
+
+    sparse = True
+
+    def __init__(self, source, encoder, matrices):
+        super().__init__(source.images, source.gender_codes, source.gender_values, source.aesthetic_scores,
+                         matrices, source.masks, source.attribute_keys, source.attribute_key_mask,
+                         normalized=True, source_rows=source.source_rows, attribute_texts=source.attribute_texts)
+        self.source_path = source.source_path
+        self.encoder = encoder
+
+    @property
+    def nbytes(self):
+        """Bytes held by the sparse attribute matrices."""
+        return sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in self.embeddings.values())
+
+    def prepare_query(self, user_emb_dict):
+        # encoder rows are already unit length
+        return user_emb_dict
+
+    def cosine(self, attr, vector, rows=None):
+        matrix = self.embeddings[attr] if rows is None else self.embeddings[attr][rows]
+        return (matrix @ vector.T).toarray().ravel().astype(np.float64)
+
+    @classmethod
+    def build(cls, source, attribute_texts, n_features=DEFAULT_FEATURES):
+        """Fit the encoder on every catalog text and vectorize each attribute column."""
+        missing = [None] * len(source)
+        columns = {attr: ["" if text is None else str(text) for text in attribute_texts.get(attr, missing)]
+                   for attr in source.attributes}
+        encoder = LexicalEncoder(n_features).fit([text for texts in columns.values() for text in texts if text])
+        matrices = {attr: encoder.transform(texts) for attr, texts in columns.items()}
+        return cls(source, encoder, matrices)
+
+
+def load_lexical_catalog(path=None):
+    """
+    Build the lexical catalog from a binary catalog directory (mapped, only its
+    metadata and texts are read) or from the source JSON.
+
+    Returns:
+        LexicalCatalog or None: the catalog, or None if it could not be built
+    """
+    path = path or catalog_index.get_catalog_path()
+    start_time = time.time()
+    try:
+        if os.path.isdir(path):
+            source = CatalogIndex.from_binary(path)
+            texts = catalog_index.load_attribute_texts(path)
+            if texts is None:
+                raise ValueError(f"{path} has no {catalog_index.TEXTS_FILE}; rebuild it with build_catalog.py")
+        else:
+            source = CatalogIndex.from_json(path, normalize=False)
+            texts = source.attribute_texts
+        source.source_path = path
+        catalog = LexicalCatalog.build(source, texts, int(os.environ.get("LEXICAL_FEATURES", DEFAULT_FEATURES)))
+    except Exception as e:
+        logger.error(f"Failed to build lexical catalog from {path}: {e}")
+        return None
+    logger.info(
+        f"Lexical catalog built: {len(catalog)} entries, {len(catalog.attributes)} attributes, "
+        f"{catalog.nbytes / 1e6:.1f} MB, took {time.time() - start_time:.2f} seconds"
+    )
+    return catalog
+
+
+def get_lexical_catalog():
+    """
+    Return the process-wide lexical catalog, building it on first use.
+
+    Returns:
+        LexicalCatalog or None: the catalog, or None if it could not be built
+    """
+    global _lexical_catalog
+
+    catalog = _lexical_catalog
+    if catalog is not None:
+        return catalog
+    with _lexical_lock:
+        if _lexical_catalog is None:
+            _lexical_catalog = load_lexical_catalog()
+        return _lexical_catalog
+
+
+def top_matches(user_text, catalog, debug=None, filters=None):
+    return match_user_text(user_text, catalog, catalog.encoder.embed, debug, filters)
+
+
+# entry, the model-free counterpart of embedding_match.main
+def main(user_text, filters=None):
+    if not user_text:
+        print("Failed to retrieve user description, exiting.")
+        return
+
+    catalog = get_lexical_catalog()
+    if catalog is None:
+        print(f"加载词法匹配目录失败: {catalog_index.get_catalog_path()}")
+        return None
+
+    return top_matches(user_text, catalog, filters=filters)
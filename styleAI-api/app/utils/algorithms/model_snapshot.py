@@ -0,0 +1,250 @@
+"""
+Offline local snapshot of the embedding model.
+
+export_model.py writes the tokenizer, the config and the weights of a hub
+model into one directory; load_embedding_model (embedding_backends) then
+loads from it without touching the network or the hub cache. The weights are
+a single safetensors file that is memory-mapped, not deserialized: the model
+skeleton is built on the meta device (no random initialization) and every
+parameter is pointed at its slice of the mapping. Pages are read on first
+use and stay in the page cache, shared by every process that maps the same
+file, so a cold start costs the imports plus a few milliseconds, and layers
+dropped by EMBEDDING_LAYERS are never read at all.
+
+The mapping is private (copy-on-write): quantizing or moving the model
+creates new tensors and never writes to the file.
+
+Snapshot layout:
+    snapshot.json           manifest (source model, library versions, sizes)
+    config.json, tokenizer  as written by save_pretrained
+    model.safetensors       the state dict, also loadable by from_pretrained
+    buffers.safetensors     non-persistent buffers missing from the state dict
+
+Configuration (environment variables):
+    EMBEDDING_MODEL_DIR   snapshot directory (default: model_snapshot next to this file)
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SNAPSHOT_DIR = os.path.join(ALGORITHMS_DIR, "model_snapshot")
+MANIFEST_FILE = "snapshot.json"
+WEIGHTS_FILE = "model.safetensors"
+BUFFERS_FILE = "buffers.safetensors"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# safetensors dtype codes and the numpy dtype of the same width, viewed as the torch dtype
+_DTYPES = {
+    "F64": ("float64", "<f8"), "F32": ("float32", "<f4"), "F16": ("float16", "<f2"),
+    "BF16": ("bfloat16", "<u2"), "I64": ("int64", "<i8"), "I32": ("int32", "<i4"),
+    "I16": ("int16", "<i2"), "I8": ("int8", "i1"), "U8": ("uint8", "u1"), "BOOL": ("bool", "?"),
+}
+
+
+class SnapshotError(RuntimeError):
+    """A snapshot directory that is missing files or does not fit the model class."""
+
+
+def get_snapshot_dir():
+    """Snapshot location, overridable with the EMBEDDING_MODEL_DIR environment variable."""
+    return os.environ.get("EMBEDDING_MODEL_DIR", DEFAULT_SNAPSHOT_DIR)
+
+
+def read_manifest(path):
+    """The manifest of the snapshot at ``path``, or None when it is not a snapshot."""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_snapshot(model_name):
+    """
+    Snapshot directory to load ``model_name`` from: the name itself when it is
+    a snapshot directory, else the configured directory when it was exported
+    from that model, else None (load from the hub).
+    """
+    if read_manifest(model_name) is not None:
+        return model_name
+    path = get_snapshot_dir()
+    manifest = read_manifest(path)
+    if manifest is not None and manifest.get("model_name") == model_name:
+        return path
+    return None
+
+
+def snapshot_fingerprint(path):
+    """
+    Short hash identifying the weights of the snapshot at ``path``: the
+    manifest's creation time and the size and modification time of the
+    tensor files, so re-exporting or replacing the weights changes it.
+    """
+    manifest = read_manifest(path) or {}
+    parts = [str(manifest.get("model_name")), str(manifest.get("created"))]
+    for name in (WEIGHTS_FILE, BUFFERS_FILE):
+        try:
+            stat = os.stat(os.path.join(path, name))
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{name}:missing")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _save_tensors(tensors, path):
+    from safetensors.torch import save_file
+
+    unique, seen = {}, set()
+    for name, tensor in tensors.items():
+        # tied weights are stored once, as from_pretrained expects
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique[name] = tensor.detach().cpu().contiguous()
+    save_file(unique, path, metadata={"format": "pt"})
+
+
+def _non_persistent_buffers(model):
+    buffers = {}
+    for module_name, module in model.named_modules():
+        for name in getattr(module, "_non_persistent_buffers_set", ()):
+            buffer = module._buffers.get(name)
+            if buffer is not None:
+                buffers[f"{module_name}.{name}" if module_name else name] = buffer
+    return buffers
+
+
+def export_snapshot(model_name, path):
+    """
+    Download ``model_name`` (hub name or local directory) and write its
+    tokenizer, config and weights into the snapshot directory ``path``.
+
+    Returns:
+        dict: the manifest written
+    """
+    import torch
+    import transformers
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    os.makedirs(path, exist_ok=True)
+    tokenizer.save_pretrained(path)
+    model.config.save_pretrained(path)
+    _save_tensors(model.state_dict(), os.path.join(path, WEIGHTS_FILE))
+    _save_tensors(_non_persistent_buffers(model), os.path.join(path, BUFFERS_FILE))
+
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "model_name": model_name,
+        "model_class": type(model).__name__,
+        "parameters": sum(p.numel() for p in model.parameters()),
+        "weights_bytes": os.path.getsize(os.path.join(path, WEIGHTS_FILE)),
+        "transformers_version": transformers.__version__,
+        "torch_version": torch.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    # written last: a directory without a manifest is never picked up as a snapshot
+    with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def map_safetensors(path):
+    """
+    Tensors of a safetensors file, backed by a private memory mapping of it.
+
+    Returns:
+        dict: tensor name -> torch.Tensor sharing memory with the mapping
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        if info["dtype"] not in _DTYPES:
+            raise SnapshotError(f"Unsupported dtype {info['dtype']} of {name} in {path}")
+        torch_dtype, np_dtype = _DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        # numpy views the mapping without copying; from_numpy keeps the view (and the mapping) alive
+        array = np.ndarray(shape=(end - begin) // np.dtype(np_dtype).itemsize, dtype=np_dtype,
+                           buffer=mapping, offset=data_start + begin)
+        tensor = torch.from_numpy(array)
+        if torch_dtype == "bfloat16":
+            tensor = tensor.view(torch.bfloat16)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def _assign(model, tensors):
+    """Point every parameter and buffer of a meta-device model at the mapped tensors."""
+    import torch
+
+    resolved = {}
+    for module_name, module in model.named_modules():
+        prefix = f"{module_name}." if module_name else ""
+        for kind in ("_parameters", "_buffers"):
+            for name, current in list(getattr(module, kind).items()):
+                if current is None:
+                    continue
+                full_name = prefix + name
+                tensor = tensors.get(full_name)
+                if tensor is None:
+                    # the other half of a tied pair was stored under its first name
+                    tensor = resolved.get(id(current))
+                if tensor is None:
+                    raise SnapshotError(f"{full_name} is missing from the snapshot")
+                if tuple(tensor.shape) != tuple(current.shape):
+                    raise SnapshotError(f"{full_name} has shape {tuple(tensor.shape)} in the snapshot, "
+                                        f"the model expects {tuple(current.shape)}")
+                if kind == "_parameters":
+                    tensor = torch.nn.Parameter(tensor, requires_grad=False)
+                getattr(module, kind)[name] = tensor
+                resolved[id(current)] = tensor
+
+
+def load_snapshot(path, device):
+    """
+    Tokenizer and eval-mode model of the snapshot at ``path``, loaded without
+    network access, the weights memory-mapped.
+
+    Returns:
+        tuple: (tokenizer, model)
+    """
+    import torch
+    from transformers import AutoConfig, AutoModel, AutoTokenizer
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise SnapshotError(f"{path} is not a model snapshot, create it with export_model.py")
+    start_time = time.time()
+    tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+    config = AutoConfig.from_pretrained(path, local_files_only=True)
+    with torch.device("meta"):
+        model = AutoModel.from_config(config)
+    tensors = map_safetensors(os.path.join(path, WEIGHTS_FILE))
+    tensors.update(map_safetensors(os.path.join(path, BUFFERS_FILE)))
+    _assign(model, tensors)
+    model.eval()
+    if torch.device(device).type != "cpu":
+        model = model.to(device)
+    logger.info(f"Embedding model loaded from snapshot {path} ({manifest.get('model_name')}), "
+                f"took {time.time() - start_time:.2f} seconds")
+    return tokenizer, model
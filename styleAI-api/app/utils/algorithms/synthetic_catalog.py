@@ -0,0 +1,74 @@
+"""
+Synthetic catalogs and users for the matching benchmarks.
+
+Entries are drawn around a fixed set of latent looks so that nearest
+neighbours are meaningful, with a shared offset on every vector to mimic the
+anisotropy of DistilBERT CLS embeddings (cosines between unrelated texts are
+still high, which is what makes the THRESHOLD rule bite).
+"""
+
+import numpy as np
+
+from catalog_index import CatalogIndex, GENDER_ATTR, gender_layout, normalize_rows
+
+WEIGHT_ONE_ATTRIBUTES = [
+    "Color Features.Skin Tone and Visual Characteristics",
+    "Color Features.Hair Color and Saturation",
+    "Structural Features.Facial Features.Face Shape and Visual Outline",
+]
+
+
+def synthetic_attributes(extra=len(WEIGHT_ONE_ATTRIBUTES)):
+    """The weighted attribute paths plus ``extra`` default-weight ones."""
+    from embedding_match import WEIGHTS
+    return sorted(WEIGHTS) + WEIGHT_ONE_ATTRIBUTES[:extra]
+
+
+class SyntheticLooks:
+    """Latent look prototypes shared by a synthetic catalog and its users."""
+
+    def __init__(self, dim=768, n_looks=64, attributes=None, seed=0):
+        self.dim = dim
+        self.attributes = attributes or synthetic_attributes()
+        rng = np.random.RandomState(seed)
+        self.common = rng.standard_normal(dim).astype(np.float32) * 2.0
+        self.prototypes = {
+            attr: rng.standard_normal((n_looks, dim)).astype(np.float32)
+            for attr in self.attributes
+        }
+        self.n_looks = n_looks
+
+    def vectors(self, attr, looks, rng, noise=0.3):
+        base = self.prototypes[attr][looks] + self.common
+        return (base + rng.standard_normal(base.shape).astype(np.float32) * noise).astype(np.float32)
+
+    def catalog(self, n, seed=1, presence=0.95):
+        rng = np.random.RandomState(seed)
+        looks = rng.randint(self.n_looks, size=n)
+        embeddings = {}
+        masks = {}
+        for attr in self.attributes:
+            mask = rng.random_sample(n) < presence
+            matrix = np.zeros((n, self.dim), dtype=np.float32)
+            matrix[mask] = self.vectors(attr, looks[mask], rng)
+            embeddings[attr] = normalize_rows(matrix)
+            masks[attr] = mask
+
+        images = np.array([f"synthetic_{i}.jpg" for i in range(n)], dtype=object)
+        gender_codes = rng.randint(2, size=n).astype(np.int16)
+        # same row layout as indexes built from the catalog JSON
+        gender_codes = gender_codes[gender_layout(gender_codes, 2)]
+        aesthetic_scores = rng.choice([6.0, 7.0, 7.5, 8.0, 8.5, 9.0], size=n)
+        attribute_keys = sorted(self.attributes + [GENDER_ATTR])
+        attribute_key_mask = np.ones((n, len(attribute_keys)), dtype=bool)
+        return CatalogIndex(images, gender_codes, ["female", "male"], aesthetic_scores,
+                            embeddings, masks, attribute_keys, attribute_key_mask, normalized=True)
+
+    def users(self, count, seed=2):
+        """``count`` (user_emb_dict, user_gender) pairs."""
+        rng = np.random.RandomState(seed)
+        users = []
+        for look in rng.randint(self.n_looks, size=count):
+            emb_dict = {attr: self.vectors(attr, np.array([look]), rng)[0] for attr in self.attributes}
+            users.append((emb_dict, ["female", "male"][rng.randint(2)]))
+        return users
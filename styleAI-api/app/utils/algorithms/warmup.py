@@ -0,0 +1,96 @@
+"""
+Warm-up passes run once the embedding model and the catalog are loaded.
+
+The first requests after a boot or a worker recycle otherwise pay for work
+done once per process: the tokenizer's lazy initialization, the allocator
+growing its pools, kernel selection for every new input shape of the forward
+pass, and the page faults of the memory-mapped catalog and model snapshot.
+
+warm_embeddings encodes a synthetic batch of attribute-like texts whose
+lengths cover every token-length bucket, so each padded shape a request can
+produce has been run once; it goes through the inference batcher when there
+is one and never through the embedding cache, so no entries are evicted.
+warm_catalog scores every catalog row once (touching every page of the
+embeddings) and then runs one match through the serving path (ANN, shards).
+
+Configuration (environment variables):
+    MODEL_WARMUP              0 disables the warm-up (default 1)
+    MODEL_WARMUP_BATCH_SIZES  comma-separated synthetic batch sizes (default 1,8,32)
+"""
+
+import logging
+import os
+import time
+
+import embedding_match
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZES = (1, 8, 32)
+# short values to long descriptions, one or more per token-length bucket
+WARMUP_TEXTS = [
+    "male", "oval", "warm undertone", "dark brown hair",
+    "medium height with balanced proportions",
+    "calm and understated overall impression with clean lines and soft edges",
+    "slender frame with narrow shoulders, long limbs and softly defined lines through the waist and hips",
+    "low contrast outfits in navy, charcoal and camel with one accent colour, structured outerwear over "
+    "fine knitwear, straight trousers and minimal leather accessories for office and weekend alike",
+]
+
+
+def get_warmup_config():
+    """Read the warm-up settings from the environment."""
+    sizes = os.environ.get("MODEL_WARMUP_BATCH_SIZES")
+    return {
+        "enabled": os.environ.get("MODEL_WARMUP", "1") != "0",
+        "batch_sizes": parse_batch_sizes(sizes) if sizes is not None else list(DEFAULT_BATCH_SIZES),
+    }
+
+
+def parse_batch_sizes(value):
+    """Positive batch sizes of a comma-separated list; invalid entries are skipped with a warning."""
+    sizes = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit() or int(part) < 1:
+            logger.warning(f"Ignoring invalid warm-up batch size {part!r}")
+            continue
+        sizes.append(int(part))
+    return sizes
+
+
+def warmup_texts(batch_size):
+    """``batch_size`` synthetic texts cycling through WARMUP_TEXTS."""
+    return [WARMUP_TEXTS[i % len(WARMUP_TEXTS)] for i in range(batch_size)]
+
+
+def warm_embeddings(tokenizer, model, device, batch_size, batcher=None):
+    """Encode one synthetic batch of ``batch_size`` texts; returns the embedding matrix."""
+    texts = warmup_texts(batch_size)
+    if batcher is not None:
+        return batcher.embed(texts)
+    return embedding_match.encode_texts(texts, tokenizer, model, device)
+
+
+def catalog_query(catalog, tokenizer, model, device):
+    """A user embedding dict with one encoded attribute-like text per catalog attribute."""
+    attrs = sorted(catalog.embeddings)
+    vectors = embedding_match.encode_texts(warmup_texts(len(attrs)), tokenizer, model, device)
+    return dict(zip(attrs, vectors))
+
+
+def warm_catalog(catalog, user_emb_dict):
+    """
+    Score every catalog row once, then match through the serving path.
+
+    Returns:
+        int: catalog rows scored
+    """
+    start_time = time.time()
+    gender = next((gender for gender in catalog.genders if gender), None)
+    embedding_match.score_catalog(catalog.prepare_query(user_emb_dict), catalog)
+    embedding_match.match_catalog(user_emb_dict, catalog, gender)
+    logger.info(f"Catalog warm-up scored {len(catalog)} entries in {time.time() - start_time:.2f} seconds")
+    return len(catalog)
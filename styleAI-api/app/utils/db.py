@@ -1,6 +1,4 @@
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import logging
 import json
 
@@ -23,6 +21,9 @@ def get_db_connection():
             logger.error("未设置DATABASE_URL环境变量")
             raise ValueError("未设置DATABASE_URL环境变量")
             
+        # 在第一次连接时导入，应用启动时不加载psycopg2
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
         conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
         logger.info("数据库连接成功")
         return conn
@@ -131,6 +132,8 @@ def update_job_best_fit(job_id, image_data):
         bool: 更新成功返回True，失败返回False
     """
     try:
+        # 与get_db_connection相同，第一次使用时才导入psycopg2
+        import psycopg2
         conn = get_db_connection()
         cur = conn.cursor()
         
@@ -2,7 +2,6 @@ import os
 import uuid
 import base64
 from io import BytesIO
-from PIL import Image
 import logging
 
 # 配置日志
@@ -44,7 +43,8 @@ def save_image_from_buffer(image_buffer, filename=None, job_id=None, prefix='img
             filename = f"{prefix}_{job_id or uuid.uuid4()}.jpg"
             filepath = os.path.join(TEMP_DIR, filename)
         
-        # 将二进制数据转换为图像并保存
+        # 将二进制数据转换为图像并保存(第一次保存图像时才导入PIL)
+        from PIL import Image
         image = Image.open(BytesIO(image_buffer))
         image.save(filepath)
         
@@ -0,0 +1,140 @@
+"""
+跨请求的动态微批处理
+gthread 下每个请求线程各自调用一次模型前向计算，彼此争抢 CPU 且无法合批。
+InferenceBatcher 用一个队列和一个工作线程收集多个请求的待编码文本：
+等待几毫秒或凑满最大批量后执行一次带 padding 的前向计算，再把结果分发回各个调用方。
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _EmbedRequest:
+    """一次 embed 调用，由工作线程填充结果后唤醒调用方"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceBatcher:
+    """
+    动态微批处理器
+
+    Args:
+        encode_fn (callable): 接收文本列表、返回同序嵌入矩阵的函数（一次前向计算）
+        max_batch_size (int): 单次前向计算的最大文本数
+        max_wait_ms (float): 收到第一个请求后等待更多请求的最长时间（毫秒）
+    """
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats = {"batches": 0, "requests": 0, "texts": 0, "forward_texts": 0}
+
+    def _ensure_started(self):
+        # 线程不会跨 fork 存活，在新进程中首次使用时重新启动
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+            self._thread.start()
+
+    def embed(self, texts, timeout=None):
+        """
+        提交文本并等待其嵌入结果
+
+        Args:
+            texts (list): 已归一化的文本列表
+            timeout (float, optional): 最长等待秒数
+
+        Returns:
+            numpy.ndarray: 与 texts 同序的嵌入矩阵
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self._ensure_started()
+        request = _EmbedRequest(list(texts))
+        self._queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError(f"等待批量推理结果超时({timeout}秒)")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        """阻塞取得第一个请求，再在等待窗口内尽量凑满一批"""
+        batch = [self._queue.get()]
+        count = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            count += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"批量推理失败: {e}")
+                for request in batch:
+                    request.error = e
+            finally:
+                for request in batch:
+                    request.done.set()
+
+    def _process(self, batch):
+        # 合并各请求的文本并去重，按最大批量分块执行前向计算
+        unique_texts = list(dict.fromkeys(text for request in batch for text in request.texts))
+        vectors = {}
+        for start in range(0, len(unique_texts), self.max_batch_size):
+            chunk = unique_texts[start:start + self.max_batch_size]
+            for text, vector in zip(chunk, self.encode_fn(chunk)):
+                vectors[text] = vector
+            self._stats["batches"] += 1
+            self._stats["forward_texts"] += len(chunk)
+
+        for request in batch:
+            request.result = np.stack([vectors[text] for text in request.texts])
+        self._stats["requests"] += len(batch)
+        self._stats["texts"] += sum(len(request.texts) for request in batch)
+
+    def stats(self):
+        """
+        批处理统计
+
+        Returns:
+            dict: 前向计算次数、请求数、文本数及平均批量
+        """
+        stats = dict(self._stats)
+        stats["mean_batch_size"] = stats["forward_texts"] / stats["batches"] if stats["batches"] else 0.0
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000.0
+        return stats
@@ -0,0 +1,172 @@
+"""
+模型资源注册表
+每个进程只加载一次模型资源：第一个调用方在锁保护下执行加载，并发的调用方等待同一次加载完成，
+不会重复加载DistilBERT。注册表记录整体状态(pending/loading/ready/failed)、
+加载耗时以及每个加载步骤的状态与耗时，供 /ready 端点和请求处理函数使用。
+加载失败不是永久状态：设置了retry_seconds时，退避时间过后的下一次请求重新加载，
+连续失败时退避时间翻倍，最长max_retry_seconds。
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelRegistry:
+    """
+    单次加载(single-flight)的资源注册表
+
+    Args:
+        name (str): 注册表名称，用于日志
+        retry_seconds (float, optional): 加载失败后重试前的退避时间(秒)，None或0表示不重试
+        max_retry_seconds (float): 连续失败时退避时间的上限(秒)
+    """
+
+    def __init__(self, name="model", retry_seconds=None, max_retry_seconds=300):
+        self.name = name
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.failures = 0
+        self.state = PENDING
+        self.resources = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.steps = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    def load(self, loader):
+        """
+        加载资源，整个进程只执行一次(失败后退避时间已过时重新加载)
+
+        第一个调用方在当前线程执行 loader(registry)，其返回值即为资源；
+        加载期间的其他调用方阻塞到加载结束，之后的调用直接返回已有结果。
+
+        Returns:
+            object: loader的返回值，加载失败时为None
+        """
+        with self._lock:
+            first = self._begin()
+        if not first:
+            self._done.wait()
+            return self.resources
+        return self._run(loader)
+
+    def start_background(self, loader, on_ready=None):
+        """
+        在后台线程中开始加载(已开始、已完成或失败后尚在退避时间内时不做任何事)
+
+        Args:
+            on_ready (callable, optional): 加载成功后在同一后台线程中以资源为参数调用
+        """
+        with self._lock:
+            if not self._begin():
+                return
+            self._thread = threading.Thread(target=self._run_then, args=(loader, on_ready),
+                                            name=f"{self.name}-loader", daemon=True)
+        self._thread.start()
+
+    def _begin(self):
+        """持有锁时调用：需要由当前调用方加载时切换到loading并返回True"""
+        if self.state == FAILED and self.retry_in == 0:
+            logger.info(f"{self.name}资源第{self.failures}次加载失败后重试")
+        elif self.state != PENDING:
+            return False
+        self.state = LOADING
+        self.resources = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.steps = {}
+        # 上一次加载的等待方已被唤醒，本次加载使用新的事件
+        self._done = threading.Event()
+        return True
+
+    def _run(self, loader):
+        logger.info(f"开始加载{self.name}资源...")
+        try:
+            self.resources = loader(self)
+            self.failures = 0
+            self.state = READY
+            logger.info(f"{self.name}资源加载完成，耗时: {self.load_seconds:.2f}秒")
+        except Exception as e:
+            self.error = str(e)
+            self.failures += 1
+            self.state = FAILED
+            logger.error(f"{self.name}资源加载失败: {e}")
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+        return self.resources
+
+    def _run_then(self, loader, on_ready):
+        resources = self._run(loader)
+        if on_ready is not None and self.ready:
+            on_ready(resources)
+
+    @property
+    def retry_in(self):
+        """加载失败后距离允许重试的秒数，不会重试(未失败或未设置retry_seconds)时为None"""
+        if self.state != FAILED or not self.retry_seconds:
+            return None
+        backoff = min(self.retry_seconds * 2 ** (self.failures - 1), self.max_retry_seconds)
+        return max(0.0, self.finished_at + backoff - time.time())
+
+    def wait(self, timeout=None):
+        """
+        等待加载结束，最多timeout秒
+
+        Returns:
+            bool: 资源是否已就绪
+        """
+        self._done.wait(timeout)
+        return self.state == READY
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def load_seconds(self):
+        """加载耗时(秒)，加载中时为已用时间，尚未开始时为None"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    @contextmanager
+    def step(self, name):
+        """
+        记录一个加载步骤的状态与耗时；步骤内抛出的异常标记为失败后继续向上抛出
+        """
+        started = time.time()
+        self.steps[name] = {"state": LOADING, "seconds": None}
+        try:
+            yield
+        except Exception as e:
+            self.steps[name] = {"state": FAILED, "seconds": round(time.time() - started, 3), "error": str(e)}
+            raise
+        self.steps[name] = {"state": READY, "seconds": round(time.time() - started, 3)}
+        logger.info(f"加载步骤 {name} 完成，耗时: {self.steps[name]['seconds']:.2f}秒")
+
+    def status(self):
+        """状态、耗时与各步骤信息，可直接序列化为JSON"""
+        load_seconds = self.load_seconds
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "error": self.error,
+            "failures": self.failures,
+            "retry_in": None if self.retry_in is None else round(self.retry_in, 3),
+            "load_seconds": None if load_seconds is None else round(load_seconds, 3),
+            "steps": {name: dict(step) for name, step in list(self.steps.items())},
+        }
@@ -1,14 +1,19 @@
 """
 预加载算法模块
 此模块用于在Flask应用启动时预加载算法模块，提高响应速度
+模型资源通过ModelRegistry每个进程只加载一次，导入本模块时不会触发加载
 """
 
+import gc
 import os
 import sys
 import logging
 import importlib
 import time
 import importlib.util
+import platform
+
+from app.utils.model_registry import FAILED, READY, ModelRegistry
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -16,8 +21,19 @@ logger = logging.getLogger(__name__)
 
 # 全局变量
 _model_resources = None
+# 请求等待模型资源就绪的最长时间(秒)
+MODEL_READY_TIMEOUT = float(os.environ.get('MODEL_READY_TIMEOUT', 30))
+# 模型资源加载失败后，下一次请求重新加载前的退避时间(秒)，连续失败时翻倍，0表示不重试
+MODEL_RETRY_SECONDS = float(os.environ.get('MODEL_RETRY_SECONDS', 10))
+MODEL_RETRY_MAX_SECONDS = float(os.environ.get('MODEL_RETRY_MAX_SECONDS', 300))
+_registry = ModelRegistry("模型", retry_seconds=MODEL_RETRY_SECONDS, max_retry_seconds=MODEL_RETRY_MAX_SECONDS)
+_warmup_registry = ModelRegistry("预热")
+# 已解析的算法模块(导入失败的模块不记录，下次调用时重新导入)
+_algorithm_modules = {}
 model_name = "distilbert-base-uncased"
 ALGORITHMS_PATH = os.path.join(os.path.dirname(__file__), 'algorithms')
+# 预热时是否打开一次数据库连接
+MODEL_WARMUP_DB = os.environ.get('MODEL_WARMUP_DB', '1') != '0'
 
 def safe_import_preload():
     """
@@ -33,20 +49,55 @@ def safe_import_preload():
         logger.error(f"导入预加载模块失败: {e}")
         return None
 
-def get_model_resources():
+def get_model_resources(timeout=None):
     """
     获取预加载的模型资源
     
+    资源尚未加载完成时最多等待timeout秒(见wait_until_ready)
+    
     Returns:
-        dict: 包含预加载模型资源的字典
+        dict: 包含预加载模型资源的字典，未就绪时为空字典
     """
-    global _model_resources
-    
-    if _model_resources is None:
-        logger.warning("模型资源尚未加载")
+    if not wait_until_ready(timeout):
+        logger.warning(f"模型资源尚未就绪，状态: {_registry.state}")
         return {}
         
-    return _model_resources
+    return _registry.resources or {}
+
+def wait_until_ready(timeout=None):
+    """
+    等待模型资源就绪
+    
+    加载尚未开始，或上一次加载失败且退避时间已过时，在后台线程中开始加载
+    
+    Args:
+        timeout (float): 最长等待时间(秒)，默认MODEL_READY_TIMEOUT，0表示不等待
+        
+    Returns:
+        bool: 资源是否已就绪
+    """
+    _registry.start_background(load_resources, on_ready=warm_up)
+    return _registry.wait(MODEL_READY_TIMEOUT if timeout is None else timeout)
+
+def get_status():
+    """
+    获取模型资源的加载与预热状态
+    
+    模型加载完成、预热尚未结束时整体状态为warming_up，ready为False，
+    负载均衡按/ready把流量留给已预热的worker；预热失败不影响就绪
+    
+    Returns:
+        dict: 整体状态(pending/loading/warming_up/ready/failed)、加载耗时、各加载步骤的状态与耗时，
+              以及warmup中预热的状态和各预热步骤的耗时
+    """
+    status = _registry.status()
+    warmup_status = _warmup_registry.status()
+    warmup_status['enabled'] = _warmup_enabled()
+    status['warmup'] = warmup_status
+    if status['ready'] and warmup_status['enabled'] and _warmup_registry.state not in (READY, FAILED):
+        status['state'] = 'warming_up'
+        status['ready'] = False
+    return status
 
 def preload_models():
     """
@@ -60,11 +111,67 @@ def preload_models():
         # 初始化资源字典
         _model_resources = {}
         
+        # MATCH_BACKEND=lexical时只使用词法匹配，不导入torch和transformers
+        import lexical_match
+        _model_resources['match_backend'] = lexical_match.get_match_backend()
+        if _model_resources['match_backend'] == 'lexical':
+            logger.info("匹配后端: lexical，跳过embedding模型和目录嵌入的加载")
+            _model_resources['tokenizer'] = None
+            _model_resources['model'] = None
+            _model_resources['device'] = None
+            _model_resources['batcher'] = None
+            with _registry.step('lexical_catalog'):
+                _model_resources['lexical_catalog'] = lexical_match.get_lexical_catalog()
+            logger.info("模型和资源预加载完成")
+            return _model_resources
+        
+        # 加载目录索引（每个进程只解析一次目录JSON）
+        try:
+            with _registry.step('catalog_index'):
+                import catalog_index
+                _model_resources['catalog_index'] = catalog_index.get_catalog_index()
+                if _model_resources['catalog_index'] is None:
+                    raise RuntimeError(f"无法加载目录: {catalog_index.get_catalog_path()}")
+        except Exception as e:
+            logger.error(f"加载目录索引失败: {e}")
+            _model_resources['catalog_index'] = None
+
+        # 启用近似检索(CATALOG_ANN=ivf)时提前构建索引，否则首个请求时构建
+        if _model_resources['catalog_index'] is not None:
+            try:
+                with _registry.step('ann_index'):
+                    import catalog_ann
+                    catalog_ann.get_ann_index(_model_resources['catalog_index'])
+            except Exception as e:
+                logger.error(f"构建近似检索索引失败: {e}")
+        
+        # 目录加载后建立属性倒排索引，筛选查询不再扫描目录
+        if _model_resources['catalog_index'] is not None:
+            try:
+                with _registry.step('filter_index'):
+                    import catalog_filters
+                    catalog_filters.get_filter_index(_model_resources['catalog_index'])
+            except Exception as e:
+                logger.error(f"建立属性筛选索引失败: {e}")
+        
+        # 启用分片评分(CATALOG_SHARDS>1)时在加载模型之前启动工作进程，子进程不继承模型
+        # (GUNICORN_PRELOAD=1的master不启动，由worker在post_fork中启动，见defer_shard_pools)
+        if _model_resources['catalog_index'] is not None:
+            try:
+                with _registry.step('shard_pool'):
+                    import catalog_shards
+                    import embedding_match
+                    catalog_shards.get_shard_pool(_model_resources['catalog_index'],
+                                                  embedding_match.shard_candidates)
+            except Exception as e:
+                logger.error(f"启动目录分片进程池失败: {e}")
+        
         # 检查是否可以导入torch
         try:
-            import torch
-            import transformers
-            from transformers import AutoModel, AutoTokenizer
+            with _registry.step('torch_import'):
+                import torch
+                import transformers
+                from transformers import AutoModel, AutoTokenizer
             
             # 设置设备
             _model_resources['device'] = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -72,19 +179,31 @@ def preload_models():
             
             # 尝试加载embedding模型和tokenizer
             try:
-                # 加载tokenizer
-                logger.info(f"加载tokenizer: {model_name}")
-                tokenizer = AutoTokenizer.from_pretrained(model_name)
-                _model_resources['tokenizer'] = tokenizer
+                import embedding_backends
                 
-                # 加载模型
-                logger.info(f"加载embedding模型: {model_name}")
-                model = AutoModel.from_pretrained(model_name).to(_model_resources['device'])
+                # 加载tokenizer和模型，并按EMBEDDING_BACKEND转换(fp32/int8)
+                logger.info(f"加载tokenizer和embedding模型: {model_name}")
+                # 用户向量必须与目录向量来自同一层数(EMBEDDING_LAYERS / build_catalog.py --layers)
+                with _registry.step('embedding_model'):
+                    tokenizer, model, backend = embedding_backends.load_embedding_model(
+                        model_name, _model_resources['device'],
+                        n_layers=resolve_embedding_layers(_model_resources['catalog_index']))
+                _model_resources['embedding_layers'] = embedding_backends.embedding_layers(model)
+                # 按EMBEDDING_COMPILE构建只输出CLS向量的trace/compile编码器，失败时使用原模型
+                with _registry.step('encoder_compile'):
+                    model, compile_mode = embedding_backends.compile_encoder(
+                        model, tokenizer, _model_resources['device'], backend=backend)
+                _model_resources['tokenizer'] = tokenizer
                 _model_resources['model'] = model
+                _model_resources['backend'] = backend
+                _model_resources['compile_mode'] = compile_mode
+                logger.info(f"embedding后端: {backend}, 编码器模式: {compile_mode}, "
+                            f"Transformer层数: {_model_resources['embedding_layers']}")
                 
                 # 验证模型和tokenizer是否正确加载
                 if tokenizer and model:
                     logger.info("成功加载embedding模型和tokenizer")
+                    _model_resources['batcher'] = create_batcher(tokenizer, model, _model_resources['device'])
                 else:
                     logger.error("模型或tokenizer加载失败")
                     if not tokenizer:
@@ -96,13 +215,19 @@ def preload_models():
                 # 设置为None以便后续检查
                 _model_resources['tokenizer'] = None
                 _model_resources['model'] = None
+                _model_resources['batcher'] = None
         except ImportError as e:
             logger.warning(f"无法导入必要的库: {e}，跳过模型加载")
             _model_resources['tokenizer'] = None
             _model_resources['model'] = None
             _model_resources['device'] = None
+            _model_resources['batcher'] = None
         
-        # 加载其他资源...
+        # 模型不可用时请求降级为词法匹配，提前构建词法目录
+        if _model_resources.get('model') is None and lexical_match.fallback_enabled():
+            logger.warning("embedding模型不可用，请求将降级为词法匹配")
+            with _registry.step('lexical_catalog'):
+                _model_resources['lexical_catalog'] = lexical_match.get_lexical_catalog()
         
         logger.info("模型和资源预加载完成")
         return _model_resources
@@ -111,13 +236,67 @@ def preload_models():
         _model_resources = {
             'tokenizer': None,
             'model': None,
-            'device': None
+            'device': None,
+            'batcher': None
         }
         return _model_resources
 
+def resolve_embedding_layers(catalog):
+    """
+    确定embedding模型运行的Transformer层数
+    
+    目录记录了编码层数时以目录为准，EMBEDDING_LAYERS与之不一致时记录错误；
+    目录按完整模型编码时忽略EMBEDDING_LAYERS；目录未加载时使用EMBEDDING_LAYERS
+    
+    Returns:
+        int: 保留的层数，0表示完整模型
+    """
+    import embedding_backends
+    
+    configured = embedding_backends.get_layer_count()
+    if catalog is None:
+        return configured
+    
+    catalog_layers = catalog.embedding_layers or 0
+    if configured and configured != catalog_layers:
+        logger.error(f"EMBEDDING_LAYERS={configured}与目录的编码层数({catalog_layers or '完整模型'})不一致，"
+                     f"按目录使用{catalog_layers or '完整模型'}；请用 build_catalog.py --layers {configured} 重新构建目录")
+    return catalog_layers
+
+def create_batcher(tokenizer, model, device):
+    """
+    创建跨请求的推理微批处理器
+    
+    通过环境变量配置:
+        INFERENCE_BATCHING: 设为0时关闭微批处理，每个请求单独前向计算
+        INFERENCE_BATCH_SIZE: 单次前向计算的最大文本数，默认32
+        INFERENCE_BATCH_WAIT_MS: 凑批等待窗口(毫秒)，默认5
+    
+    Returns:
+        InferenceBatcher or None: 微批处理器，关闭时返回None
+    """
+    if os.environ.get('INFERENCE_BATCHING', '1') == '0':
+        logger.info("推理微批处理已关闭")
+        return None
+    
+    import embedding_match
+    from app.utils.inference_batcher import InferenceBatcher
+    
+    batcher = InferenceBatcher(
+        lambda texts: embedding_match.encode_texts(texts, tokenizer, model, device),
+        max_batch_size=int(os.environ.get('INFERENCE_BATCH_SIZE', 32)),
+        max_wait_ms=float(os.environ.get('INFERENCE_BATCH_WAIT_MS', 5))
+    )
+    logger.info(f"推理微批处理已启用: 最大批量 {batcher.max_batch_size}, 等待窗口 {batcher.max_wait * 1000:.1f}毫秒")
+    return batcher
+
 def import_module(module_name):
     """
-    导入指定的模块
+    导入指定的算法模块
+    
+    每个模块只解析和导入一次(注册在sys.modules中，与普通import共用同一个模块对象)，
+    结果缓存在_algorithm_modules中，请求处理函数反复调用时不再查找模块路径；
+    导入失败时不缓存，下一次调用重新尝试导入
     
     Args:
         module_name (str): 要导入的模块名
@@ -125,15 +304,17 @@ def import_module(module_name):
     Returns:
         module or None: 导入的模块，如果导入失败则返回None
     """
+    if module_name in _algorithm_modules:
+        return _algorithm_modules[module_name]
+    if ALGORITHMS_PATH not in sys.path:
+        sys.path.append(ALGORITHMS_PATH)
     try:
-        module_path = os.path.join(ALGORITHMS_PATH, f"{module_name}.py")
-        spec = importlib.util.spec_from_file_location(module_name, module_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        return module
+        module = importlib.import_module(module_name)
     except Exception as e:
         logger.error(f"导入模块 {module_name} 失败: {e}")
         return None
+    _algorithm_modules[module_name] = module
+    return module
 
 def check_dependencies(packages):
     """
@@ -151,6 +332,40 @@ def check_dependencies(packages):
             return False
     return True
 
+def check_environment():
+    """
+    检查Python版本和必要的依赖是否已安装
+
+    在加载模型前调用(每个进程一次)，find_spec查找torch和transformers较慢，不放在启动路径上
+    """
+    # 检查Python版本
+    python_version = platform.python_version()
+    logger.info(f"Python版本: {python_version}")
+    
+    # 检查必要的依赖是否已安装(包名: 导入名)
+    required_packages = {
+        'transformers': 'transformers',
+        'torch': 'torch',
+        'scikit-learn': 'sklearn'
+    }
+    
+    missing_packages = []
+    installed_packages = []
+    
+    for package, module_name in required_packages.items():
+        if importlib.util.find_spec(module_name) is None:
+            missing_packages.append(package)
+        else:
+            installed_packages.append(package)
+    
+    if missing_packages:
+        logger.warning(f"以下依赖包未安装: {', '.join(missing_packages)}")
+        logger.warning(f"请使用以下命令安装: pip install {' '.join(missing_packages)}")
+        logger.warning("某些功能可能受限")
+    
+    if installed_packages:
+        logger.info(f"已安装的依赖包: {', '.join(installed_packages)}")
+
 def check_scikit_learn():
     """
     检查scikit-learn是否已安装且版本兼容
@@ -187,7 +402,7 @@ def preload_modules():
         logger.info(f"已将算法模块路径添加到sys.path: {ALGORITHMS_PATH}")
     
     # 检查算法模块文件是否存在
-    module_files = ['main.py', 'input_analyse.py', 'embedding_match.py', 'change_ootd.py']
+    module_files = ['main.py', 'input_analyse.py', 'embedding_match.py', 'catalog_index.py', 'catalog_ann.py', 'catalog_filters.py', 'catalog_shards.py', 'embedding_cache.py', 'embedding_backends.py', 'model_snapshot.py', 'warmup.py', 'lexical_match.py', 'change_ootd.py']
     missing_files = []
     
     for file in module_files:
@@ -214,23 +429,167 @@ def preload_modules():
         logger.error(f"预加载算法模块时出错: {str(e)}")
         return False
 
-# 初始化函数
-def init():
+def load_resources(registry):
     """
-    初始化预加载模块
+    加载算法模块和模型资源(由ModelRegistry调用，每个进程只执行一次)
+    
+    Returns:
+        dict: 模型资源字典
     """
     logger.info("初始化预加载模块...")
     
+    # 检查Python版本和必要的依赖是否已安装
+    check_environment()
+    
     # 添加算法目录到Python路径
     if ALGORITHMS_PATH not in sys.path:
         sys.path.append(ALGORITHMS_PATH)
         logger.info(f"已将算法目录添加到Python路径: {ALGORITHMS_PATH}")
     
     # 预加载模块
-    preload_modules()
+    try:
+        with registry.step('modules'):
+            if not preload_modules():
+                raise RuntimeError("算法模块预加载失败")
+    except RuntimeError as e:
+        logger.error(str(e))
     
     # 预加载模型
-    preload_models()
+    resources = preload_models()
+    if resources.get('model') is None and resources.get('lexical_catalog') is None:
+        raise RuntimeError("embedding模型和词法匹配目录均不可用")
+    return resources
+
+# 初始化函数
+def init():
+    """
+    初始化预加载模块
+    
+    每个进程只加载一次：并发调用等待同一次加载完成，之后的调用直接返回已加载的资源
+    
+    Returns:
+        dict or None: 模型资源字典，加载失败时为None
+    """
+    resources = _registry.load(load_resources)
+    if _registry.ready:
+        warm_up(resources)
+    return resources
+
+def _warmup_enabled():
+    if ALGORITHMS_PATH not in sys.path:
+        sys.path.append(ALGORITHMS_PATH)
+    try:
+        import warmup
+        return warmup.get_warmup_config()['enabled']
+    except ImportError:
+        return False
+
+def warm_up(resources):
+    """
+    模型资源就绪后执行一次预热(MODEL_WARMUP=0时跳过)，每个进程只执行一次
+    
+    依次执行各批量大小的合成嵌入批次、一次完整的目录评分和一次数据库连接，
+    避免启动或worker回收后的第一批请求承担分配器增长、tokenizer延迟初始化、首次前向计算的内核选择
+    和内存映射文件缺页的开销。单个步骤失败只记录错误，不影响其他步骤
+    """
+    if not _warmup_enabled():
+        logger.info("已关闭启动预热(MODEL_WARMUP=0)")
+        return None
+    return _warmup_registry.load(lambda registry: run_warmup(registry, resources))
+
+def _warmup_step(registry, name, func, *args):
+    try:
+        with registry.step(name):
+            func(*args)
+    except Exception as e:
+        logger.error(f"预热步骤 {name} 失败: {e}")
+
+def _open_db_connection():
+    from app.utils.db import get_db_connection
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+    finally:
+        conn.close()
+
+def _warm_catalog(catalog, tokenizer, model, device):
+    import warmup
+    warmup.warm_catalog(catalog, warmup.catalog_query(catalog, tokenizer, model, device))
+
+def run_warmup(registry, resources):
+    """
+    执行预热步骤(由预热注册表调用)
+    
+    Returns:
+        dict: 各预热步骤的状态与耗时
+    """
+    import warmup
+    config = warmup.get_warmup_config()
+    model = resources.get('model')
+    if model is not None:
+        tokenizer, device = resources.get('tokenizer'), resources.get('device')
+        for batch_size in config['batch_sizes']:
+            _warmup_step(registry, f'embedding_batch_{batch_size}', warmup.warm_embeddings,
+                         tokenizer, model, device, batch_size, resources.get('batcher'))
+        if resources.get('catalog_index') is not None:
+            _warmup_step(registry, 'catalog_scoring', _warm_catalog,
+                         resources['catalog_index'], tokenizer, model, device)
+    else:
+        logger.info("embedding模型不可用，跳过嵌入和目录评分预热")
+    if MODEL_WARMUP_DB:
+        _warmup_step(registry, 'db_connection', _open_db_connection)
+    logger.info("预热步骤耗时: " + ", ".join(f"{name} {step['seconds']}秒({step['state']})"
+                                         for name, step in registry.steps.items()))
+    return dict(registry.steps)
+
+def prepare_fork():
+    """
+    在gunicorn master fork worker之前调用(GUNICORN_PRELOAD=1)
+    
+    等待模型资源加载和预热完成后冻结GC：已加载的对象移入永久代，worker中的GC不再扫描和改写它们，
+    模型权重和目录所在的内存页通过copy-on-write在所有worker之间共享
+    
+    Returns:
+        dict or None: 模型资源字典，加载失败时为None
+    """
+    resources = init()
+    if resources and str(resources.get('device')).startswith('cuda'):
+        logger.warning("CUDA上下文不能跨fork使用，GPU部署请关闭GUNICORN_PRELOAD")
+    gc.collect()
+    gc.freeze()
+    logger.info(f"模型资源已在master中加载({_registry.state})，冻结 {gc.get_freeze_count()} 个对象后fork worker")
+    return resources
+
+def defer_shard_pools():
+    """
+    在gunicorn master中调用(GUNICORN_PRELOAD=1)，master加载目录和预热时不启动分片进程池
+
+    master只负责加载和fork，它启动的分片进程不会被使用，却一直占用内存和管道；
+    worker在post_fork中通过start_shard_pool启动自己的进程池
+    """
+    catalog_shards = import_module('catalog_shards')
+    if catalog_shards is not None:
+        catalog_shards.defer_shard_pools()
+
+def start_shard_pool():
+    """
+    在worker中启动分片进程池(gunicorn post_fork调用)，未启用分片或目录未加载时不做任何事
+    
+    Returns:
+        ShardPool or None: 进程池，未启动时为None
+    """
+    catalog = (_registry.resources or {}).get('catalog_index')
+    catalog_shards = import_module('catalog_shards')
+    embedding_match = import_module('embedding_match')
+    if catalog is None or catalog_shards is None or embedding_match is None:
+        return None
+    try:
+        return catalog_shards.get_shard_pool(catalog, embedding_match.shard_candidates)
+    except Exception as e:
+        logger.error(f"启动目录分片进程池失败: {e}")
+        return None
 
 # initialize函数作为init函数的别名
 def initialize():
@@ -238,7 +597,4 @@ def initialize():
     初始化预加载模块(init函数的别名)
     这个函数是为了兼容app/__init__.py中的调用
     """
-    return init()
-
-# 在模块导入时自动初始化
-init() 
\ No newline at end of file
+    return init() 
\ No newline at end of file
@@ -6,11 +6,12 @@
 import os
 import sys
 import logging
-import importlib.util
 import json
 import shutil
 import base64
-from typing import Dict, Any, Optional, Tuple, Union
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from app.utils import preload
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -41,7 +42,9 @@ def find_best_match_image(
     analysis_data: Union[str, Dict], 
     tokenizer: Any, 
     model: Any, 
-    device: Any
+    device: Any,
+    batcher: Any = None,
+    filters: Union[str, List[str], None] = None
 ) -> Tuple[bool, str, Optional[str]]:
     """
     使用embedding_match找到最佳匹配的图片
@@ -51,39 +54,54 @@ def find_best_match_image(
         tokenizer: 预加载的tokenizer
         model: 预加载的模型
         device: 计算设备
+        batcher: 预加载的推理微批处理器，为None时单独执行前向计算
+        filters: 目录筛选条件，如 "occasion=formal; style!=one-piece"，只在满足条件的条目中匹配
         
     Returns:
         Tuple[bool, str, Optional[str]]: 
             - 是否成功
             - 错误信息或成功信息
             - 匹配图片的路径(如果成功)
+    
+    Raises:
+        catalog_filters.FilterError: 筛选条件无法解析、字段未建立索引或类型不是字符串/字符串列表
+        catalog_filters.NoMatchingEntries: 没有目录条目满足筛选条件
     """
     # 获取算法路径
     ALGORITHMS_PATH = get_algorithms_path()
     
+    # 导入算法模块(每个模块只解析一次)
+    embedding_match = preload.import_module('embedding_match')
+    if embedding_match is None:
+        return False, "embedding_match模块不可用", None
+    catalog_filters = preload.import_module('catalog_filters')
+    lexical_match = preload.import_module('lexical_match')
+    
     try:
-        # 检查算法模块是否可用
-        embedding_match_spec = importlib.util.find_spec('embedding_match')
-        if not embedding_match_spec:
-            return False, "embedding_match模块不可用", None
-        
-        # 导入算法模块
-        import embedding_match
-        
-        # 检查模型资源
-        if not model or not tokenizer or not device:
-            return False, "预加载的模型资源不可用", None
-        
-        # 调用embedding_match算法
-        logger.info(f"开始使用embedding_match分析用户数据")
-        logger.info(f"分析数据: {analysis_data if isinstance(analysis_data, str) else json.dumps(analysis_data)[:200]}...")
-        
-        best_image_name = embedding_match.main(
-            analysis_data, 
-            tokenizer, 
-            model, 
-            device
-        )
+        # MATCH_BACKEND=lexical时始终使用词法匹配；embedding后端的模型资源不可用时，
+        # 由LEXICAL_FALLBACK决定是否降级为词法匹配
+        if lexical_match is not None and lexical_match.get_match_backend() == 'lexical':
+            logger.info("匹配后端为lexical，使用词法匹配分析用户数据")
+            best_image_name = lexical_match.main(analysis_data, filters=filters)
+        elif not model or not tokenizer or not device:
+            if lexical_match is None or not lexical_match.fallback_enabled():
+                return False, "预加载的模型资源不可用", None
+            
+            logger.info("embedding模型不可用，使用词法匹配分析用户数据")
+            best_image_name = lexical_match.main(analysis_data, filters=filters)
+        else:
+            # 调用embedding_match算法
+            logger.info(f"开始使用embedding_match分析用户数据")
+            logger.info(f"分析数据: {analysis_data if isinstance(analysis_data, str) else json.dumps(analysis_data)[:200]}...")
+            
+            best_image_name = embedding_match.main(
+                analysis_data, 
+                tokenizer, 
+                model, 
+                device,
+                batcher,
+                filters=filters
+            )
         
         if not best_image_name:
             return False, "embedding_match未返回有效结果", None
@@ -118,7 +136,11 @@ def find_best_match_image(
                 return False, f"匹配的图片不存在: {source_image_path}", None
         else:
             return False, f"无效的best_image_name: {best_image_name}", None
-            
+    
+    except (catalog_filters.FilterError, catalog_filters.NoMatchingEntries) as e:
+        # 客户端输入问题，交给路由返回400/404
+        logger.warning(f"筛选条件无法使用: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"查找最佳匹配图片时出错: {str(e)}")
         return False, f"查找最佳匹配图片时出错: {str(e)}", None
@@ -144,14 +166,11 @@ def generate_outfit_image(
     ALGORITHMS_PATH = get_algorithms_path()
     
     try:
-        # 检查算法模块是否可用
-        change_ootd_spec = importlib.util.find_spec('change_ootd')
-        if not change_ootd_spec:
+        # 导入算法模块(每个模块只解析一次)
+        change_ootd = preload.import_module('change_ootd')
+        if change_ootd is None:
             return False, "change_ootd模块不可用", None
         
-        # 导入算法模块
-        import change_ootd
-        
         # 将本地图片转换为base64编码
         try:
             model_image_base64 = encode_image_to_base64(user_image_path)
@@ -0,0 +1,14 @@
+"""
+Puts the algorithm modules on sys.path.
+
+The benchmarks import them by name, as preload does; they live outside
+app/utils/algorithms so that the image does not ship them.
+"""
+
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALGORITHMS_DIR = os.path.join(API_DIR, "app", "utils", "algorithms")
+if ALGORITHMS_DIR not in sys.path:
+    sys.path.insert(0, ALGORITHMS_DIR)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Recall/latency report for the IVF shortlist against exact scoring.
+
+Usage:
+    python bench_ann.py [--sizes 1000 10000 100000] [--queries 200] [--dim 768] [--output report.md]
+
+For every synthetic catalog size it reports recall@5 (overlap of the ANN top-5
+with the exact top-5), top-1 agreement after the aesthetic re-rank, and the
+p50/p99 latency of score + rank for both paths. Embedding time is excluded.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from catalog_ann import IVFIndex
+from embedding_match import rank_matches, score_catalog
+from synthetic_catalog import SyntheticLooks
+
+
+def _match(catalog, user_emb_dict, user_gender, ann=None):
+    user_emb_dict = catalog.prepare_query(user_emb_dict)
+    rows = ann.shortlist(user_emb_dict) if ann is not None else None
+    similarity, valid = score_catalog(user_emb_dict, catalog, user_gender, rows)
+    return rank_matches(similarity, valid, catalog, rows=rows)
+
+
+def _percentiles(samples):
+    return np.percentile(np.array(samples) * 1000, 50), np.percentile(np.array(samples) * 1000, 99)
+
+
+def run(size, queries, dim, n_probe, min_candidates, n_clusters):
+    looks = SyntheticLooks(dim=dim, n_looks=max(32, size // 100))
+    catalog = looks.catalog(size)
+    users = looks.users(queries)
+
+    start_time = time.time()
+    ann = IVFIndex.build(catalog, n_clusters=n_clusters, n_probe=n_probe, min_candidates=min_candidates)
+    build_time = time.time() - start_time
+
+    exact_times, ann_times, recalls, top1 = [], [], [], []
+    for user_emb_dict, user_gender in users:
+        t = time.perf_counter()
+        exact = _match(catalog, user_emb_dict, user_gender)
+        exact_times.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        approx = _match(catalog, user_emb_dict, user_gender, ann)
+        ann_times.append(time.perf_counter() - t)
+
+        recalls.append(len(set(exact.tolist()) & set(approx.tolist())) / max(1, len(exact)))
+        top1.append(len(exact) > 0 and len(approx) > 0 and exact[0] == approx[0])
+
+    return {
+        "size": size,
+        "clusters": ann.n_clusters,
+        "build_s": build_time,
+        "recall": float(np.mean(recalls)),
+        "top1": float(np.mean(top1)),
+        "exact": _percentiles(exact_times),
+        "ann": _percentiles(ann_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF shortlist recall/latency report")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--probes", type=int, default=8)
+    parser.add_argument("--min-candidates", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=None)
+    parser.add_argument("--output", help="also write the markdown table to this file")
+    args = parser.parse_args()
+
+    lines = [
+        f"dim={args.dim}, probes={args.probes}, min_candidates={args.min_candidates}, queries={args.queries}",
+        "",
+        "| entries | clusters | build (s) | recall@5 | top-1 agreement | exact p50 / p99 (ms) | ANN p50 / p99 (ms) |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for size in args.sizes:
+        r = run(size, args.queries, args.dim, args.probes, args.min_candidates, args.clusters)
+        lines.append(
+            f"| {r['size']} | {r['clusters']} | {r['build_s']:.1f} | {r['recall']:.3f} | {r['top1']:.3f} "
+            f"| {r['exact'][0]:.2f} / {r['exact'][1]:.2f} | {r['ann'][0]:.2f} / {r['ann'][1]:.2f} |"
+        )
+        print(lines[-1], flush=True)
+
+    report = "\n".join(lines)
+    print()
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Throughput of batched multi-user matching against one user per call.
+
+Usage:
+    python bench_batch.py [--size 20000] [--users 1000]
+    python bench_batch.py --catalog ../app/utils/algorithms/catalog_bin --model distilbert-base-uncased [--users 1000]
+
+Without --catalog, synthetic users are scored against a synthetic catalog
+(embedding excluded): match_catalog per user vs match_catalog_batch. With
+--catalog and --model, catalog entries' own attribute texts are the users and
+the whole path is timed: top_matches per user vs batch_top_matches (the
+embedding cache is cleared before each run). Reports users per minute and
+how many results differ (ranked lists for synthetic users, best images
+end to end); synthetic lists that only reorder rows whose scores are equal to
+within 1e-6 are counted separately as ties.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+import embedding_match
+from catalog_index import CatalogIndex, load_attribute_texts
+from synthetic_catalog import SyntheticLooks
+
+
+def _user_text(attribute_texts, row):
+    data = {}
+    for attr, texts in attribute_texts.items():
+        if texts[row] is None:
+            continue
+        node = data
+        *parents, leaf = attr.split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = texts[row]
+    return json.dumps(data)
+
+
+def _scoring(args):
+    looks = SyntheticLooks(n_looks=max(32, args.size // 100))
+    catalog = looks.catalog(args.size)
+    users = looks.users(args.users)
+
+    start = time.perf_counter()
+    single = [embedding_match.match_catalog(user_emb_dict, catalog, gender) for user_emb_dict, gender in users]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = embedding_match.match_catalog_batch([u for u, _ in users], catalog, [g for _, g in users])
+    batch_time = time.perf_counter() - start
+
+    differing = ties = 0
+    for (user_emb_dict, gender), a, b in zip(users, single, batch):
+        if np.array_equal(a, b):
+            continue
+        similarity, _ = embedding_match.score_catalog(catalog.prepare_query(user_emb_dict), catalog, gender)
+        if len(a) == len(b) and np.allclose(np.sort(similarity[a]), np.sort(similarity[b]), atol=1e-6):
+            ties += 1
+        else:
+            differing += 1
+    return f"catalog entries: {len(catalog)} (synthetic)", len(users), single_time, batch_time, differing, ties
+
+
+def _end_to_end(args):
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval()
+
+    if os.path.isdir(args.catalog):
+        catalog = CatalogIndex.from_binary(args.catalog)
+        texts = load_attribute_texts(args.catalog)
+    else:
+        catalog = CatalogIndex.from_json(args.catalog)
+        texts = catalog.attribute_texts
+    rows = np.random.RandomState(args.seed).choice(len(catalog), min(args.users, len(catalog)), replace=False)
+    user_texts = [_user_text(texts, row) for row in rows]
+
+    embedding_match.get_embedding_cache().clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        single = [embedding_match.top_matches(text, catalog, tokenizer, model, "cpu") for text in user_texts]
+    single_time = time.perf_counter() - start
+
+    embedding_match.get_embedding_cache().clear()
+    start = time.perf_counter()
+    batch = [images[0] if images else None
+             for images in embedding_match.batch_top_matches(user_texts, catalog, tokenizer, model, "cpu")]
+    batch_time = time.perf_counter() - start
+
+    differing = sum(a != b for a, b in zip(single, batch))
+    return f"catalog entries: {len(catalog)}", len(user_texts), single_time, batch_time, differing, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs per-user matching throughput")
+    parser.add_argument("--size", type=int, default=20000, help="synthetic catalog size")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--catalog", help="catalog JSON or binary directory with attribute texts")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    title, users, single_time, batch_time, differing, ties = _end_to_end(args) if args.catalog else _scoring(args)
+    print(f"{title}, users: {users}")
+    print(f"per user: {single_time:.2f} s ({users / single_time * 60:.0f} users/min)")
+    print(f"batched:  {batch_time:.2f} s ({users / batch_time * 60:.0f} users/min, {single_time / batch_time:.2f}x)")
+    print(f"results differing: {differing}" + (f" (plus {ties} reordered among ties)" if ties is not None else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Memory/latency/agreement report for the compressed catalog store.
+
+Usage:
+    python bench_compression.py [--size 20000] [--queries 100] [--dim 768]
+                                [--pca-dims 128 256] [--rescore 50] [--output report.md]
+
+For a synthetic catalog it compares float32 scoring with every compression
+layout (float16, int8, each with and without PCA, each with and without exact
+re-scoring) and reports the embedding memory, p50/p99 match latency, top-5
+agreement with the float32 result and top-1 agreement after the aesthetic
+re-rank. Embedding time is excluded.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from catalog_compression import COMPRESSION_KINDS, CompressedCatalog
+from embedding_match import match_catalog
+from synthetic_catalog import SyntheticLooks
+
+
+def _percentiles(samples):
+    return np.percentile(np.array(samples) * 1000, 50), np.percentile(np.array(samples) * 1000, 99)
+
+
+def _run(catalog, users):
+    results, times = [], []
+    for user_emb_dict, user_gender in users:
+        start = time.perf_counter()
+        results.append(match_catalog(user_emb_dict, catalog, user_gender))
+        times.append(time.perf_counter() - start)
+    return results, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed catalog memory/latency/agreement report")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--pca-dims", nargs="*", type=int, default=[128, 256])
+    parser.add_argument("--rescore", type=int, default=50)
+    parser.add_argument("--output", help="also write the markdown table to this file")
+    args = parser.parse_args()
+
+    looks = SyntheticLooks(dim=args.dim, n_looks=max(32, args.size // 100))
+    catalog = looks.catalog(args.size)
+    users = looks.users(args.queries)
+    baseline, baseline_times = _run(catalog, users)
+    baseline_bytes = sum(matrix.nbytes for matrix in catalog.embeddings.values())
+
+    p50, p99 = _percentiles(baseline_times)
+    lines = [
+        f"entries={args.size}, dim={args.dim}, queries={args.queries}",
+        "",
+        "| layout | rescore | memory (MB) | saved | p50 / p99 (ms) | speedup (p50) | top-5 agreement | top-1 agreement |",
+        "|---|---|---|---|---|---|---|---|",
+        f"| float32 | - | {baseline_bytes / 1e6:.1f} | - | {p50:.2f} / {p99:.2f} | 1.00x | 1.000 | 1.000 |",
+    ]
+    for kind in COMPRESSION_KINDS:
+        for pca_dim in [0] + args.pca_dims:
+            for rescore in (0, args.rescore):
+                compressed = CompressedCatalog.compress(catalog, kind, pca_dim, rescore)
+                results, times = _run(compressed, users)
+                top5 = np.mean([len(set(a.tolist()) & set(b.tolist())) / max(1, len(a))
+                                for a, b in zip(baseline, results)])
+                top1 = np.mean([len(a) > 0 and len(b) > 0 and a[0] == b[0] for a, b in zip(baseline, results)])
+                c50, c99 = _percentiles(times)
+                layout = f"{kind}" + (f" + PCA {pca_dim}" if pca_dim else "")
+                lines.append(
+                    f"| {layout} | {rescore or '-'} | {compressed.nbytes / 1e6:.1f} | "
+                    f"{1 - compressed.nbytes / baseline_bytes:.1%} | {c50:.2f} / {c99:.2f} | "
+                    f"{p50 / c50:.2f}x | {top5:.3f} | {top1:.3f} |"
+                )
+                print(lines[-1], file=sys.stderr)
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
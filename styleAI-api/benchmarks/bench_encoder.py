@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Eager vs traced/compiled encoder latency across batch sizes.
+
+Usage:
+    python bench_encoder.py [--model distilbert-base-uncased] [--backend fp32]
+                            [--modes trace compile] [--batch-sizes 1 2 4 8 16 32 64] [--repeats 20]
+
+Every batch holds short attribute values mixed with longer descriptions and
+goes through encode_texts, so tokenization and length bucketing are included
+in the timings exactly as in a request.
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from embedding_backends import BACKENDS, apply_backend, compile_encoder
+from embedding_match import encode_texts
+
+SAMPLE_TEXTS = [
+    "male", "oval", "slim", "warm undertone", "dark brown", "medium height",
+    "calm and understated overall impression with clean lines",
+    "slender frame with narrow shoulders and softly defined limbs",
+    "low contrast outfits in navy, charcoal and camel with one accent colour",
+]
+
+
+def _latency(model, tokenizer, batches, repeats):
+    for texts in batches[:2]:
+        encode_texts(texts, tokenizer, model, "cpu")
+    samples = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        encode_texts(batches[i % len(batches)], tokenizer, model, "cpu")
+        samples.append(time.perf_counter() - start)
+    return np.percentile(np.array(samples) * 1000, 50), np.percentile(np.array(samples) * 1000, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eager vs compiled CLS encoder latency")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--backend", default="fp32", choices=BACKENDS)
+    parser.add_argument("--modes", nargs="+", default=["trace", "compile"], choices=["trace", "compile"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model, backend = apply_backend(AutoModel.from_pretrained(args.model), "cpu", args.backend)
+
+    encoders = [("eager", model)]
+    for mode in args.modes:
+        start = time.time()
+        encoder, applied = compile_encoder(model, tokenizer, "cpu", mode)
+        if applied == mode:
+            print(f"{mode} encoder built in {time.time() - start:.1f}s")
+            encoders.append((mode, encoder))
+        else:
+            print(f"{mode} encoder unavailable, skipped")
+
+    rng = random.Random(args.seed)
+    header = "| batch | " + " | ".join(f"{name} p50 / p99 (ms)" for name, _ in encoders) + " |"
+    print(f"backend: {backend}")
+    print(header)
+    print("|" + "---|" * (len(encoders) + 1))
+    for batch_size in args.batch_sizes:
+        batches = [[rng.choice(SAMPLE_TEXTS) for _ in range(batch_size)] for _ in range(4)]
+        cells = []
+        for _, encoder in encoders:
+            p50, p99 = _latency(encoder, tokenizer, batches, args.repeats)
+            cells.append(f"{p50:.1f} / {p99:.1f}")
+        print(f"| {batch_size} | " + " | ".join(cells) + " |")
+
+
+if __name__ == "__main__":
+    main()
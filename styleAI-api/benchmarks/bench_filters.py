@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Latency of filtered matching against filter selectivity.
+
+Usage:
+    python bench_filters.py [--size 100000] [--queries 40]
+
+A synthetic catalog gets synthetic ``Style Features`` columns (an occasion
+with a skewed value distribution and comma-separated style keywords) and is
+matched with filters of decreasing selectivity. Reported per filter: the
+fraction of the catalog it keeps, the time to compile it into a row bitmask,
+the p50 latency of match_catalog on the selected rows, and how many results
+differ from scoring the whole catalog and dropping the rows the filter
+rejects, which should always be 0.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+import catalog_filters
+import embedding_match
+from synthetic_catalog import SyntheticLooks
+
+OCCASIONS = ["Daily", "Office", "Party", "Wedding", "Gala", "Funeral", "Opera", "Regatta"]
+STYLE_KEYWORDS = ["formal", "classic", "casual street", "one-piece dress", "minimalist", "vintage", "sporty"]
+FILTERS = [
+    "style!=one-piece",
+    "occasion=daily",
+    "occasion=office|party",
+    "gender=female; occasion=office",
+    "style=formal; occasion=party",
+    "occasion=wedding",
+    "occasion=gala",
+    "occasion=opera",
+    "occasion=regatta; style=vintage",
+]
+
+
+def style_texts(n, seed=3):
+    """Occasion (each value half as frequent as the previous one) and 1-3 style keywords per row."""
+    rng = np.random.RandomState(seed)
+    weights = 0.5 ** np.arange(len(OCCASIONS))
+    occasions = rng.choice(OCCASIONS, size=n, p=weights / weights.sum())
+    keywords = [", ".join(rng.choice(STYLE_KEYWORDS, size=rng.randint(1, 4), replace=False)) for _ in range(n)]
+    return {
+        "Style Features.Occasion": np.array(occasions, dtype=object),
+        "Style Features.Style Keywords": np.array(keywords, dtype=object),
+    }
+
+
+def _brute_force(user_emb_dict, catalog, gender, mask):
+    similarity, valid = embedding_match.score_catalog(catalog.prepare_query(user_emb_dict), catalog, gender)
+    return embedding_match.rank_matches(similarity, valid & mask, catalog)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filtered matching latency per selectivity")
+    parser.add_argument("--size", type=int, default=100000, help="synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=40)
+    args = parser.parse_args()
+
+    looks = SyntheticLooks(n_looks=max(32, args.size // 100))
+    catalog = looks.catalog(args.size)
+    catalog.attribute_texts = style_texts(args.size)
+    users = looks.users(args.queries)
+    index = catalog_filters.get_filter_index(catalog)
+    print(f"catalog entries: {len(catalog)}, queries: {len(users)}, "
+          f"posting lists: {sum(len(values) for values in index.postings.values())} ({index.nbytes / 1e6:.1f} MB)")
+
+    for user_emb_dict, gender in users[:3]:
+        embedding_match.match_catalog(user_emb_dict, catalog, gender)
+    samples = []
+    for user_emb_dict, gender in users:
+        start = time.perf_counter()
+        embedding_match.match_catalog(user_emb_dict, catalog, gender)
+        samples.append(time.perf_counter() - start)
+    baseline = np.percentile(samples, 50) * 1000
+
+    print("| filter | selectivity | compile (ms) | match p50 (ms) | vs unfiltered | differing |")
+    print("|---|---|---|---|---|---|")
+    print(f"| (none) | 100.00% | - | {baseline:.1f} | 1.00x | - |")
+    for expression in FILTERS:
+        start = time.perf_counter()
+        rows, selectivity = index.select(expression)
+        compile_ms = (time.perf_counter() - start) * 1000
+        mask = index.mask(expression)
+        samples, differing = [], 0
+        for user_emb_dict, gender in users:
+            start = time.perf_counter()
+            result = embedding_match.match_catalog(user_emb_dict, catalog, gender, rows)
+            samples.append(time.perf_counter() - start)
+            differing += not np.array_equal(result, _brute_force(user_emb_dict, catalog, gender, mask))
+        p50 = np.percentile(samples, 50) * 1000
+        print(f"| `{expression}` | {selectivity:.2%} | {compile_ms:.2f} | {p50:.1f} | {baseline / p50:.2f}x | {differing} |")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
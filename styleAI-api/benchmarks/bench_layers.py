@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Latency saving and ranking agreement of early-exit embeddings per depth.
+
+Usage:
+    python bench_layers.py --catalog ../app/utils/algorithms/catalog_bin [--model distilbert-base-uncased]
+                           [--layers 1 2 3 4 5] [--queries 100] [--output report.md]
+
+A random sample of catalog entries is held out as queries; for every depth
+the remaining catalog is re-embedded with the first N transformer blocks
+(exactly as ``build_catalog.py --layers N`` does) and every query is embedded
+at the same depth. Reported per depth: p50/p99 latency of embedding one
+request's attribute texts (no embedding cache), the speedup over the full
+model, and the top-5 and top-1 agreement with the full-depth ranking.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from catalog_index import CatalogIndex, load_attribute_texts, reembed_catalog
+from embedding_backends import embedding_layers, truncate_layers
+from embedding_match import encode_texts, generate_embeddings, get_embedding_cache, match_catalog, scorable_attributes
+
+
+def _load(path):
+    if os.path.isdir(path):
+        catalog = CatalogIndex.from_binary(path)
+        catalog.attribute_texts = load_attribute_texts(path)
+        return catalog
+    return CatalogIndex.from_json(path)
+
+
+def _subset(catalog, rows):
+    """The catalog restricted to ``rows`` (embeddings are re-computed per depth anyway)."""
+    embeddings = {attr: np.asarray(matrix)[rows] for attr, matrix in catalog.embeddings.items()}
+    masks = {attr: mask[rows] for attr, mask in catalog.masks.items()}
+    texts = {attr: values[rows] for attr, values in catalog.attribute_texts.items()}
+    return CatalogIndex(catalog.images[rows], catalog.gender_codes[rows], catalog.gender_values,
+                        catalog.aesthetic_scores[rows], embeddings, masks, catalog.attribute_keys,
+                        catalog.attribute_key_mask[rows], catalog.normalized, catalog.source_rows[rows], texts)
+
+
+def _queries(catalog, rows):
+    """(attribute texts, gender) of every held-out row, restricted to scorable attributes."""
+    scorable = scorable_attributes(catalog)
+    genders = catalog.genders
+    queries = []
+    for row in rows:
+        texts = {attr: str(values[row]) for attr, values in catalog.attribute_texts.items()
+                 if values[row] is not None and attr in scorable}
+        queries.append((texts, genders[row]))
+    return queries
+
+
+def _evaluate(model, tokenizer, catalog, queries):
+    """Top rows per query and per-request embedding latencies at the model's depth."""
+    # every depth starts cold, so the latencies below include the forward passes
+    get_embedding_cache().clear()
+    encode = lambda texts: generate_embeddings(texts, tokenizer, model, "cpu")
+    with contextlib.redirect_stdout(io.StringIO()):
+        embedded = reembed_catalog(catalog, encode, embedding_layers(model))
+
+    results, times = [], []
+    for texts, gender in queries:
+        keys = list(texts)
+        normalized = [" ".join(texts[key].lower().split()) for key in keys]
+        start = time.perf_counter()
+        vectors = encode_texts(normalized, tokenizer, model, "cpu")
+        times.append(time.perf_counter() - start)
+        results.append(match_catalog(dict(zip(keys, vectors)), embedded, gender))
+    return results, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Early-exit embedding latency/agreement report")
+    parser.add_argument("--catalog", required=True, help="catalog JSON or binary directory with attribute texts")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--layers", nargs="+", type=int, help="depths to compare (default: every shallower depth)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the markdown table to this file")
+    args = parser.parse_args()
+
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    full_model = AutoModel.from_pretrained(args.model).eval()
+    depth = embedding_layers(full_model)
+
+    catalog = _load(args.catalog)
+    if catalog.attribute_texts is None:
+        print(f"{args.catalog} has no attribute texts; rebuild it with build_catalog.py")
+        return 1
+    held_out = np.random.RandomState(args.seed).choice(len(catalog), min(args.queries, len(catalog) // 2),
+                                                       replace=False)
+    queries = _queries(catalog, held_out)
+    catalog = _subset(catalog, np.setdiff1d(np.arange(len(catalog)), held_out))
+
+    baseline, baseline_times = _evaluate(full_model, tokenizer, catalog, queries)
+    p50, p99 = np.percentile(np.array(baseline_times) * 1000, [50, 99])
+    lines = [
+        f"model={args.model}, catalog entries={len(catalog)}, queries={len(queries)}",
+        "",
+        "| layers | request embedding p50 / p99 (ms) | speedup (p50) | top-5 agreement | top-1 agreement |",
+        "|---|---|---|---|---|",
+        f"| {depth} (full) | {p50:.1f} / {p99:.1f} | 1.00x | 1.000 | 1.000 |",
+    ]
+    for n_layers in sorted(args.layers or range(1, depth), reverse=True):
+        if not 0 < n_layers < depth:
+            continue
+        model, _ = truncate_layers(copy.deepcopy(full_model), n_layers)
+        results, times = _evaluate(model, tokenizer, catalog, queries)
+        samples = np.array(times) * 1000
+        top5 = np.mean([len(set(a.tolist()) & set(b.tolist())) / max(1, len(a)) for a, b in zip(baseline, results)])
+        top1 = np.mean([len(a) > 0 and len(b) > 0 and a[0] == b[0] for a, b in zip(baseline, results)])
+        lines.append(
+            f"| {n_layers} | {np.percentile(samples, 50):.1f} / {np.percentile(samples, 99):.1f} | "
+            f"{p50 / np.percentile(samples, 50):.2f}x | {top5:.3f} | {top1:.3f} |"
+        )
+        print(lines[-1], file=sys.stderr)
+
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Startup time, peak memory and latency of one matching backend in a fresh process.
+
+Usage:
+    python bench_lexical.py --backend lexical [--catalog ../app/utils/algorithms/catalog_bin] [--queries 100] [--output lexical.json]
+    python bench_lexical.py --backend embedding [--model distilbert-base-uncased] [--compare lexical.json]
+
+Run it once per backend: startup covers the imports plus loading the model
+(embedding only) and the catalog, and peak RSS is the process high-water mark
+taken before the query texts are read. Queries are catalog entries' own
+attribute texts. --output stores the best image per query, --compare reports
+the top-1 agreement with a stored run.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+
+START = time.time()
+
+import numpy as np
+
+
+def _attribute_texts(path):
+    from catalog_index import CatalogIndex, load_attribute_texts
+    if os.path.isdir(path):
+        return load_attribute_texts(path)
+    return CatalogIndex.from_json(path, normalize=False).attribute_texts
+
+
+def _user_text(attribute_texts, row):
+    """The analysis JSON of catalog row ``row``, rebuilt from its attribute texts."""
+    data = {}
+    for attr, texts in attribute_texts.items():
+        if texts[row] is None:
+            continue
+        node = data
+        *parents, leaf = attr.split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = texts[row]
+    return json.dumps(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-backend startup/memory/latency report")
+    parser.add_argument("--backend", choices=["lexical", "embedding"], required=True)
+    parser.add_argument("--catalog", help="catalog JSON or binary directory (default: CATALOG_PATH)")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the best image per query to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous --output run")
+    args = parser.parse_args()
+
+    import catalog_index
+    path = args.catalog or catalog_index.get_catalog_path()
+    if args.backend == "lexical":
+        import lexical_match
+        catalog = lexical_match.load_lexical_catalog(path)
+        match = lambda text: lexical_match.top_matches(text, catalog)
+    else:
+        import embedding_backends
+        import embedding_match
+        tokenizer, model, _ = embedding_backends.load_embedding_model(args.model, "cpu")
+        catalog = catalog_index.load_catalog_index(path)
+        match = lambda text: embedding_match.top_matches(text, catalog, tokenizer, model, "cpu")
+    if catalog is None:
+        print(f"Failed to load catalog: {path}")
+        return 1
+    startup = time.time() - START
+    # before the query texts are loaded
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    texts = _attribute_texts(path)
+    if texts is None:
+        print(f"{path} has no attribute texts; rebuild it with build_catalog.py")
+        return 1
+    rows = np.random.RandomState(args.seed).choice(len(catalog), min(args.queries, len(catalog)), replace=False)
+
+    best, times = {}, []
+    for row in rows:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            best[str(catalog.images[row])] = match(_user_text(texts, row))
+        times.append(time.perf_counter() - start)
+
+    print(f"backend: {args.backend}, catalog entries: {len(catalog)}, queries: {len(rows)}")
+    print(f"torch imported: {'torch' in sys.modules}")
+    print(f"startup: {startup:.2f} s")
+    print(f"peak RSS after startup: {peak_rss:.0f} MB")
+    samples = np.array(times) * 1000
+    print(f"match p50 / p99: {np.percentile(samples, 50):.1f} / {np.percentile(samples, 99):.1f} ms")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        shared = [query for query in best if query in previous]
+        agreement = np.mean([best[query] == previous[query] for query in shared]) if shared else 0.0
+        print(f"top-1 agreement with {args.compare}: {agreement:.3f} over {len(shared)} queries")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(best, f, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
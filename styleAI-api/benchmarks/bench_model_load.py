@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Cold start of the embedding model: local snapshot vs from_pretrained.
+
+Usage:
+    python bench_model_load.py [--model distilbert-base-uncased] [--snapshot ../app/utils/algorithms/model_snapshot]
+                               [--runs 5] [--drop-caches]
+
+Every run is a fresh Python process timing the torch/transformers imports,
+the model load and the first encoded batch, and reporting its RSS. The
+snapshot mode goes through load_embedding_model as preload does; the
+from_pretrained mode is the hub load it replaces (hub resolution and cache
+lookups included, HF_HUB_OFFLINE=1 skips the network). --drop-caches empties
+the page cache before every run (root only), so the weights are read from
+disk as on a freshly booted host; otherwise the pages stay cached between runs.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+
+CHECK_TEXTS = ["male", "oval face", "slim build with long limbs and softly defined lines"]
+
+
+def _child(mode, model_name, snapshot):
+    start = time.perf_counter()
+    import torch  # noqa: F401
+    import transformers
+    # resolve the lazy transformers modules here so both modes pay them as import time
+    from transformers import AutoModel, AutoTokenizer  # noqa: F401
+    from embedding_match import encode_texts
+    imported = time.perf_counter()
+    if mode == "snapshot":
+        os.environ["EMBEDDING_MODEL_DIR"] = snapshot
+        from embedding_backends import load_embedding_model
+        tokenizer, model, _ = load_embedding_model(snapshot, "cpu")
+    else:
+        tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+        model = transformers.AutoModel.from_pretrained(model_name).eval()
+    loaded = time.perf_counter()
+    encode_texts(CHECK_TEXTS, tokenizer, model, "cpu")
+    encoded = time.perf_counter()
+    with open("/proc/self/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS")) / 1024
+    print(json.dumps({"import": imported - start, "load": loaded - imported,
+                      "first_batch": encoded - loaded, "total": encoded - start, "rss": rss}))
+
+
+def _drop_caches():
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start of the embedding model per load path")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--snapshot", default=None, help="snapshot directory (default EMBEDDING_MODEL_DIR)")
+    parser.add_argument("--modes", nargs="+", default=["from_pretrained", "snapshot"],
+                        choices=["from_pretrained", "snapshot"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from model_snapshot import get_snapshot_dir
+    snapshot = args.snapshot or get_snapshot_dir()
+    if args.child:
+        _child(args.child, args.model, snapshot)
+        return 0
+
+    print(f"model: {args.model}, snapshot: {snapshot}, runs: {args.runs}, "
+          f"page cache: {'dropped before every run' if args.drop_caches else 'warm'}")
+    print("| mode | import (s) | load (s) | first batch (s) | total (s) | RSS (MB) |")
+    print("|---|---|---|---|---|---|")
+    for mode in args.modes:
+        runs = []
+        for _ in range(args.runs):
+            if args.drop_caches:
+                _drop_caches()
+            output = subprocess.run([sys.executable, __file__, "--child", mode, "--model", args.model,
+                                     "--snapshot", snapshot], capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        p50 = {key: np.median([run[key] for run in runs]) for key in runs[0]}
+        print(f"| {mode} | {p50['import']:.2f} | {p50['load']:.2f} | {p50['first_batch']:.2f} | "
+              f"{p50['total']:.2f} | {p50['rss']:.0f} |")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
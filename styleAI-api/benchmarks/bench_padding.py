@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Padding report for length-bucketed tokenization in encode_texts.
+
+Usage:
+    python bench_padding.py [--catalog ../app/utils/algorithms/ALL_final_merged.json] [--requests 50]
+                            [--model distilbert-base-uncased] [--forward]
+
+Every request embeds the attribute values of one analysis (taken from the
+catalog JSON, or a synthetic mix of short values and long descriptions when no
+catalog is given). For each bucket layout it reports the share of pad tokens
+and, with --forward, the mean encode_texts latency per request.
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+import embedding_match
+from embedding_match import MAX_TOKENS, bucket_by_length, extract_attributes_scoring
+
+SHORT_VALUES = ["Male", "Female", "Oval", "Round", "Slim", "Warm", "Cool", "Medium", "Dark brown", "Fair"]
+LONG_VALUES = [
+    "Overall impression is calm and understated, with a preference for clean lines, muted colours "
+    "and well fitted pieces that suggest quiet confidence rather than attention seeking",
+    "Slender frame with narrow shoulders and long limbs; lines are soft rather than angular and the "
+    "waist is only slightly defined, so structured layers help add presence",
+    "Choose low contrast outfits in navy, charcoal and camel, avoid saturated warm reds near the face, "
+    "and use a single accent colour in accessories",
+]
+
+
+def catalog_requests(path, count, seed):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    random.Random(seed).shuffle(entries)
+    requests = []
+    for entry in entries:
+        try:
+            text = entry["result"]["data"]["outputs"]["text"]
+        except (KeyError, TypeError):
+            continue
+        attributes, _ = extract_attributes_scoring(text)
+        if attributes:
+            requests.append([str(value) for value in attributes.values()])
+        if len(requests) == count:
+            break
+    return requests
+
+
+def synthetic_requests(count, seed, n_attributes=20, long_share=0.25):
+    rng = random.Random(seed)
+    return [[rng.choice(LONG_VALUES) if rng.random() < long_share else rng.choice(SHORT_VALUES)
+             for _ in range(n_attributes)] for _ in range(count)]
+
+
+def padding(requests, tokenizer, boundaries):
+    real = padded = passes = 0
+    for texts in requests:
+        lengths = [len(ids) for ids in tokenizer(texts, truncation=True, max_length=MAX_TOKENS)["input_ids"]]
+        buckets = bucket_by_length(lengths, boundaries)
+        real += sum(lengths)
+        padded += sum(len(rows) * max(lengths[i] for i in rows) for rows in buckets)
+        passes += len(buckets)
+    return 1 - real / padded, passes / len(requests)
+
+
+def forward_time(requests, tokenizer, model, boundaries):
+    samples = []
+    for texts in requests:
+        normalized = [" ".join(text.lower().split()) for text in texts]
+        start = time.perf_counter()
+        embedding_match.encode_texts(normalized, tokenizer, model, "cpu", boundaries)
+        samples.append(time.perf_counter() - start)
+    return float(np.mean(samples)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Padding ratio of bucketed vs unbucketed tokenization")
+    parser.add_argument("--catalog", help="source catalog JSON to take attribute texts from")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--forward", action="store_true", help="also time encode_texts on the model")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval() if args.forward else None
+
+    if args.catalog:
+        requests = catalog_requests(args.catalog, args.requests, args.seed)
+    else:
+        requests = synthetic_requests(args.requests, args.seed)
+
+    layouts = [("unbucketed", ()), ("configured", embedding_match.LENGTH_BUCKETS)]
+    header = "| Layout | Buckets | Padding ratio | Forward passes / request |"
+    if args.forward:
+        header += " encode_texts mean (ms) |"
+    print(header)
+    print("|" + " --- |" * (header.count("|") - 1))
+    for name, boundaries in layouts:
+        ratio, passes = padding(requests, tokenizer, boundaries)
+        row = f"| {name} | {','.join(map(str, boundaries)) or '-'} | {ratio:.3f} | {passes:.1f} |"
+        if args.forward:
+            row += f" {forward_time(requests, tokenizer, model, boundaries):.1f} |"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Matching latency of sharded scatter-gather scoring per shard count.
+
+Usage:
+    python bench_shards.py [--size 200000] [--shards 1 2 4 8] [--queries 60] [--catalog ../app/utils/algorithms/catalog_bin]
+
+Every shard count gets its own pool of forked workers over the same catalog
+(synthetic unless --catalog is given, whose own rows are then the queries) and
+runs every query once to warm up, then once timed. Reports p50/p99 latency
+of match_catalog, the speedup over in-process scoring (shard count 1) and
+how many rankings differ from it, which should always be 0. The speedup is
+bounded by the cores available (printed first).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+import catalog_shards
+import embedding_match
+from catalog_index import CatalogIndex
+from synthetic_catalog import SyntheticLooks
+
+
+def _catalog_queries(catalog, count, seed):
+    """Every scorable attribute vector and the gender of sampled catalog rows."""
+    rows = np.random.RandomState(seed).choice(len(catalog), min(count, len(catalog)), replace=False)
+    genders = catalog.genders
+    return [({attr: np.asarray(catalog.embeddings[attr][row]) for attr in catalog.attributes
+              if catalog.masks[attr][row]}, genders[row]) for row in rows]
+
+
+def _run(catalog, queries):
+    times, results = [], []
+    for user_emb_dict, gender in queries:
+        start = time.perf_counter()
+        results.append(embedding_match.match_catalog(user_emb_dict, catalog, gender))
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded scoring latency per shard count")
+    parser.add_argument("--size", type=int, default=200000, help="synthetic catalog size")
+    parser.add_argument("--shards", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--catalog", help="catalog JSON or binary directory instead of a synthetic one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.catalog:
+        catalog = CatalogIndex.load(args.catalog)
+        queries = _catalog_queries(catalog, args.queries, args.seed)
+    else:
+        looks = SyntheticLooks(n_looks=max(32, args.size // 100))
+        catalog = looks.catalog(args.size)
+        queries = looks.users(args.queries)
+    print(f"catalog entries: {len(catalog)}, queries: {len(queries)}, cpus: {os.cpu_count()}")
+
+    os.environ["CATALOG_SHARD_MIN_ROWS"] = "0"
+    baseline = None
+    for n_shards in args.shards:
+        os.environ["CATALOG_SHARDS"] = str(n_shards)
+        # a fresh view per shard count, each with its own pool
+        shard_catalog = catalog.row_range(0, len(catalog))
+        _run(shard_catalog, queries)
+        samples, results = _run(shard_catalog, queries)
+        p50, p99 = np.percentile(samples, [50, 99])
+        if baseline is None:
+            baseline = (p50, results)
+        differing = sum(not np.array_equal(a, b) for a, b in zip(baseline[1], results))
+        print(f"shards {n_shards}: p50 {p50:.1f} ms, p99 {p99:.1f} ms, "
+              f"{baseline[0] / p50:.2f}x, rankings differing from shards {args.shards[0]}: {differing}")
+        pool = catalog_shards.get_shard_pool(shard_catalog, embedding_match.shard_candidates)
+        if pool is not None:
+            pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Latency of the first requests after a cold start, with and without warm-up.
+
+Usage:
+    python bench_warmup.py --catalog ../app/utils/algorithms/catalog_bin [--model distilbert-base-uncased]
+                           [--requests 20] [--runs 3] [--drop-caches]
+
+Every run is a fresh Python process that loads the model (from the local
+snapshot when there is one, see model_snapshot) and the catalog, runs the
+warm-up of warmup.py or not, then serves --requests distinct catalog entries
+as users through top_matches, the request path (embedding cache included,
+which the distinct users always miss). Reports the warm-up time and the
+latency of the first request, p50 and the maximum over the first requests,
+the median of every figure over --runs. --drop-caches empties the page cache
+before every run (root only), as on a freshly booted host.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from bench_batch import _user_text
+from catalog_index import CatalogIndex, get_catalog_path, load_attribute_texts
+
+
+def _child(args, warm):
+    import embedding_match
+    import warmup
+    from embedding_backends import load_embedding_model
+
+    tokenizer, model, _ = load_embedding_model(args.model, "cpu")
+    catalog = CatalogIndex.load(args.catalog)
+    texts = load_attribute_texts(args.catalog) if os.path.isdir(args.catalog) else catalog.attribute_texts
+    n = len(catalog)
+    users = [_user_text(texts, row) for row in range(0, n, max(1, n // args.requests))][:args.requests]
+
+    warmup_seconds = 0.0
+    if warm:
+        start = time.perf_counter()
+        for batch_size in warmup.get_warmup_config()["batch_sizes"]:
+            warmup.warm_embeddings(tokenizer, model, "cpu", batch_size)
+        warmup.warm_catalog(catalog, warmup.catalog_query(catalog, tokenizer, model, "cpu"))
+        warmup_seconds = time.perf_counter() - start
+
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for user_text in users:
+            start = time.perf_counter()
+            embedding_match.top_matches(user_text, catalog, tokenizer, model, "cpu")
+            latencies.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({"warmup": warmup_seconds, "first": latencies[0],
+                      "p50": float(np.percentile(latencies, 50)), "max": max(latencies)}))
+
+
+def _drop_caches():
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="First-request latency after a cold start, with and without warm-up")
+    parser.add_argument("--catalog", default=get_catalog_path())
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args, args.child == "warm")
+        return 0
+
+    print(f"catalog: {args.catalog}, model: {args.model}, requests: {args.requests}, runs: {args.runs}, "
+          f"page cache: {'dropped before every run' if args.drop_caches else 'warm'}")
+    print("| mode | warm-up (s) | first request (ms) | p50 (ms) | max (ms) |")
+    print("|---|---|---|---|---|")
+    for mode in ("cold", "warm"):
+        runs = []
+        for _ in range(args.runs):
+            if args.drop_caches:
+                _drop_caches()
+            output = subprocess.run([sys.executable, __file__, "--child", mode, "--catalog", args.catalog,
+                                     "--model", args.model, "--requests", str(args.requests)],
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        p50 = {key: np.median([run[key] for run in runs]) for key in runs[0]}
+        print(f"| {mode} | {p50['warmup']:.2f} | {p50['first']:.1f} | {p50['p50']:.1f} | {p50['max']:.1f} |")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
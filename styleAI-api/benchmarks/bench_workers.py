@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Memory of N forked serving workers with and without a preloading master.
+
+Usage:
+    python bench_workers.py --catalog ../app/utils/algorithms/catalog_bin [--model distilbert-base-uncased]
+                            [--workers 1 2 4] [--queries 20] [--gunicorn]
+
+Reproduces the two gunicorn modes of gunicorn.conf.py without a web server:
+    per-worker  (GUNICORN_PRELOAD=0) every forked worker loads the model and
+                the catalog itself
+    preload     (GUNICORN_PRELOAD=1) the master loads them single-threaded,
+                freezes the GC and forks the workers, which share the pages
+Every worker then matches --queries catalog entries end to end (the encoder
+runs, so pages touched by inference are counted) and reports its memory from
+/proc/self/smaps_rollup while all workers are alive: RSS, PSS (shared pages
+divided among the processes sharing them) and USS (private pages). The total
+is the PSS of the workers plus the master, the memory the box actually pays.
+
+With --gunicorn the real server is started instead (gunicorn.conf.py, the
+app's own model and catalog configuration, CATALOG_PATH set to --catalog) and
+measured once every process has finished its start-up warm-up; no request is
+served, the routes need the database. Worker memory then covers loading and
+warm-up only, and shard processes (CATALOG_SHARDS) are counted per parent.
+Linux only.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from algorithms_path import API_DIR  # also puts the algorithm modules on sys.path
+import embedding_match
+from bench_batch import _user_text
+from catalog_index import CatalogIndex, get_catalog_path, load_attribute_texts
+
+
+# logged once per process when its start-up warm-up is done (preload.run_warmup)
+WARMUP_DONE = "预热步骤耗时"
+
+
+def memory_mb(pid="self"):
+    """RSS, PSS and USS of process ``pid`` (the calling one by default) in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def _load(model_name, catalog_path):
+    import torch
+    from embedding_backends import compile_encoder, load_embedding_model
+
+    tokenizer, model, _ = load_embedding_model(model_name, "cpu")
+    model, _ = compile_encoder(model, tokenizer, "cpu")
+    torch.set_grad_enabled(False)
+    catalog = CatalogIndex.load(catalog_path)
+    return tokenizer, model, catalog
+
+
+def _queries(catalog_path, count):
+    texts = load_attribute_texts(catalog_path) if os.path.isdir(catalog_path) else \
+        CatalogIndex.from_json(catalog_path).attribute_texts
+    n = len(next(iter(texts.values())))
+    return [_user_text(texts, row) for row in range(0, n, max(1, n // count))][:count]
+
+
+def _worker(loaded, args, queries, threads, report, release):
+    import torch
+
+    torch.set_num_threads(threads)
+    tokenizer, model, catalog = loaded or _load(args.model, args.catalog)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for user_text in queries:
+            embedding_match.top_matches(user_text, catalog, tokenizer, model, "cpu")
+    os.write(report, (json.dumps(memory_mb()) + "\n").encode())
+    # stay alive until every worker has measured, so shared pages are counted as shared
+    os.read(release, 1)
+
+
+def run(mode, n_workers, args, queries):
+    loaded = None
+    threads = max(1, (os.cpu_count() or 1) // n_workers)
+    if mode == "preload":
+        import torch
+        torch.set_num_threads(1)
+        loaded = _load(args.model, args.catalog)
+        gc.collect()
+        gc.freeze()
+
+    report_r, report_w = os.pipe()
+    release_r, release_w = os.pipe()
+    pids = []
+    for _ in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(loaded, args, queries, threads, report_w, release_r)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    with os.fdopen(report_r) as reports:
+        workers = [json.loads(reports.readline()) for _ in range(n_workers)]
+        master = memory_mb()
+        os.write(release_w, b"x" * n_workers)
+        for pid in pids:
+            os.waitpid(pid, 0)
+    return workers, master
+
+
+def _children(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children += [int(child) for child in f.read().split()]
+    return children
+
+
+def run_gunicorn(mode, n_workers, args, port=5099):
+    """Memory of the master, of each worker and of the shard processes of a real gunicorn."""
+    env = dict(os.environ, GUNICORN_PRELOAD="1" if mode == "preload" else "0", GUNICORN_WORKERS=str(n_workers),
+               CATALOG_PATH=os.path.abspath(args.catalog), MODEL_WARMUP_DB="0")
+    with tempfile.TemporaryFile() as log:
+        server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                                   "-b", f"127.0.0.1:{port}", "app:create_app()"],
+                                  cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            # the preload master warms up once for every worker
+            expected = 1 if mode == "preload" else n_workers
+            deadline = time.time() + args.timeout
+            while True:
+                log.seek(0)
+                text = log.read().decode("utf-8", "replace")
+                workers = [int(pid) for pid in re.findall(r"Booting worker with pid: (\d+)", text)]
+                if text.count(WARMUP_DONE) >= expected and len(workers) == n_workers:
+                    break
+                if server.poll() is not None or time.time() > deadline:
+                    raise RuntimeError(f"gunicorn ({mode}, {n_workers} workers) did not finish warming up")
+                time.sleep(0.5)
+            # let the workers forked after the warm-up finish post_fork (shard pools)
+            time.sleep(2)
+            # shard processes: the master's own, besides its workers, and the workers'
+            shards = {"master": [pid for pid in _children(server.pid) if pid not in workers],
+                      "workers": [child for pid in workers for child in _children(pid)]}
+            return ([memory_mb(pid) for pid in workers], memory_mb(server.pid),
+                    {owner: [memory_mb(pid) for pid in pids] for owner, pids in shards.items()})
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory with and without a preloading master")
+    parser.add_argument("--catalog", default=get_catalog_path())
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", default=["per-worker", "preload"], choices=["per-worker", "preload"])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--gunicorn", action="store_true", help="measure a real gunicorn server instead")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a gunicorn start-up")
+    args = parser.parse_args()
+
+    if args.gunicorn:
+        print(f"catalog: {args.catalog}, gunicorn.conf.py, CATALOG_SHARDS={os.environ.get('CATALOG_SHARDS', 0)}, "
+              f"cpus: {os.cpu_count()}")
+        print("| mode | workers | RSS / worker (MB) | PSS / worker (MB) | USS / worker (MB) | master PSS (MB) | "
+              "shard processes master / workers | shard PSS (MB) | total PSS (MB) |")
+        print("|---|---|---|---|---|---|---|---|---|")
+        for mode in args.modes:
+            for n_workers in args.workers:
+                workers, master, shards = run_gunicorn(mode, n_workers, args)
+                mean = {key: sum(w[key] for w in workers) / n_workers for key in ("rss", "pss", "uss")}
+                shard_pss = sum(m["pss"] for pids in shards.values() for m in pids)
+                total = sum(w["pss"] for w in workers) + master["pss"] + shard_pss
+                print(f"| {mode} | {n_workers} | {mean['rss']:.0f} | {mean['pss']:.0f} | {mean['uss']:.0f} | "
+                      f"{master['pss']:.0f} | {len(shards['master'])} / {len(shards['workers'])} | "
+                      f"{shard_pss:.0f} | {total:.0f} |", flush=True)
+        return 0
+
+    queries = _queries(args.catalog, args.queries)
+    print(f"catalog: {args.catalog}, model: {args.model}, queries per worker: {len(queries)}, cpus: {os.cpu_count()}")
+    print("| mode | workers | RSS / worker (MB) | PSS / worker (MB) | USS / worker (MB) | master PSS (MB) | total PSS (MB) |")
+    print("|---|---|---|---|---|---|---|")
+    for mode in args.modes:
+        for n_workers in args.workers:
+            # a fresh master per run: the preload master keeps the model it loaded
+            pid = os.fork()
+            if pid == 0:
+                workers, master = run(mode, n_workers, args, queries)
+                mean = {key: sum(w[key] for w in workers) / n_workers for key in ("rss", "pss", "uss")}
+                total = sum(w["pss"] for w in workers) + master["pss"]
+                print(f"| {mode} | {n_workers} | {mean['rss']:.0f} | {mean['pss']:.0f} | {mean['uss']:.0f} | "
+                      f"{master['pss']:.0f} | {total:.0f} |", flush=True)
+                os._exit(0)
+            os.waitpid(pid, 0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
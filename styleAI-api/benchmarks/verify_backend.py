@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Quality and cost check of an embedding backend against fp32.
+
+Usage:
+    python verify_backend.py [--backend int8] [--catalog ../app/utils/algorithms/ALL_final_merged.json]
+                             [--entries 200] [--queries 50] [--model distilbert-base-uncased]
+
+Re-embeds the attribute texts of a sample of catalog analyses with the fp32
+model and with the backend, then reports:
+    - cosine drift between the two embeddings of every text
+    - score drift and top-5 / top-1 agreement as served: EMBEDDING_BACKEND
+      only changes the query side, the catalog keeps the fp32 vectors of
+      ALL_final_merged.json or build_catalog.py (which always embeds with
+      fp32), so held-out analyses are matched against the fp32 vectors of the
+      sampled entries once with fp32 and once with backend query vectors
+    - encode speedup and serialized model size
+
+Without --catalog a synthetic set of analyses is generated.
+"""
+
+import argparse
+import copy
+import io
+import json
+import random
+import time
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from catalog_index import CatalogIndex, GENDER_ATTR
+from embedding_backends import BACKENDS, apply_backend
+from embedding_match import encode_texts, extract_attributes_scoring, rank_matches, score_catalog
+from synthetic_catalog import synthetic_attributes
+
+LOOK_WORDS = ("slim athletic curvy tall petite broad soft sharp warm cool muted bright classic modern "
+              "minimal casual formal relaxed tailored layered navy camel charcoal beige olive cream "
+              "black white denim linen wool oversized fitted cropped straight wide relaxed elegant "
+              "sporty romantic edgy calm confident gentle bold understated polished").split()
+
+
+def catalog_analyses(path, count, seed):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    random.Random(seed).shuffle(entries)
+    analyses = []
+    for entry in entries:
+        try:
+            text = entry["result"]["data"]["outputs"]["text"]
+        except (KeyError, TypeError):
+            continue
+        attributes, _ = extract_attributes_scoring(text)
+        attributes.pop(GENDER_ATTR, None)
+        if attributes:
+            analyses.append({attr: str(value) for attr, value in attributes.items()})
+        if len(analyses) == count:
+            break
+    return analyses
+
+
+def synthetic_analyses(count, seed, n_looks=20):
+    """Analyses drawn around a few looks, each attribute a short or long word sequence."""
+    rng = random.Random(seed)
+    attributes = synthetic_attributes()
+    looks = [{attr: rng.sample(LOOK_WORDS, rng.choice([2, 6, 24])) for attr in attributes}
+             for _ in range(n_looks)]
+    analyses = []
+    for _ in range(count):
+        look = rng.choice(looks)
+        analyses.append({attr: " ".join(word if rng.random() > 0.2 else rng.choice(LOOK_WORDS) for word in words)
+                         for attr, words in look.items()})
+    return analyses
+
+
+def embed_analyses(analyses, tokenizer, model, batch_size):
+    """Per analysis {attr: vector}, plus the total encode time in seconds."""
+    texts = list(dict.fromkeys(" ".join(value.lower().split()) for analysis in analyses for value in analysis.values()))
+    start = time.perf_counter()
+    vectors = np.concatenate([encode_texts(texts[i:i + batch_size], tokenizer, model, "cpu")
+                              for i in range(0, len(texts), batch_size)])
+    elapsed = time.perf_counter() - start
+    by_text = dict(zip(texts, vectors))
+    embedded = [{attr: by_text[" ".join(value.lower().split())] for attr, value in analysis.items()}
+                for analysis in analyses]
+    return embedded, by_text, elapsed
+
+
+def build_catalog(embedded):
+    n = len(embedded)
+    attributes = sorted({attr for emb_dict in embedded for attr in emb_dict})
+    dim = len(next(iter(embedded[0].values())))
+    embeddings = {attr: np.zeros((n, dim), dtype=np.float32) for attr in attributes}
+    masks = {attr: np.zeros(n, dtype=bool) for attr in attributes}
+    for row, emb_dict in enumerate(embedded):
+        for attr, vector in emb_dict.items():
+            embeddings[attr][row] = vector
+            masks[attr][row] = True
+    images = np.array([f"entry_{i}" for i in range(n)], dtype=object)
+    return CatalogIndex(images, np.full(n, -1, dtype=np.int16), [], np.zeros(n), embeddings, masks,
+                        attributes, np.ones((n, len(attributes)), dtype=bool))
+
+
+def model_size_mb(model):
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against fp32")
+    parser.add_argument("--backend", default="int8", choices=[b for b in BACKENDS if b != "fp32"])
+    parser.add_argument("--catalog", help="source catalog JSON to take analyses from")
+    parser.add_argument("--entries", type=int, default=200, help="analyses used as the catalog")
+    parser.add_argument("--queries", type=int, default=50, help="held-out analyses used as users")
+    parser.add_argument("--model", default="distilbert-base-uncased")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    fp32_model = AutoModel.from_pretrained(args.model).eval()
+    backend_model, applied = apply_backend(copy.deepcopy(fp32_model), "cpu", args.backend)
+
+    count = args.entries + args.queries
+    if args.catalog:
+        analyses = catalog_analyses(args.catalog, count, args.seed)
+    else:
+        analyses = synthetic_analyses(count, args.seed)
+
+    # warm both models up so the timings below exclude one-off initialization
+    encode_texts(["warm up"], tokenizer, fp32_model, "cpu")
+    encode_texts(["warm up"], tokenizer, backend_model, "cpu")
+    fp32_embedded, fp32_vectors, fp32_time = embed_analyses(analyses, tokenizer, fp32_model, args.batch_size)
+    backend_embedded, backend_vectors, backend_time = embed_analyses(analyses, tokenizer, backend_model,
+                                                                     args.batch_size)
+
+    cosines = []
+    for text, a in fp32_vectors.items():
+        b = backend_vectors[text]
+        cosines.append(float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b))))
+    drift = 1 - np.array(cosines)
+
+    # the served catalog is embedded with fp32 whatever the query backend
+    fp32_catalog = build_catalog(fp32_embedded[:args.entries])
+    overlaps, top1, score_drift = [], [], []
+    for fp32_user, backend_user in zip(fp32_embedded[args.entries:], backend_embedded[args.entries:]):
+        expected_similarity, expected_valid = score_catalog(fp32_user, fp32_catalog)
+        similarity, valid = score_catalog(backend_user, fp32_catalog)
+        score_drift.append(np.abs(similarity - expected_similarity)[valid & expected_valid])
+        expected = rank_matches(expected_similarity, expected_valid, fp32_catalog)
+        actual = rank_matches(similarity, valid, fp32_catalog)
+        overlaps.append(len(set(expected.tolist()) & set(actual.tolist())) / max(1, len(expected)))
+        top1.append(len(expected) > 0 and len(actual) > 0 and expected[0] == actual[0])
+    score_drift = np.concatenate(score_drift)
+
+    fp32_size = model_size_mb(fp32_model)
+    backend_size = model_size_mb(backend_model)
+    print(f"backend: {applied}, texts: {len(fp32_vectors)}, catalog entries: {args.entries}, "
+          f"queries: {len(overlaps)}")
+    print("| metric | value |")
+    print("|---|---|")
+    print(f"| cosine drift mean / max | {drift.mean():.5f} / {drift.max():.5f} |")
+    print(f"| score drift mean / max ({applied} queries, fp32 catalog) | "
+          f"{score_drift.mean():.5f} / {score_drift.max():.5f} |")
+    print(f"| top-5 agreement | {np.mean(overlaps):.3f} |")
+    print(f"| top-1 agreement | {np.mean(top1):.3f} |")
+    print(f"| encode time fp32 / {applied} (s) | {fp32_time:.2f} / {backend_time:.2f} |")
+    print(f"| speedup | {fp32_time / backend_time:.2f}x |")
+    print(f"| model size fp32 / {applied} (MB) | {fp32_size:.1f} / {backend_size:.1f} |")
+    print(f"| memory reduction | {1 - backend_size / fp32_size:.1%} |")
+
+
+if __name__ == "__main__":
+    main()
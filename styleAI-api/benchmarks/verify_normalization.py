@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Check that pre-normalized catalog vectors give the same matching outcomes.
+
+Usage:
+    python verify_normalization.py [--catalog ../app/utils/algorithms/ALL_final_merged.json] [--queries 200]
+
+Scores every query against the catalog twice: with raw vectors and per-call
+cosine norms (the previous layout) and with rows normalized at build time and
+the user vector normalized once (the current layout). Reports the largest
+squared-similarity difference, how many THRESHOLD/PENALTY_VALUE decisions
+changed and how many final top-5 lists differ; lists that only swap entries
+whose raw scores are equal to within 1e-6 (duplicate catalog rows) are counted
+separately as ties.
+
+Queries are catalog entries' own attribute vectors when --catalog is given,
+otherwise synthetic users against a synthetic catalog with random row norms.
+"""
+
+import argparse
+
+import numpy as np
+
+import algorithms_path  # noqa: F401  (the algorithm modules by name)
+from catalog_index import CatalogIndex
+from embedding_match import MAPPED_ATTRS, THRESHOLD, WEIGHTS, match_catalog, score_catalog
+from synthetic_catalog import SyntheticLooks
+
+
+def _with_embeddings(catalog, embeddings, normalized):
+    return CatalogIndex(catalog.images, catalog.gender_codes, catalog.gender_values, catalog.aesthetic_scores,
+                        embeddings, catalog.masks, catalog.attribute_keys, catalog.attribute_key_mask, normalized,
+                        catalog.source_rows)
+
+
+def synthetic_pair(size, queries, seed):
+    looks = SyntheticLooks(n_looks=max(32, size // 100))
+    normalized = looks.catalog(size)
+    rng = np.random.RandomState(seed)
+    # CLS vectors are far from unit length; give every raw row its own norm
+    raw = {attr: matrix * rng.uniform(5.0, 15.0, size=(size, 1)).astype(np.float32)
+           for attr, matrix in normalized.embeddings.items()}
+    return _with_embeddings(normalized, raw, False), normalized, looks.users(queries)
+
+
+def catalog_pair(path, queries, seed):
+    raw = CatalogIndex.from_json(path, normalize=False)
+    normalized = CatalogIndex.from_json(path)
+    rng = np.random.RandomState(seed)
+    users = []
+    for row in rng.choice(len(raw), min(queries, len(raw)), replace=False):
+        emb_dict = {attr: np.array(raw.embeddings[attr][row]) for attr in raw.attributes if raw.masks[attr][row]}
+        users.append((emb_dict, raw.genders[row]))
+    return raw, normalized, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw vs pre-normalized catalog scoring")
+    parser.add_argument("--catalog", help="source catalog JSON; synthetic data when omitted")
+    parser.add_argument("--size", type=int, default=5000, help="synthetic catalog size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.catalog:
+        raw, normalized, users = catalog_pair(args.catalog, args.queries, args.seed)
+    else:
+        raw, normalized, users = synthetic_pair(args.size, args.queries, args.seed)
+
+    max_difference = 0.0
+    decisions = flips = differing = ties = 0
+    for user_emb_dict, user_gender in users:
+        query = normalized.prepare_query(user_emb_dict)
+        pairs = [(attr, attr) for attr in user_emb_dict if attr in raw.embeddings]
+        pairs += [(u, m) for u, m in MAPPED_ATTRS.items() if u in user_emb_dict and m in raw.embeddings]
+        for user_key, model_key in pairs:
+            mask = raw.masks[model_key]
+            before = raw.cosine(model_key, user_emb_dict[user_key])[mask] ** 2
+            after = normalized.cosine(model_key, query[user_key])[mask] ** 2
+            if len(before):
+                max_difference = max(max_difference, float(np.abs(before - after).max()))
+            if WEIGHTS.get(user_key, 1.0) == 1.0:
+                decisions += len(before)
+                flips += int(np.count_nonzero((before >= THRESHOLD) != (after >= THRESHOLD)))
+
+        expected = match_catalog(user_emb_dict, raw, user_gender)
+        actual = match_catalog(user_emb_dict, normalized, user_gender)
+        if not np.array_equal(expected, actual):
+            similarity, _ = score_catalog(user_emb_dict, raw, user_gender)
+            if len(expected) == len(actual) and np.allclose(similarity[expected], similarity[actual], atol=1e-6):
+                ties += 1
+            else:
+                differing += 1
+
+    print(f"queries: {len(users)}, catalog entries: {len(raw)}")
+    print(f"max squared-similarity difference: {max_difference:.3e}")
+    print(f"threshold decisions changed: {flips} of {decisions}")
+    print(f"top-5 lists differing: {differing} of {len(users)} (plus {ties} reordered among ties)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import os
 bind = "0.0.0.0:5001"
 
 # Worker optimization
-workers = 1
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
 threads = 2
 worker_class = "gthread"
 
@@ -22,7 +22,28 @@ graceful_timeout = 60
 keepalive = 5
 
 # Optimize for memory usage
-preload_app = False  # Don't preload the app to save memory
+# GUNICORN_PRELOAD=1 loads the app, the model and the catalog once in the master
+# and forks the workers from it: they share the weights copy-on-write, so N
+# workers cost about one model, and a worker recycled by max_requests is forked
+# with the model already loaded. Off by default: each worker loads its own copy.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+# Intra-op torch threads per worker in preload mode (default: cores / workers)
+torch_threads = int(os.environ.get("TORCH_NUM_THREADS", 0)) or max(1, multiprocessing.cpu_count() // workers)
+
+if preload_app:
+    # Workers forked from a process that ran multi-threaded OpenMP regions hang
+    # in their first torch op: the master runs torch single-threaded and every
+    # worker sets its own thread count in post_fork
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    # The master only loads and forks: shard pools (CATALOG_SHARDS) started
+    # while it loads the catalog would never be used, every worker starts its own
+    from app.utils import preload as _preload
+    _preload.defer_shard_pools()
 
 # Log settings
 loglevel = "info"
@@ -33,6 +54,14 @@ errorlog = "-"   # Log to stderr
 def on_starting(server):
     print("Starting Gunicorn server with memory optimization")
 
+# Master is ready to fork the workers
+def when_ready(server):
+    if preload_app:
+        # wait for the model load create_app started, then freeze the GC so the
+        # workers never write to the pages of the shared objects
+        from app.utils import preload
+        preload.prepare_fork()
+
 # Post-fork cleanup
 def post_fork(server, worker):
     # Import gc module
@@ -49,11 +78,18 @@ def post_fork(server, worker):
                 torch.cuda.empty_cache()
             # Disable gradient calculation for inference
             torch.set_grad_enabled(False)
+            if preload_app:
+                torch.set_num_threads(torch_threads)
             # Mark as configured
             os.environ['TORCH_ALREADY_CONFIGURED'] = '1'
     except ImportError:
         pass
 
+    # The master started no shard pool (CATALOG_SHARDS); the worker starts its own
+    if preload_app:
+        from app.utils import preload
+        preload.start_shard_pool()
+
 # Release memory between requests
 def pre_request(worker, req):
     import gc
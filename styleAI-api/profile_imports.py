@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Import-time profile of the StyleAI API
+Runs `python -X importtime` in a fresh interpreter and reports what each module costs to import
+
+Usage:
+    python profile_imports.py                      # import app and call create_app()
+    python profile_imports.py --modules torch embedding_match
+    python profile_imports.py --top 30 --budget-ms 500
+
+By default the profile covers the web startup path: importing the app package
+and create_app(), with MODEL_PRELOAD=0 so the background model load does not
+run and its imports do not mix into the startup profile. --modules profiles
+the given modules instead (the algorithms directory is on the path, so the
+algorithm modules can be named directly). With --budget-ms the command exits
+with status 1 when the total import time exceeds the budget.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+ALGORITHMS_DIR = os.path.join(API_DIR, 'app', 'utils', 'algorithms')
+
+STARTUP_CODE = "from app import create_app; create_app()"
+
+
+def run_importtime(code):
+    """Run code under -X importtime and return the (self_us, cumulative_us, depth, name) of every import"""
+    env = dict(os.environ)
+    env.setdefault('MODEL_PRELOAD', '0')
+    env['PYTHONPATH'] = os.pathsep.join([API_DIR, ALGORITHMS_DIR] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=API_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f"Profiled code failed with exit code {result.returncode}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return imports, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the StyleAI API")
+    parser.add_argument('--modules', nargs='+', help="modules to profile instead of the app startup")
+    parser.add_argument('--top', type=int, default=20, help="rows per table")
+    parser.add_argument('--budget-ms', type=float, help="fail when the total import time exceeds this")
+    args = parser.parse_args()
+
+    code = '; '.join(f"import {module}" for module in args.modules) if args.modules else STARTUP_CODE
+    imports, wall = run_importtime(code)
+    # importtime prints every import after its children; depth 0 are the ones the code triggered itself
+    total_ms = sum(cumulative for _, cumulative, depth, _ in imports if depth == 0) / 1000
+
+    print(f"Profiled: {code}")
+    print(f"Total import time: {total_ms:.1f} ms ({len(imports)} modules), process wall time: {wall * 1000:.0f} ms")
+
+    packages = defaultdict(lambda: [0, 0])
+    for self_us, _, _, name in imports:
+        package = packages[name.split('.')[0]]
+        package[0] += self_us
+        package[1] += 1
+    print("\n| package | self time (ms) | share | modules |")
+    print("|---|---|---|---|")
+    for name, (self_us, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"| {name} | {self_us / 1000:.1f} | {self_us / 10 / max(total_ms, 1e-9):.1f}% | {count} |")
+
+    print("\n| module | cumulative (ms) | self (ms) |")
+    print("|---|---|---|")
+    for self_us, cumulative_us, depth, name in sorted(imports, key=lambda item: -item[1])[:args.top]:
+        print(f"| {'  ' * depth}{name} | {cumulative_us / 1000:.1f} | {self_us / 1000:.1f} |")
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\nImport time {total_ms:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
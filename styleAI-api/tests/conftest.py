@@ -0,0 +1,90 @@
+"""
+Shared fixtures for the matching tests.
+
+The algorithm modules are flat files imported by name (as preload does), so
+the algorithms directory goes on sys.path, next to styleAI-api for the app
+package. Catalogs are small synthetic ones
+(see synthetic_catalog) shaped to reach the awkward cases: duplicated entries
+whose scores tie exactly, entries of unknown gender, entries sharing no
+attribute with the user, and the MAPPED_ATTRS cross comparisons.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALGORITHMS_DIR = os.path.join(API_DIR, "app", "utils", "algorithms")
+# the app package for the route tests, the algorithm modules by name
+for path in (API_DIR, ALGORITHMS_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from catalog_index import CatalogIndex, gender_layout  # noqa: E402
+from embedding_match import MAPPED_ATTRS  # noqa: E402
+from synthetic_catalog import SyntheticLooks, synthetic_attributes  # noqa: E402
+
+# catalog side of one MAPPED_ATTRS pair, scored against the user's differently named attribute
+MAPPED_USER_KEY, MAPPED_MODEL_KEY = next(iter(MAPPED_ATTRS.items()))
+
+
+def tied_catalog(looks, n, seed=1, grouped=True):
+    """
+    A synthetic catalog of ``n`` entries plus duplicates of a fifth of them.
+
+    Duplicates get identical vectors and aesthetic scores, so their scores tie
+    exactly and only the source order can separate them. A few entries have an
+    unknown gender and three carry no attribute at all. With ``grouped`` the
+    rows are laid out by gender like a catalog built from JSON; otherwise they
+    stay in source order with no ``source_rows``, like a pre-layout build.
+    """
+    base = looks.catalog(n, seed=seed)
+    rng = np.random.RandomState(seed)
+    # source order: every entry once plus the duplicates, shuffled together
+    entries = rng.permutation(np.concatenate([np.arange(n), rng.choice(n, n // 5, replace=False)]))
+    gender_codes = base.gender_codes[entries].copy()
+    gender_codes[rng.choice(len(entries), 7, replace=False)] = -1
+    empty = rng.choice(len(entries), 3, replace=False)
+
+    layout = gender_layout(gender_codes, 2) if grouped else np.arange(len(entries))
+    rows = entries[layout]
+    embeddings, masks = {}, {}
+    for attr in base.attributes:
+        masks[attr] = base.masks[attr][rows].copy()
+        masks[attr][np.isin(layout, empty)] = False
+        embeddings[attr] = np.where(masks[attr][:, None], base.embeddings[attr][rows], 0).astype(np.float32)
+    return CatalogIndex(np.array([f"entry_{source}.jpg" for source in layout], dtype=object),
+                        gender_codes[layout], base.gender_values, base.aesthetic_scores[rows],
+                        embeddings, masks, base.attribute_keys, base.attribute_key_mask[rows],
+                        normalized=True, source_rows=layout if grouped else None)
+
+
+def synthetic_users(looks, count, seed=2):
+    """
+    ``count`` (user_emb_dict, user_gender) pairs of mixed genders (some unknown)
+    with a few attributes dropped, each also carrying MAPPED_USER_KEY.
+    """
+    rng = np.random.RandomState(seed)
+    users = []
+    for user, (emb_dict, gender) in enumerate(looks.users(count, seed=seed)):
+        emb_dict = {attr: vector for attr, vector in emb_dict.items() if rng.random_sample() > 0.2}
+        emb_dict[MAPPED_USER_KEY] = looks.vectors(MAPPED_MODEL_KEY, np.array([rng.randint(looks.n_looks)]), rng)[0]
+        users.append((emb_dict, None if user % 5 == 4 else gender))
+    return users
+
+
+@pytest.fixture(scope="session")
+def looks():
+    return SyntheticLooks(dim=32, n_looks=6, attributes=synthetic_attributes() + [MAPPED_MODEL_KEY], seed=0)
+
+
+@pytest.fixture(scope="session")
+def catalog(looks):
+    return tied_catalog(looks, 400)
+
+
+@pytest.fixture(scope="session")
+def users(looks):
+    return synthetic_users(looks, 12)
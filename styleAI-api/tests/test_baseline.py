@@ -0,0 +1,112 @@
+"""
+match_catalog against the original algorithm, as it ran before the rewrite.
+
+test_scoring checks the vectorized scorer against a per-entry loop that
+shares its cosines (CatalogIndex.cosine), so it cannot catch a drift in the
+cosines themselves. Here the reference is the baseline top_matches: every
+entry scored on its own in float64 with sklearn's cosine_similarity, the
+results stably sorted by similarity, the top 5 stably re-sorted by aesthetic
+score. match_catalog must pick the same 5 entries in the same order, and its
+scores (float32 matrix products) must stay within SCORE_TOLERANCE of the
+float64 ones.
+"""
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from conftest import tied_catalog
+from embedding_match import GENDER_PENALTY, PENALTY_VALUE, THRESHOLD, TOP_K, WEIGHTS, match_catalog, score_catalog
+
+# float32 cosines against float64 ones, after squaring and weighting
+SCORE_TOLERANCE = 1e-5
+
+BASELINE_MAPPED_ATTRS = {
+    "Clothing Color Optimization Suggestions": "Clothing Color Description",
+    "Style Optimization and Temperament Enhancement Suggestions": "Style and Temperament Description",
+}
+
+
+def baseline_entries(catalog):
+    """The catalog as the baseline read it from JSON: one dict per entry, in source order."""
+    entries = []
+    # a catalog built without a gender layout keeps its rows in source order
+    order = np.arange(len(catalog)) if catalog.source_rows is None else np.argsort(catalog.source_rows)
+    for row in order:
+        embeddings = {attr: catalog.embeddings[attr][row].astype(np.float64).tolist()
+                      for attr in catalog.embeddings if catalog.masks[attr][row]}
+        entries.append({"row": int(row), "attribute_embeddings": embeddings,
+                        "gender": catalog.genders[row], "score": float(catalog.aesthetic_scores[row])})
+    return entries
+
+
+def adjusted(sim, weight):
+    squared_sim = sim ** 2
+    if weight == 1.0:
+        return squared_sim if squared_sim >= THRESHOLD else PENALTY_VALUE
+    return squared_sim
+
+
+def baseline_top_matches(user_emb_dict, entries, user_gender):
+    """(catalog row, similarity) of the baseline top 5, in the order it returned them."""
+    user_emb_dict = {attr: np.asarray(vector, dtype=np.float64) for attr, vector in user_emb_dict.items()}
+    results = []
+    for entry in entries:
+        model_emb_dict = entry["attribute_embeddings"]
+        common_attrs = set(user_emb_dict) & set(model_emb_dict)
+        if not common_attrs:
+            continue
+        pairs = [(attr, attr) for attr in common_attrs]
+        pairs += [(user_key, model_key) for user_key, model_key in BASELINE_MAPPED_ATTRS.items()
+                  if user_key in user_emb_dict and model_key in model_emb_dict]
+
+        total_weighted_similarity = 0.0
+        total_weight = 0.0
+        for user_key, model_key in pairs:
+            sim = cosine_similarity([user_emb_dict[user_key]], [np.array(model_emb_dict[model_key])])[0][0]
+            weight = WEIGHTS.get(user_key, 1.0)
+            total_weighted_similarity += weight * adjusted(sim, weight)
+            total_weight += weight
+
+        weighted_avg_similarity = total_weighted_similarity / total_weight if total_weight > 0 else 0
+        model_gender = entry["gender"]
+        gender_penalty = GENDER_PENALTY if user_gender and model_gender and user_gender != model_gender else 0.0
+        results.append({"row": entry["row"], "similarity": max(0, weighted_avg_similarity - gender_penalty),
+                        "score": entry["score"]})
+
+    results.sort(key=lambda x: x["similarity"], reverse=True)
+    top_5 = results[:5]
+    top_5.sort(key=lambda x: x["score"], reverse=True)
+    return [(result["row"], result["similarity"]) for result in top_5]
+
+
+@pytest.fixture(autouse=True)
+def exact_scoring(monkeypatch):
+    """match_catalog scores the whole catalog in-process, like the baseline."""
+    monkeypatch.setenv("CATALOG_ANN", "off")
+    monkeypatch.setenv("CATALOG_SHARDS", "0")
+
+
+@pytest.fixture(scope="module", params=["grouped", "source_order"])
+def baseline_catalog(request, looks):
+    """
+    Tied catalogs laid out by gender and left in source order; smaller than
+    the shared fixture, the baseline makes one sklearn call per comparison.
+    """
+    grouped = request.param == "grouped"
+    return tied_catalog(looks, 100, seed=1 if grouped else 5, grouped=grouped)
+
+
+@pytest.mark.parametrize("user", range(12))
+def test_top_matches_equal_baseline(baseline_catalog, users, user):
+    user_emb_dict, user_gender = users[user]
+    expected = baseline_top_matches(user_emb_dict, baseline_entries(baseline_catalog), user_gender)
+
+    rows = match_catalog(user_emb_dict, baseline_catalog, user_gender)[:TOP_K]
+    assert TOP_K == 5
+    # the same five entries, in the same aesthetic order
+    assert rows.tolist() == [row for row, _ in expected]
+
+    similarity, valid = score_catalog(baseline_catalog.prepare_query(user_emb_dict), baseline_catalog, user_gender)
+    assert valid[rows].all()
+    np.testing.assert_allclose(similarity[rows], [score for _, score in expected], rtol=0, atol=SCORE_TOLERANCE)
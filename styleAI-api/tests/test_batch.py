@@ -0,0 +1,45 @@
+"""
+match_catalog_batch against match_catalog one user at a time.
+
+The batch scores many users with one matrix product and re-scores each
+user's shortlist exactly, so every user of a mixed-gender batch must get
+the same rows, in the same order, as a match_catalog call of their own.
+"""
+
+import pytest
+
+import embedding_match
+from catalog_compression import CompressedCatalog
+from conftest import synthetic_users
+from embedding_match import match_catalog, match_catalog_batch
+
+
+@pytest.fixture
+def batch_users(looks):
+    users = synthetic_users(looks, 40, seed=11)
+    # men, women and unknown genders in one batch
+    assert len({user_gender for _, user_gender in users}) == 3
+    return users
+
+
+@pytest.fixture(autouse=True)
+def exact_scoring(monkeypatch):
+    """match_catalog scores the whole catalog in-process, like the batch."""
+    monkeypatch.setenv("CATALOG_ANN", "off")
+    monkeypatch.setenv("CATALOG_SHARDS", "0")
+
+
+@pytest.mark.parametrize("block", [embedding_match.MATCH_BATCH_USERS, 7])
+@pytest.mark.parametrize("kind", ["float32", "int8"])
+def test_batch_matches_single_user(catalog, batch_users, monkeypatch, block, kind):
+    if kind == "int8":
+        catalog = CompressedCatalog.compress(catalog, "int8", rescore=50)
+    # a block size that does not divide the batch exercises the last, partial block
+    monkeypatch.setattr(embedding_match, "MATCH_BATCH_USERS", block)
+    user_emb_dicts = [user_emb_dict for user_emb_dict, _ in batch_users]
+    user_genders = [user_gender for _, user_gender in batch_users]
+
+    results = match_catalog_batch(user_emb_dicts, catalog, user_genders)
+    assert len(results) == len(batch_users)
+    for i, (user_emb_dict, user_gender) in enumerate(batch_users):
+        assert results[i].tolist() == match_catalog(user_emb_dict, catalog, user_gender).tolist()
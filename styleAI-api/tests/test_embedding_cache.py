@@ -0,0 +1,78 @@
+"""
+The embedding cache key of a model.
+
+Entries must follow the model's weights, backend and depth, never its id():
+a reloaded copy of the same snapshot reuses them, a swapped model or a model
+allocated where a freed one lived never reads them.
+"""
+
+import gc
+
+import numpy as np
+import pytest
+
+import embedding_match
+from embedding_match import _model_cache_key, generate_embeddings
+
+
+class FakeModel:
+    """Just enough of a HuggingFace model for embedding_layers."""
+
+    def __init__(self, n_layers=6, weights=None, backend="fp32"):
+        self.transformer = type("Transformer", (), {"layer": [None] * n_layers})()
+        if weights is not None:
+            self._weights_identity = weights
+            self._embedding_backend = backend
+
+
+class CountingBatcher:
+    def __init__(self, value):
+        self.value = value
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded += texts
+        return np.full((len(texts), 4), self.value, dtype=np.float32)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    embedding_match.get_embedding_cache().clear()
+    yield
+    embedding_match.get_embedding_cache().clear()
+
+
+def test_loaded_models_keyed_on_weights_backend_and_depth():
+    key = _model_cache_key(FakeModel(weights="snapshot:a"))
+    assert _model_cache_key(FakeModel(weights="snapshot:a")) == key
+    assert _model_cache_key(FakeModel(weights="snapshot:b")) != key
+    assert _model_cache_key(FakeModel(weights="snapshot:a", backend="int8")) != key
+    assert _model_cache_key(FakeModel(3, weights="snapshot:a")) != key
+
+
+def test_unknown_models_never_share_a_key():
+    seen = set()
+    for _ in range(50):
+        # freed right away, so CPython hands the next model the same address
+        model = FakeModel()
+        key = _model_cache_key(model)
+        assert _model_cache_key(model) == key
+        assert key not in seen
+        seen.add(key)
+        del model
+        gc.collect()
+
+
+def test_swapped_model_misses_the_cache():
+    texts = ["Slim", "oval  face"]
+    first = CountingBatcher(1.0)
+    assert (generate_embeddings(texts, None, FakeModel(weights="snapshot:a"), "cpu", first) == 1.0).all()
+
+    # the same snapshot loaded again: served from the cache
+    reloaded = CountingBatcher(2.0)
+    assert (generate_embeddings(texts, None, FakeModel(weights="snapshot:a"), "cpu", reloaded) == 1.0).all()
+    assert reloaded.embedded == []
+
+    swapped = CountingBatcher(3.0)
+    assert (generate_embeddings(texts, None, FakeModel(weights="snapshot:b"), "cpu", swapped) == 3.0).all()
+    assert swapped.embedded == ["slim", "oval face"]
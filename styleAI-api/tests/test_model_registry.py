@@ -0,0 +1,99 @@
+"""
+Recovering from a failed load.
+
+A failed load is not final: once the backoff has passed, the next request
+loads again, and the backoff doubles with every consecutive failure. A module
+that failed to import is not remembered either.
+"""
+
+import sys
+import time
+
+from app.utils import preload
+from app.utils.model_registry import FAILED, READY, ModelRegistry
+
+
+class FlakyLoader:
+    """Fails the first `failures` loads, then returns its resources."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, registry):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError(f"load {self.calls} failed")
+        return {"model": "loaded"}
+
+
+def test_failed_load_retries_after_backoff():
+    registry = ModelRegistry("test", retry_seconds=0.2)
+    loader = FlakyLoader(failures=2)
+
+    assert registry.load(loader) is None
+    assert registry.state == FAILED and registry.failures == 1
+    # within the backoff: the failure is returned as is, nothing is loaded
+    assert registry.load(loader) is None and loader.calls == 1
+    assert 0 < registry.status()["retry_in"] <= 0.2
+
+    time.sleep(0.25)
+    assert registry.load(loader) is None
+    assert loader.calls == 2 and registry.failures == 2
+    # the second failure doubles the backoff
+    assert 0.2 < registry.retry_in <= 0.4
+
+    time.sleep(0.45)
+    registry.start_background(loader)
+    assert registry.wait(5)
+    assert loader.calls == 3 and registry.resources == {"model": "loaded"}
+    assert registry.failures == 0 and registry.error is None and registry.retry_in is None
+
+
+def test_backoff_is_capped():
+    registry = ModelRegistry("test", retry_seconds=0.1, max_retry_seconds=0.15)
+    loader = FlakyLoader(failures=3)
+    registry.load(loader)
+    time.sleep(0.15)
+    registry.load(loader)
+    time.sleep(0.2)
+    registry.load(loader)
+    assert registry.failures == 3 and registry.retry_in <= 0.15
+
+
+def test_no_retry_without_backoff():
+    registry = ModelRegistry("test")
+    loader = FlakyLoader(failures=1)
+    registry.load(loader)
+    registry.start_background(loader)
+    assert registry.load(loader) is None
+    assert loader.calls == 1 and registry.state == FAILED and registry.retry_in is None
+
+
+def test_ready_registry_loads_once():
+    registry = ModelRegistry("test", retry_seconds=0.01)
+    loader = FlakyLoader(failures=0)
+    registry.load(loader)
+    registry.start_background(loader)
+    assert registry.load(loader) == {"model": "loaded"}
+    assert loader.calls == 1 and registry.state == READY
+
+
+def test_failed_import_is_not_cached(tmp_path, monkeypatch):
+    # a module whose import fails until its environment is there
+    (tmp_path / "late_algorithm.py").write_text(
+        "import os\nVALUE = int(os.environ['LATE_ALGORITHM_VALUE'])\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(preload, "_algorithm_modules", {})
+    monkeypatch.delenv("LATE_ALGORITHM_VALUE", raising=False)
+
+    try:
+        assert preload.import_module("late_algorithm") is None
+        assert "late_algorithm" not in preload._algorithm_modules
+
+        monkeypatch.setenv("LATE_ALGORITHM_VALUE", "1")
+        module = preload.import_module("late_algorithm")
+        assert module is not None and module.VALUE == 1
+        assert preload.import_module("late_algorithm") is module
+    finally:
+        sys.modules.pop("late_algorithm", None)
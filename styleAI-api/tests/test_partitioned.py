@@ -0,0 +1,157 @@
+"""
+score_catalog_partitioned against score_catalog.
+
+Pruning may leave rows unscored, but never one that belongs in the top k:
+the top k positions (ties broken by source_rows) and their scores must be
+exactly those of scoring every row.
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from catalog_ann import IVFIndex
+from catalog_index import METADATA_FILE, CatalogIndex
+from conftest import MAPPED_MODEL_KEY, tied_catalog
+from embedding_match import _prune_by_bound, _take, _top_positions, score_catalog, score_catalog_partitioned
+from synthetic_catalog import SyntheticLooks, synthetic_attributes
+
+
+def users_like_rows(catalog, count, seed=7):
+    """
+    Users close to catalog entries of the other gender, so penalized rows
+    compete for the top k and the pruning bound decides at the cutoff.
+    """
+    rng = np.random.RandomState(seed)
+    users = []
+    for row in rng.choice(np.flatnonzero(catalog.gender_codes >= 0), count, replace=False):
+        emb_dict = {attr: matrix[row] + rng.standard_normal(catalog.dim).astype(np.float32) * 0.02
+                    for attr, matrix in catalog.embeddings.items() if catalog.masks[attr][row]}
+        users.append((emb_dict, catalog.gender_values[1 - catalog.gender_codes[row]]))
+    return users
+
+
+def assert_same_top(catalog, query, user_gender, rows, k):
+    order = _take(catalog.source_rows, rows)
+    full_similarity, full_valid = score_catalog(query, catalog, user_gender, rows)
+    similarity, valid = score_catalog_partitioned(query, catalog, user_gender, rows, k)
+
+    expected = _top_positions(full_similarity, full_valid, k, order)
+    top = _top_positions(similarity, valid, k, order)
+    assert top.tolist() == expected.tolist()
+    assert similarity[top].tolist() == full_similarity[expected].tolist()
+    # scored rows keep their exact score, unscored rows are never ranked
+    assert (similarity[valid] == full_similarity[valid]).all()
+    assert not (valid & ~full_valid).any()
+    return valid
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+@pytest.mark.parametrize("user", range(12))
+def test_whole_catalog(catalog, users, user, k):
+    user_emb_dict, user_gender = users[user]
+    assert_same_top(catalog, catalog.prepare_query(user_emb_dict), user_gender, None, k)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+@pytest.mark.parametrize("user", range(12))
+def test_ann_shortlist(catalog, users, user, k):
+    ann = IVFIndex.build(catalog, n_clusters=12, n_probe=3, min_candidates=60, projection_dim=8)
+    user_emb_dict, user_gender = users[user]
+    query = catalog.prepare_query(user_emb_dict)
+    rows = ann.shortlist(query)
+    assert rows is not None and 0 < len(rows) < len(catalog)
+    assert_same_top(catalog, query, user_gender, rows, k)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_sparse_row_subset(catalog, users, k):
+    rng = np.random.RandomState(4)
+    for user_emb_dict, user_gender in users:
+        rows = np.sort(rng.choice(len(catalog), 90, replace=False))
+        assert_same_top(catalog, catalog.prepare_query(user_emb_dict), user_gender, rows, k)
+
+
+@pytest.fixture(scope="module")
+def spread_catalog():
+    """Few entries per look, so an entry of the other gender can still be the best match."""
+    looks = SyntheticLooks(dim=32, n_looks=200, attributes=synthetic_attributes() + [MAPPED_MODEL_KEY], seed=8)
+    return tied_catalog(looks, 400, seed=8)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_penalized_rows_in_top(spread_catalog, k):
+    catalog = spread_catalog
+    reached = 0
+    for user_emb_dict, user_gender in users_like_rows(catalog, 30):
+        query = catalog.prepare_query(user_emb_dict)
+        valid = assert_same_top(catalog, query, user_gender, None, k)
+        similarity, valid = score_catalog_partitioned(query, catalog, user_gender, None, k)
+        reached += int(catalog.gender_mismatch(user_gender)[_top_positions(similarity, valid, k,
+                                                                              catalog.source_rows)].any())
+    assert reached > 0
+
+
+def test_bound_keeps_rows_at_the_cutoff(spread_catalog, users):
+    """Every penalized row scoring at least the cutoff survives, also when it ties the cutoff exactly."""
+    catalog = spread_catalog
+    rng = np.random.RandomState(9)
+    pruned = 0
+    for user_emb_dict, user_gender in users_like_rows(catalog, 10) + [user for user in users if user[1]]:
+        query = catalog.prepare_query(user_emb_dict)
+        penalized = catalog.gender_partitions(user_gender)[1]
+        rows = np.arange(len(catalog))[penalized]
+        similarity, valid = score_catalog(query, catalog, user_gender, rows)
+        for cutoff in rng.choice(similarity[valid], 10):
+            survivors = _prune_by_bound(query, catalog, penalized, cutoff)
+            kept = np.isin(rows, np.arange(len(catalog))[survivors])
+            assert kept[valid & (similarity >= cutoff)].all()
+            pruned += int((~kept).sum())
+    assert pruned > 0
+
+
+def test_pruning_skips_rows(catalog, users):
+    """The bound actually prunes here, so the tests above exercise it."""
+    skipped = 0
+    for user_emb_dict, user_gender in users:
+        if user_gender is None:
+            continue
+        valid = assert_same_top(catalog, catalog.prepare_query(user_emb_dict), user_gender, None, 5)
+        full_valid = score_catalog(catalog.prepare_query(user_emb_dict), catalog, user_gender)[1]
+        skipped += int((full_valid & ~valid).sum())
+    assert skipped > 0
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_ties_resolved_by_source_rows(looks, users, k):
+    """Exact ties at the cutoff keep source order whichever partition holds the rows."""
+    catalog = tied_catalog(looks, 60, seed=5)
+    # every entry duplicated: each score appears at least twice
+    doubled = CatalogIndex(np.concatenate([catalog.images] * 2), np.concatenate([catalog.gender_codes] * 2),
+                           catalog.gender_values, np.concatenate([catalog.aesthetic_scores] * 2),
+                           {attr: np.concatenate([matrix] * 2) for attr, matrix in catalog.embeddings.items()},
+                           {attr: np.concatenate([mask] * 2) for attr, mask in catalog.masks.items()},
+                           catalog.attribute_keys, np.concatenate([catalog.attribute_key_mask] * 2),
+                           normalized=True,
+                           source_rows=np.concatenate([catalog.source_rows * 2 + 1, catalog.source_rows * 2]))
+    for user_emb_dict, user_gender in users:
+        assert_same_top(doubled, doubled.prepare_query(user_emb_dict), user_gender, None, k)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_legacy_binary_without_source_rows(looks, users, tmp_path, k):
+    """Binary catalogs written before the gender layout: source order, no source_rows."""
+    path = os.path.join(tmp_path, "catalog_bin")
+    tied_catalog(looks, 300, seed=6, grouped=False).save(path)
+    with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as f:
+        metadata = json.load(f)
+    del metadata["source_rows"]
+    with open(os.path.join(path, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+
+    catalog = CatalogIndex.load(path)
+    assert catalog.source_rows.tolist() == list(range(len(catalog)))
+    for user_emb_dict, user_gender in users:
+        assert_same_top(catalog, catalog.prepare_query(user_emb_dict), user_gender, None, k)
@@ -0,0 +1,92 @@
+"""
+The personalized routes with the lexical matching backend.
+
+MATCH_BACKEND=lexical is a configured backend, not a fallback: with
+LEXICAL_FALLBACK=0 it must still match, over a small JSON catalog here, while
+the database and the outfit generation (external services) are replaced.
+"""
+
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from app import create_app
+from app.routes import personalized
+from app.utils import preload
+from app.utils.model_registry import ModelRegistry
+
+import lexical_match
+
+STYLES = ["formal classic suit", "casual street wear", "one-piece summer dress", "business formal blazer"]
+BODIES = ["slim build with long limbs", "broad shoulders and sturdy frame", "petite frame", "tall and lean"]
+
+
+def entry_text(row, gender):
+    return json.dumps({
+        "Semantic Features": {"Intrinsic Features": {"Gender": gender}},
+        "Structural Features": {"Body Features": {"Body Type and Curve Characteristics": BODIES[row % 4]}},
+        "Style Features": {"Style Keywords": STYLES[row % 4], "Occasion": ["Office", "Party"][row % 2]},
+        "Scoring": {"Aesthetic Score": 6 + row % 3},
+    })
+
+
+@pytest.fixture
+def json_catalog(tmp_path):
+    """A JSON catalog of 8 entries whose images exist, as the lexical backend reads it."""
+    entries = []
+    for row in range(8):
+        image = tmp_path / f"look_{row}.jpg"
+        image.write_bytes(b"")
+        text = entry_text(row, ["Male", "Female"][row % 2])
+        # the lexical backend only reads the texts; the vectors just have to be present
+        embeddings = {attr: [1.0, float(row)] for attr in (
+            "Structural Features.Body Features.Body Type and Curve Characteristics",
+            "Style Features.Style Keywords", "Style Features.Occasion")}
+        entries.append({"image": str(image), "attribute_embeddings": embeddings,
+                        "result": {"data": {"outputs": {"text": text}}}})
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(entries), encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def client(json_catalog, monkeypatch):
+    monkeypatch.setenv("MATCH_BACKEND", "lexical")
+    monkeypatch.setenv("LEXICAL_FALLBACK", "0")
+    monkeypatch.setenv("CATALOG_PATH", json_catalog)
+    monkeypatch.setenv("MODEL_PRELOAD", "0")
+    monkeypatch.setenv("MODEL_WARMUP", "0")
+    # a fresh process as far as the loaded resources go
+    monkeypatch.setattr(preload, "_registry", ModelRegistry("模型"))
+    monkeypatch.setattr(preload, "_warmup_registry", ModelRegistry("预热"))
+    monkeypatch.setattr(lexical_match, "_lexical_catalog", None)
+
+    image = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(image, format="JPEG")
+    job = {"uploaded_image": image.getvalue(), "target_description": entry_text(2, "Male")}
+    monkeypatch.setattr(personalized, "get_job_by_id", lambda job_id: job)
+    monkeypatch.setattr(personalized, "update_job_best_fit", lambda job_id, data: True)
+    generated = []
+
+    def generate_outfit_image(user_image_path, garment_image_path):
+        generated.append(garment_image_path)
+        return True, "ok", b"outfit"
+
+    monkeypatch.setattr(personalized, "generate_outfit_image", generate_outfit_image)
+    client = create_app().test_client()
+    client.generated = generated
+    return client
+
+
+@pytest.mark.parametrize("route", ["generate-best-fit", "wear-suit-pictures"])
+def test_lexical_backend_without_fallback(client, json_catalog, route):
+    response = client.post(f"/api/personalized/{route}", json={"jobId": "job-1"})
+
+    body = response.get_json()
+    assert response.status_code == 200, body
+    assert body["status"] == "success" and not body.get("is_mock_data")
+    # matched over the catalog: an image of the JSON catalog went to the outfit generation
+    assert len(client.generated) == 1 and client.generated[0].startswith(json_catalog.rsplit("/", 1)[0])
+    assert preload.get_model_resources()["model"] is None
@@ -0,0 +1,105 @@
+"""
+score_catalog and rank_matches against the original per-entry loop.
+
+The reference below is the loop embedding_match.top_matches ran before the
+catalog was scored with matrix products: entries in source order, common
+attributes then the MAPPED_ATTRS pairs, the THRESHOLD/PENALTY_VALUE rule, the
+gender penalty, a stable sort by similarity and a stable re-sort of the top
+by aesthetic score. Cosines come from CatalogIndex.cosine for both sides and
+are summed in the same order, so scores must match exactly, not to a tolerance.
+"""
+
+import numpy as np
+import pytest
+
+from embedding_match import (GENDER_PENALTY, MAPPED_ATTRS, PENALTY_VALUE, THRESHOLD, TOP_K, WEIGHTS,
+                             _top_positions, rank_matches, score_catalog)
+
+
+def reference_scores(user_emb_dict, catalog, user_gender):
+    """(catalog row, similarity) of every entry sharing an attribute with the user, in source order."""
+    query = catalog.prepare_query(user_emb_dict)
+    cosines = {}
+
+    def cosine(user_key, model_key, row):
+        if (user_key, model_key) not in cosines:
+            cosines[user_key, model_key] = catalog.cosine(model_key, query[user_key])
+        return cosines[user_key, model_key][row]
+
+    genders = catalog.genders
+    results = []
+    for row in np.argsort(catalog.source_rows):
+        common = [attr for attr in query if attr in catalog.embeddings and catalog.masks[attr][row]]
+        if not common:
+            continue
+        pairs = [(attr, attr) for attr in common]
+        pairs += [(user_key, model_key) for user_key, model_key in MAPPED_ATTRS.items()
+                  if user_key in query and model_key in catalog.embeddings and catalog.masks[model_key][row]]
+
+        total_weighted_similarity = 0.0
+        total_weight = 0.0
+        for user_key, model_key in pairs:
+            squared_sim = cosine(user_key, model_key, row) ** 2
+            weight = WEIGHTS.get(user_key, 1.0)
+            if weight == 1.0:
+                adjusted_sim = squared_sim if squared_sim >= THRESHOLD else PENALTY_VALUE
+            else:
+                adjusted_sim = squared_sim
+            total_weighted_similarity += weight * adjusted_sim
+            total_weight += weight
+
+        weighted_avg_similarity = total_weighted_similarity / total_weight if total_weight > 0 else 0
+        gender_penalty = GENDER_PENALTY if user_gender and genders[row] and user_gender != genders[row] else 0.0
+        results.append((int(row), max(0, weighted_avg_similarity - gender_penalty)))
+    return results
+
+
+def reference_ranking(results, catalog, k):
+    top = sorted(results, key=lambda result: result[1], reverse=True)[:k]
+    top.sort(key=lambda result: catalog.aesthetic_scores[result[0]], reverse=True)
+    return [row for row, _ in top]
+
+
+@pytest.mark.parametrize("user", range(12))
+def test_scores_match_reference_loop(catalog, users, user):
+    user_emb_dict, user_gender = users[user]
+    results = reference_scores(user_emb_dict, catalog, user_gender)
+    similarity, valid = score_catalog(catalog.prepare_query(user_emb_dict), catalog, user_gender)
+
+    scored = [row for row, _ in results]
+    assert valid.sum() == len(scored) and valid[scored].all()
+    assert similarity[scored].tolist() == [score for _, score in results]
+
+
+@pytest.mark.parametrize("k", [1, TOP_K, 50, 10000])
+@pytest.mark.parametrize("user", range(12))
+def test_ranking_matches_reference_loop(catalog, users, user, k):
+    user_emb_dict, user_gender = users[user]
+    results = reference_scores(user_emb_dict, catalog, user_gender)
+    similarity, valid = score_catalog(catalog.prepare_query(user_emb_dict), catalog, user_gender)
+
+    assert rank_matches(similarity, valid, catalog, k).tolist() == reference_ranking(results, catalog, k)
+    # the similarity order alone, ties broken by source position
+    expected = [row for row, _ in sorted(results, key=lambda result: result[1], reverse=True)[:k]]
+    assert _top_positions(similarity, valid, k, catalog.source_rows).tolist() == expected
+
+
+def test_catalog_has_ties_and_penalties(catalog, users):
+    """The fixture reaches the cases the ranking tests are about."""
+    user_emb_dict, user_gender = users[0]
+    results = reference_scores(user_emb_dict, catalog, user_gender)
+    scores = [score for _, score in results]
+    assert len(scores) - len(set(scores)) >= 10
+    assert len(results) < len(catalog)
+    assert catalog.gender_mismatch(user_gender).any() and (catalog.gender_codes < 0).any()
+
+
+def test_scores_restricted_rows(catalog, users):
+    """Scoring a row subset gives the full scores of those rows."""
+    user_emb_dict, user_gender = users[1]
+    query = catalog.prepare_query(user_emb_dict)
+    rows = np.sort(np.random.RandomState(3).choice(len(catalog), 97, replace=False))
+    full_similarity, full_valid = score_catalog(query, catalog, user_gender)
+    similarity, valid = score_catalog(query, catalog, user_gender, rows)
+    assert similarity.tolist() == full_similarity[rows].tolist()
+    assert valid.tolist() == full_valid[rows].tolist()
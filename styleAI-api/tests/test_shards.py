@@ -0,0 +1,103 @@
+"""
+Sharded scatter-gather scoring against in-process match_catalog.
+
+A pool of three forked workers over a catalog whose row count is not a
+multiple of three must return exactly the single-process top k, for the
+float32 index and for an int8 catalog re-scored at full precision, and its
+workers must exit on their own once the pool is closed.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import catalog_shards
+from catalog_compression import CompressedCatalog
+from conftest import tied_catalog
+from embedding_match import match_catalog, shard_candidates
+
+N_SHARDS = 3
+
+
+@pytest.fixture(scope="module")
+def shard_catalog(looks):
+    catalog = tied_catalog(looks, 401, seed=10)
+    assert len(catalog) % N_SHARDS
+    return catalog
+
+
+@pytest.fixture
+def sharding(monkeypatch):
+    """Turn sharding on for catalogs of any size; closes the pools the test started."""
+    monkeypatch.setenv("CATALOG_SHARDS", str(N_SHARDS))
+    monkeypatch.setenv("CATALOG_SHARD_MIN_ROWS", "0")
+    started = []
+
+    def pool_for(catalog):
+        pool = catalog_shards.get_shard_pool(catalog, shard_candidates)
+        started.append(catalog)
+        return pool
+
+    yield pool_for
+    for catalog in started:
+        pool = catalog_shards._shard_pools.pop(catalog, None)
+        if pool:
+            pool.close()
+
+
+def in_process(monkeypatch, catalog, users):
+    monkeypatch.setenv("CATALOG_SHARDS", "0")
+    expected = [match_catalog(user_emb_dict, catalog, user_gender).tolist() for user_emb_dict, user_gender in users]
+    monkeypatch.setenv("CATALOG_SHARDS", str(N_SHARDS))
+    return expected
+
+
+@pytest.mark.parametrize("kind", ["float32", "int8"])
+def test_sharded_top_k_matches_in_process(shard_catalog, users, monkeypatch, sharding, kind):
+    catalog = shard_catalog if kind == "float32" else CompressedCatalog.compress(shard_catalog, "int8", rescore=20)
+    expected = in_process(monkeypatch, catalog, users)
+
+    pool = sharding(catalog)
+    assert pool is not None and pool.pid == os.getpid()
+    assert sorted(stop - start for start, stop in pool.bounds) == [160, 160, 161]
+    for (user_emb_dict, user_gender), rows in zip(users, expected):
+        assert match_catalog(user_emb_dict, catalog, user_gender).tolist() == rows
+    # no worker failed and fell back to in-process scoring
+    assert catalog_shards._shard_pools[catalog] is pool
+
+
+def test_filtered_rows(shard_catalog, users, monkeypatch, sharding):
+    """A row selection spanning the shard boundaries is split and gathered back in catalog rows."""
+    rows = catalog_shards.shard_bounds(len(shard_catalog), N_SHARDS)
+    selection = sorted({row for start, _ in rows for row in range(max(0, start - 7), start + 40)})
+    selection = np.array(selection)
+    monkeypatch.setenv("CATALOG_SHARDS", "0")
+    expected = [match_catalog(u, shard_catalog, g, selection).tolist() for u, g in users]
+    monkeypatch.setenv("CATALOG_SHARDS", str(N_SHARDS))
+
+    assert sharding(shard_catalog) is not None
+    assert [match_catalog(u, shard_catalog, g, selection).tolist() for u, g in users] == expected
+
+
+def test_pool_shuts_down(shard_catalog, users, sharding):
+    pool = sharding(shard_catalog)
+    user_emb_dict, user_gender = users[0]
+    match_catalog(user_emb_dict, shard_catalog, user_gender)
+    processes = list(pool._processes)
+    assert all(process.is_alive() for process in processes)
+
+    pool.close()
+    # closing the pipes ends every worker loop; none had to be terminated
+    assert [process.exitcode for process in processes] == [0] * N_SHARDS
+
+
+def test_deferred_process_starts_no_pool(shard_catalog, monkeypatch, sharding):
+    """A preloading gunicorn master defers its pools; the workers it forks start their own."""
+    monkeypatch.setattr(catalog_shards, "_deferred_pid", None)
+    catalog_shards.defer_shard_pools()
+    assert sharding(shard_catalog) is None and shard_catalog not in catalog_shards._shard_pools
+
+    # as seen from a process forked afterwards
+    monkeypatch.setattr(catalog_shards, "_deferred_pid", os.getpid() + 1)
+    assert sharding(shard_catalog) is not None